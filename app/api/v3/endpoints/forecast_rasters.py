@@ -1,18 +1,86 @@
-from fastapi import APIRouter, HTTPException, Query, Response, Request
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Literal
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, Response, Request
+from fastapi.responses import FileResponse, StreamingResponse
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Optional, Literal, Tuple, Union
+from email.utils import formatdate
 from pathlib import Path
+import hashlib
 import os
-from app.models.forecast import ForecastResponse, ForecastRequestModel, ForecastFile
+import stat
+from app.models.forecast import (
+    ForecastFile,
+    ForecastManifest,
+    ForecastManifestModel,
+    ForecastManifestSeries,
+    ForecastResponse,
+    ForecastRequestModel,
+    PointForecast,
+    PointForecastRequestModel,
+    PointForecastResponse,
+    PointForecastValue,
+    VelocitySubsetRequestModel,
+)
 from app.utils.error import handle_validation_error
+from app.utils.encoding import (
+    available_reencodings,
+    can_reencode,
+    encode_sibling,
+    fresh_reencodings,
+    is_fresh,
+    iter_gunzip,
+    remove_orphans,
+    sibling_path,
+)
+from app.utils.cache import LRUCache, Signature, signature
+from app.utils.executor import iterate_blocking, run_blocking
+from app.utils.forecast_catalog import CatalogDirectory, ForecastCatalog
 from loguru import logger
 from app.utils.path import safe_join
+from app.utils.response import (
+    ETAG_SUFFIXES,
+    RenderedPayload,
+    is_not_modified,
+    parse_accept_encoding,
+    payload_response,
+    render_payload,
+    select_encoding,
+)
+from app.utils.velocity import (
+    VELOCITY_DERIVED_SUFFIXES,
+    VelocityGrid,
+    binary_path,
+    encode_velocity,
+    encode_velocity_binary,
+    load_velocity,
+    parse_bbox,
+    sample_bilinear,
+    snap_bbox,
+    stride_for_zoom,
+    subset_velocity,
+    wind_components,
+    wind_speed_direction,
+    write_velocity_binary,
+)
 
 router = APIRouter()
 
 # Base directory where your forecast files are stored
 BASE_DIR = Path("./data/forecast")
 
+forecast_catalog = ForecastCatalog(BASE_DIR)
+
+# Decoded velocity files, by file version (a few MB each for the model grids)
+velocity_grids = LRUCache(
+    maxsize=int(os.getenv("SWI_METOBS_BACKEND_VELOCITY_GRID_CACHE", "64"))
+)
+# Subsets of the velocity files, by file version, bounding box tile and stride
+velocity_subsets = LRUCache(maxsize=256)
+# Binary velocity files rendered in memory, when they cannot be written next
+# to the velocity files, by file version
+velocity_binaries = LRUCache(maxsize=64)
+# The rendered manifest, by signatures of the model directories
+manifest_cache = LRUCache(maxsize=1)
+
 
 def get_files_for_variable(
     variable: str,
@@ -23,63 +91,236 @@ def get_files_for_variable(
 ) -> List[Dict[str, str]]:
     """
     Returns a list of files (COG or velocity) for the given variable, models, and hour range.
+    The files are looked up in the forecast catalog, by model then by valid time.
     """
-    files = []
     now = datetime.utcnow()
 
     # Calculate the time range
     start_time = now + timedelta(hours=start_hour)
     end_time = now + timedelta(hours=end_hour)
 
-    # If no models are specified, use all available models
-    if models is None:
-        models = [d for d in os.listdir(BASE_DIR) if (BASE_DIR / d).is_dir()]
+    return forecast_catalog.files(variable, models, file_type, start_time, end_time)
+
+
+def build_manifest(
+    directories: Dict[Tuple[str, str], CatalogDirectory],
+) -> ForecastManifest:
+    """Build the manifest of the forecast files from the catalog listings."""
+    models: Dict[str, List[ForecastManifestSeries]] = {}
+    for (model, file_type), directory in sorted(directories.items()):
+        series = models.setdefault(model, [])
+        for name, catalog_series in sorted(directory.series.items()):
+            updated_at = datetime.fromtimestamp(catalog_series.updated_at, timezone.utc)
+            series.append(
+                ForecastManifestSeries(
+                    name=name,
+                    file_type=file_type,
+                    updated_at=updated_at.isoformat(),
+                    timestamps=[file.timestamp for file in catalog_series.files],
+                    file_paths=[file.file_path for file in catalog_series.files],
+                )
+            )
+    return ForecastManifest(
+        models=[
+            ForecastManifestModel(model=model, series=series)
+            for model, series in models.items()
+        ]
+    )
+
+
+def get_manifest() -> RenderedPayload:
+    """
+    Returns the rendered manifest of the forecast files, blocking.
+
+    It is rendered again only when a model directory changed, and its ETag
+    is a hash of its content.
+    """
+    directories = forecast_catalog.directories()
+    key = tuple(
+        (model_type, directory.signature)
+        for model_type, directory in sorted(directories.items())
+    )
+    payload = manifest_cache.get(key)
+    if payload is None:
+        manifest = build_manifest(directories)
+        payload = render_payload(manifest.model_dump_json().encode())
+        manifest_cache.put(key, payload)
+    return payload
+
+
+def get_velocity_grids(
+    file_path: Path, version: Optional[Signature] = None
+) -> List[VelocityGrid]:
+    """
+    Returns the decoded grids of a velocity file, blocking.
+
+    The grids are decoded once per version (mtime, size, inode) of the file.
+    """
+    if version is None:
+        version = signature(file_path)
+    key = (str(file_path), version)
+    grids = velocity_grids.get(key)
+    if grids is None:
+        grids = load_velocity(file_path)
+        velocity_grids.put(key, grids)
+    return grids
+
 
-    for model in models:
-        model_dir = safe_join(BASE_DIR, model, file_type, relative=True)
-        # model_dir = BASE_DIR / model / file_type
-        if not model_dir.exists():
+def sample_point_forecast(
+    files: List[ForecastFile], variable: str, lat: float, lon: float
+) -> List[PointForecast]:
+    """
+    Returns the wind at a location for each velocity file, blocking.
+
+    The U and V components are interpolated bilinearly, the speed and
+    direction derived from them. The models whose grids do not cover the
+    location are left out.
+    """
+    values: Dict[str, List[PointForecastValue]] = {}
+    for file in files:
+        file_path = safe_join(BASE_DIR, file.model, "velocity", file.file_path)
+        try:
+            u_grid, v_grid = wind_components(get_velocity_grids(file_path))
+        except FileNotFoundError:
+            # Removed since it was listed
             continue
+        value = PointForecastValue(
+            timestamp=file.timestamp,
+            u=sample_bilinear(u_grid, lat, lon),
+            v=sample_bilinear(v_grid, lat, lon),
+        )
+        if value.u is not None and value.v is not None:
+            value.speed, value.direction = wind_speed_direction(value.u, value.v)
+        values.setdefault(file.model, []).append(value)
 
-        for filename in os.listdir(model_dir):
-            if file_type == "cog" and filename.startswith(f"cog_{variable}_"):
-                try:
-                    timestamp_str = filename.split(f"cog_{variable}_")[1].split(".tif")[
-                        0
-                    ]
-                    timestamp = datetime.strptime(timestamp_str, "%Y-%m-%dT%H%M%SZ")
-                except (IndexError, ValueError):
-                    continue
-                if start_time <= timestamp <= end_time:
-                    files.append(
-                        ForecastFile(
-                            model=model,
-                            file_path=str(model_dir / filename),
-                            timestamp=timestamp_str,
-                        )
-                    )
-            elif (
-                file_type == "velocity"
-                and f"_{variable}_" in filename
-                and filename.endswith(".json.gz")
-            ):
-                try:
-                    timestamp_str = filename.split(f"_{variable}_")[1].split(
-                        ".json.gz"
-                    )[0]
-                    timestamp = datetime.strptime(timestamp_str, "%Y-%m-%dT%H%M%SZ")
-                except (IndexError, ValueError):
-                    continue
-                if start_time <= timestamp <= end_time:
-                    files.append(
-                        ForecastFile(
-                            model=model,
-                            file_path=str(filename),
-                            timestamp=timestamp_str,
-                        )
-                    )
+    return [
+        PointForecast(
+            model=model, variable=variable, lat=lat, lon=lon, values=model_values
+        )
+        for model, model_values in values.items()
+        if any(value.u is not None for value in model_values)
+    ]
 
-    return files
+
+def get_velocity_subset(
+    file_path: Path,
+    stat_result: os.stat_result,
+    bbox: Optional[str] = None,
+    stride: Optional[int] = None,
+    zoom: Optional[int] = None,
+) -> RenderedPayload:
+    """
+    Returns the rendered subset of a velocity file, blocking.
+
+    The bounding box is snapped to the tile grid so that close map views
+    share the same cached subset. The stride is derived from the zoom level
+    when not given.
+    """
+    snapped = snap_bbox(parse_bbox(bbox)) if bbox else None
+    version = (stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino)
+    key = (str(file_path), version, snapped, stride, zoom)
+    payload = velocity_subsets.get(key)
+    if payload is not None:
+        return payload
+
+    grids = get_velocity_grids(file_path, version)
+    if stride is None:
+        stride = stride_for_zoom(grids[0].header, zoom) if zoom is not None else 1
+    subset = subset_velocity(grids, snapped, stride)
+    if subset is None:
+        raise HTTPException(
+            status_code=404, detail="No velocity data in the bounding box"
+        )
+
+    payload = render_payload(encode_velocity(subset))
+    velocity_subsets.put(key, payload)
+    return payload
+
+
+def get_velocity_binary(
+    file_path: Path, stat_result: os.stat_result
+) -> Union[Path, RenderedPayload]:
+    """
+    Returns the binary sibling of a velocity file, written if outdated, blocking.
+
+    When the sibling cannot be written (e.g. read-only data directory), the
+    binary file is rendered in memory instead.
+    """
+    sibling = binary_path(file_path)
+    if is_fresh(sibling, stat_result):
+        return sibling
+
+    content = encode_velocity_binary(load_velocity(file_path))
+    try:
+        return write_velocity_binary(file_path, stat_result, content)
+    except OSError as e:
+        logger.warning("Cannot write {}, served from memory: {}".format(sibling, e))
+        return render_payload(content, "application/octet-stream")
+
+
+def reencode_velocity_file(file_path: Path, encoding: str):
+    """
+    Re-encode a velocity file into its sibling, then delete the derived files
+    of the velocity files that were removed, blocking.
+    """
+    if encode_sibling(file_path, encoding):
+        remove_orphans(file_path.parent, VELOCITY_DERIVED_SUFFIXES)
+
+
+async def stat_velocity_file(file_path: Path) -> os.stat_result:
+    """Returns the stat of a velocity file, raising a 404 if it does not exist."""
+    try:
+        stat_result = await run_blocking(os.stat, file_path, group="forecast")
+    except FileNotFoundError:
+        stat_result = None
+    if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+        raise HTTPException(status_code=404, detail="Velocity file not found")
+    return stat_result
+
+
+def gzipped_file_response(
+    request: Request,
+    file_path: Path,
+    stat_result: os.stat_result,
+    encoding: str,
+    media_type: str,
+) -> Response:
+    """
+    Serve a gzipped file in the negotiated encoding.
+
+    The gzip and re-encoded files are streamed from disk, the decompressed
+    content chunk by chunk. The validators derive from the stored file, with
+    a suffix per encoding.
+    """
+    etag_base = hashlib.md5(
+        f"{stat_result.st_mtime}-{stat_result.st_size}".encode(),
+        usedforsecurity=False,
+    ).hexdigest()
+    headers = {
+        "Cache-Control": "public, max-age=600",
+        "ETag": f'"{etag_base}{ETAG_SUFFIXES[encoding]}"',
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Vary": "Accept-Encoding",
+    }
+
+    if is_not_modified(request.headers, headers["ETag"], headers["Last-Modified"]):
+        return Response(status_code=304, headers=headers)
+
+    if encoding == "identity":
+        return StreamingResponse(
+            iterate_blocking(iter_gunzip(file_path), group="forecast"),
+            media_type=media_type,
+            headers=headers,
+        )
+
+    headers["Content-Encoding"] = encoding
+    if encoding == "gzip":
+        return FileResponse(
+            file_path, media_type=media_type, stat_result=stat_result, headers=headers
+        )
+    return FileResponse(
+        sibling_path(file_path, encoding), media_type=media_type, headers=headers
+    )
 
 
 @router.get("/list/", response_model=ForecastResponse)
@@ -115,7 +356,15 @@ async def get_available_forecast(
         logger.error("Forecast directory {} not availabale.".format(BASE_DIR))
         raise HTTPException(status_code=404, detail="Forecast not available")
 
-    files = get_files_for_variable(variable, model, file_type, start_hour, end_hour)
+    files = await run_blocking(
+        get_files_for_variable,
+        variable,
+        model,
+        file_type,
+        start_hour,
+        end_hour,
+        group="forecast",
+    )
 
     if not files:
         raise HTTPException(
@@ -129,39 +378,243 @@ async def get_available_forecast(
     return files
 
 
-@router.get("/files/velocity/{model}/{filename}")
+@router.get("/manifest/", response_model=ForecastManifest)
+async def get_forecast_manifest(request: Request):
+    """
+    Endpoint to get every available forecast file, by model and variable.
+
+    Unlike /list/, the manifest does not depend on the current time: it only
+    changes, with its ETag, when forecast files are added or removed.
+    Clients should revalidate it with If-None-Match.
+    """
+    if not BASE_DIR.exists():
+        logger.error("Forecast directory {} not availabale.".format(BASE_DIR))
+        raise HTTPException(status_code=404, detail="Forecast not available")
+
+    payload = await run_blocking(get_manifest, group="forecast")
+    return payload_response(request, payload, "no-cache")
+
+
+@router.get("/point/", response_model=PointForecastResponse)
+async def get_point_forecast(
+    variable: str,
+    lat: float = Query(..., description="Latitude of the location in degrees"),
+    lon: float = Query(..., description="Longitude of the location in degrees"),
+    model: Optional[List[str]] = Query(
+        None,
+        description="List of models to filter by (aa = Arome Arctic). If not provided, all models are returned.",
+    ),
+    start_hour: int = Query(
+        -24, description="Start hour offset from now (e.g., -24 for 24 hours ago)"
+    ),
+    end_hour: int = Query(
+        24, description="End hour offset from now (e.g., 24 for 24 hours ahead)"
+    ),
+    response: Response = None,
+):
+    """
+    Endpoint to get the forecast at a location (meteogram), for each model.
+
+    The values are interpolated from the velocity files of the variable in
+    the hour range: U and V wind components, speed and direction (degrees,
+    where the wind comes from).
+    """
+    handle_validation_error(
+        PointForecastRequestModel,
+        variable=variable,
+        models=model,
+        file_type="velocity",
+        start_hour=start_hour,
+        end_hour=end_hour,
+        lat=lat,
+        lon=lon,
+    )
+
+    if not BASE_DIR.exists():
+        logger.error("Forecast directory {} not availabale.".format(BASE_DIR))
+        raise HTTPException(status_code=404, detail="Forecast not available")
+
+    files = await run_blocking(
+        get_files_for_variable,
+        variable,
+        model,
+        "velocity",
+        start_hour,
+        end_hour,
+        group="forecast",
+    )
+    try:
+        forecasts = await run_blocking(
+            sample_point_forecast, files, variable, lat, lon, group="forecast"
+        )
+    except (OSError, ValueError, KeyError) as e:
+        logger.error("Error sampling the {} forecast: {}".format(variable, e))
+        raise HTTPException(status_code=500, detail="Invalid velocity file")
+
+    if not forecasts:
+        raise HTTPException(
+            status_code=404,
+            detail="No forecast found for the given variable, location, model, and hour range",
+        )
+
+    response.headers["Cache-Control"] = "public, max-age=600"
+
+    return forecasts
+
+
+@router.get(
+    "/files/velocity/{model}/{filename}",
+    response_class=FileResponse,
+    responses={
+        200: {"content": {"application/json": {}}, "description": "The velocity file"},
+        206: {"description": "The requested byte range of the encoded file"},
+        304: {"description": "Not modified"},
+        400: {"description": "Invalid subset parameters"},
+        404: {"description": "Velocity file not found"},
+        406: {"description": "The client does not accept any available encoding"},
+    },
+)
 async def get_leaflet_velocity_file(
-    model: str, filename: str, request: Request, response: Response
+    model: str,
+    filename: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    bbox: Optional[str] = Query(
+        None,
+        description="Bounding box to cut the grids to: west,south,east,north in degrees",
+    ),
+    stride: Optional[int] = Query(
+        None, description="Keep one grid point every stride points"
+    ),
+    zoom: Optional[int] = Query(
+        None, description="Map zoom level to derive the stride from"
+    ),
 ):
     """
-    Endpoint to download a gzipped velocity file.
-    Clients must send 'Accept-Encoding: gzip' in the request headers.
-    Careful, this wont work in swagger UI.
+    Endpoint to download a velocity file.
+
+    The encoding is negotiated from the Accept-Encoding header: the stored
+    gzipped file, a brotli or zstd re-encoded copy when available, or the
+    decompressed JSON streamed chunk by chunk for clients without gzip.
+
+    The encoded files are streamed from disk (sendfile when the server
+    supports it), with Content-Length, Last-Modified and ETag headers.
+    Conditional (If-None-Match, If-Modified-Since) and byte range requests
+    are supported.
+
+    With bbox, stride or zoom, the grids are cut to the bounding box and
+    decimated, and the subset is served from memory instead.
     """
-    # Check if the client accepts gzip encoding
-    accept_encoding = request.headers.get("Accept-Encoding", "")
-    if "gzip" not in accept_encoding.lower():
+    subset_requested = bbox is not None or stride is not None or zoom is not None
+    if subset_requested:
+        handle_validation_error(
+            VelocitySubsetRequestModel, bbox=bbox, stride=stride, zoom=zoom
+        )
+
+    file_path = safe_join(BASE_DIR, model, "velocity", filename)
+    stat_result = await stat_velocity_file(file_path)
+
+    if subset_requested:
+        try:
+            payload = await run_blocking(
+                get_velocity_subset,
+                file_path,
+                stat_result,
+                bbox,
+                stride,
+                zoom,
+                group="forecast",
+            )
+        except (OSError, ValueError, KeyError) as e:
+            logger.error("Error subsetting {}: {}".format(file_path, e))
+            raise HTTPException(status_code=500, detail="Invalid velocity file")
+        return payload_response(request, payload, "public, max-age=600")
+
+    # Select the best encoding available for the client
+    accept_encoding = request.headers.get("Accept-Encoding")
+    fresh = await run_blocking(
+        fresh_reencodings, file_path, stat_result, group="forecast"
+    )
+    encoding = select_encoding(accept_encoding, fresh + ["gzip", "identity"])
+    if encoding is None:
         raise HTTPException(
             status_code=406,  # Not Acceptable
-            detail="Client must accept gzip encoding. Send 'Accept-Encoding: gzip' header.",
+            detail="No acceptable encoding. Accept gzip or identity encoding.",
         )
 
+    # Re-encode the file in the background for the next clients
+    accepted = parse_accept_encoding(accept_encoding)
+    reencodings = available_reencodings() if can_reencode(file_path) else []
+    for reencoding in reencodings:
+        if reencoding not in fresh and accepted.get(reencoding, accepted.get("*", 0)):
+            background_tasks.add_task(
+                run_blocking,
+                reencode_velocity_file,
+                file_path,
+                reencoding,
+                group="forecast",
+            )
+
+    return gzipped_file_response(
+        request, file_path, stat_result, encoding, "application/json"
+    )
+
+
+@router.get(
+    "/files/velocity-binary/{model}/{filename}",
+    response_class=FileResponse,
+    responses={
+        200: {
+            "content": {"application/octet-stream": {}},
+            "description": "The velocity file in the binary format",
+        },
+        206: {"description": "The requested byte range of the encoded file"},
+        304: {"description": "Not modified"},
+        404: {"description": "Velocity file not found"},
+        406: {"description": "The client does not accept any available encoding"},
+    },
+)
+async def get_binary_velocity_file(model: str, filename: str, request: Request):
+    """
+    Endpoint to download a velocity file in a compact binary format.
+
+    The filename is the one of the JSON velocity file. The wind components
+    are quantized to int16 with a small JSON header, see app.utils.velocity
+    for the layout. The binary file is produced once per velocity file and
+    stored gzipped next to it, then served like the JSON file. When it cannot
+    be stored, it is kept in memory instead.
+    """
     file_path = safe_join(BASE_DIR, model, "velocity", filename)
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="Velocity file not found")
+    stat_result = await stat_velocity_file(file_path)
 
-    # Set the correct headers for a gzipped JSON response
-    response.headers["Cache-Control"] = "public, max-age=600"
-    response.headers["Content-Encoding"] = "gzip"
-    response.headers["Content-Type"] = "application/json"
-    # response.headers["Content-Disposition"] = f"inline; filename={filename}"
-
-    # Stream the file to avoid loading large files into memory
-    with open(file_path, "rb") as f:
-        gzipped_content = f.read()
-
-    return Response(
-        content=gzipped_content,
-        media_type="application/json",
-        headers=response.headers,
+    version = (stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino)
+    binary = velocity_binaries.get((str(file_path), version))
+    try:
+        if binary is None:
+            binary = await run_blocking(
+                get_velocity_binary,
+                file_path,
+                stat_result,
+                group="forecast",
+                cpu_bound=True,
+            )
+        if isinstance(binary, RenderedPayload):
+            velocity_binaries.put((str(file_path), version), binary)
+            return payload_response(request, binary, "public, max-age=600")
+        binary_stat = await run_blocking(os.stat, binary, group="forecast")
+    except (OSError, ValueError, KeyError) as e:
+        logger.error("Error encoding {}: {}".format(file_path, e))
+        raise HTTPException(status_code=500, detail="Invalid velocity file")
+
+    encoding = select_encoding(
+        request.headers.get("Accept-Encoding"), ["gzip", "identity"]
+    )
+    if encoding is None:
+        raise HTTPException(
+            status_code=406,  # Not Acceptable
+            detail="No acceptable encoding. Accept gzip or identity encoding.",
+        )
+
+    return gzipped_file_response(
+        request, binary, binary_stat, encoding, "application/octet-stream"
     )
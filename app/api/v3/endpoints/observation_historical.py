@@ -1,23 +1,40 @@
-from fastapi import APIRouter, HTTPException, Query
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from typing import List, Literal, Optional
 from app.models.stations import (
     StationTimeseries,
-    StationTimeseriesDataPoint,
-    StationPosition,
     StationsAvailableHistoricalDates,
     StationDataRequestModel,
+    StationExportRequestModel,
     StationIDModel,
 )
 from app.utils.path import safe_join
+from app.utils.cache import file_cache
 from app.utils.error import handle_validation_error
-import dask.dataframe as dd
+from app.utils.executor import iterate_blocking, run_blocking
+from app.utils.downsampling import DownsamplingMethod, downsample_timeseries
+from app.utils.export import (
+    EXPORT_MEDIA_TYPES,
+    export_columns,
+    stream_csv,
+    stream_ndjson,
+    stream_parquet,
+)
+from app.utils.historical import get_parquet_columns, read_timeseries
+from app.utils.rollup import (
+    REFRESH_INTERVAL as ROLLUP_REFRESH_INTERVAL,
+    ROLLUP_PATH,
+    RollupQuery,
+    build_rollups,
+)
+from app.utils.serialization import serialize_station_timeseries
+import asyncio
 import os
-import pandas as pd
 import json
+from contextlib import asynccontextmanager
 from loguru import logger
 from pathlib import Path
 
-router = APIRouter()
 
 # Define paths
 LONG_TIMESERIES_PATH = Path("./data/000_long_timeseries")
@@ -27,6 +44,36 @@ STATIONS_STATUS_PATH = Path("./data/000_stations_status/all_dict.json")
 MAX_TIMESTEPS = 200
 
 
+async def refresh_rollups_periodically():
+    """
+    Bring the rollups up to date with the long timeseries, then again every
+    ROLLUP_REFRESH_INTERVAL seconds.
+    """
+    while True:
+        try:
+            await run_blocking(
+                build_rollups, None, LONG_TIMESERIES_PATH, ROLLUP_PATH, group="rollups"
+            )
+        except Exception as e:
+            logger.error("Error building the rollups: {}".format(str(e)))
+        await asyncio.sleep(ROLLUP_REFRESH_INTERVAL)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Refresh the rollups in the background while the app runs."""
+    task = None
+    if ROLLUP_REFRESH_INTERVAL > 0:
+        task = asyncio.create_task(refresh_rollups_periodically())
+    yield
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+router = APIRouter(lifespan=lifespan)
+
+
 def get_available_dates_for_station(station_id: str) -> List[str]:
     """Get list of available dates for a specific station."""
     station_path = safe_join(LONG_TIMESERIES_PATH, station_id)
@@ -45,26 +92,14 @@ def get_available_dates_for_station(station_id: str) -> List[str]:
 def check_station_exists(station_id: str) -> bool:
     """Check if station exists in stations status data."""
     try:
-        with open(STATIONS_STATUS_PATH, "r") as file:
-            stations_data = json.load(file)
-            return station_id in stations_data
+        return station_id in file_cache.get(STATIONS_STATUS_PATH)
     except (FileNotFoundError, json.JSONDecodeError, Exception) as e:
         logger.error("Error checking station existence: {}".format(str(e)))
         return False
 
 
-@router.get(
-    "/available",
-    response_model=List[str],
-    responses={
-        404: {"description": "Long timeseries data directory not found"},
-        500: {"description": "Error reading station list"},
-    },
-)
-async def get_stations_where_historical_data_are_available() -> List[str]:
-    """
-    Get list of stations with available long term timeseries data.
-    """
+def list_stations_with_historical_data() -> List[str]:
+    """List the stations with a long timeseries directory."""
     try:
         stations = [
             d
@@ -88,6 +123,132 @@ async def get_stations_where_historical_data_are_available() -> List[str]:
     return stations
 
 
+def plan_export(
+    stations: List[str],
+    start_date: str,
+    end_date: str,
+    variables: Optional[List[str]] = None,
+):
+    """
+    Check the exported stations and list their daily files in the date range.
+
+    Returns:
+        The available dates of each station, and the exported columns and
+        their types (see export_columns).
+    """
+    station_dates = {}
+    for station_id in dict.fromkeys(stations):
+        if not check_station_exists(station_id):
+            logger.error("Station not found: {}".format(station_id))
+            raise HTTPException(
+                status_code=404, detail=f"Station {station_id} not found"
+            )
+        station_dates[station_id] = [
+            date
+            for date in get_available_dates_for_station(station_id)
+            if start_date <= date <= end_date
+        ]
+
+    if not any(station_dates.values()):
+        raise HTTPException(
+            status_code=404,
+            detail=f"No historical data available in the date range {start_date} to {end_date}.",
+        )
+
+    columns, types = export_columns(
+        [
+            safe_join(LONG_TIMESERIES_PATH, station_id, f"{date}.parquet")
+            for station_id, dates in station_dates.items()
+            for date in dates
+        ],
+        variables,
+    )
+    return station_dates, columns, types
+
+
+@router.get(
+    "/available",
+    response_model=List[str],
+    responses={
+        404: {"description": "Long timeseries data directory not found"},
+        500: {"description": "Error reading station list"},
+    },
+)
+async def get_stations_where_historical_data_are_available() -> List[str]:
+    """
+    Get list of stations with available long term timeseries data.
+    """
+    return await run_blocking(list_stations_with_historical_data, group="stations")
+
+
+@router.get(
+    "/export",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {media_type: {} for media_type in EXPORT_MEDIA_TYPES.values()},
+            "description": "The observations, streamed one daily file at a time",
+        },
+        404: {"description": "Station not found or no data in the date range"},
+    },
+)
+async def export_historical_observations(
+    stations: List[str] = Query(..., description="Stations to export"),
+    start_date: str = Query(..., description="Start date in YYYY-MM-DD format"),
+    end_date: str = Query(..., description="End date in YYYY-MM-DD format"),
+    variables: Optional[List[str]] = Query(
+        None, description="List of variables to include"
+    ),
+    file_format: Literal["ndjson", "csv", "parquet"] = Query(
+        "ndjson", alias="format", description="Export format"
+    ),
+) -> StreamingResponse:
+    """
+    Export the historical observations of one or more stations over any date range.
+
+    Unlike /historical/{station_id}, the number of timesteps is not limited:
+    the daily files are read and encoded one at a time and streamed to the
+    client, so the first rows are sent before the whole range is read.
+    """
+    handle_validation_error(
+        StationExportRequestModel,
+        stations=stations,
+        start_date=start_date,
+        end_date=end_date,
+        variables=variables,
+        format=file_format,
+    )
+
+    station_dates, columns, types = await run_blocking(
+        plan_export, stations, start_date, end_date, variables, group="stations"
+    )
+
+    def chunks():
+        for station_id, dates in station_dates.items():
+            for date in dates:
+                file_path = safe_join(
+                    LONG_TIMESERIES_PATH, station_id, f"{date}.parquet"
+                )
+                yield (
+                    station_id,
+                    read_timeseries([file_path], start_date, end_date, variables),
+                )
+
+    if file_format == "parquet":
+        content = stream_parquet(chunks(), columns, types)
+    elif file_format == "csv":
+        content = stream_csv(chunks(), columns)
+    else:
+        content = stream_ndjson(chunks(), columns)
+
+    filename = f"swi_historical_{start_date}_{end_date}.{file_format}"
+    return StreamingResponse(
+        iterate_blocking(content, group="export"),
+        media_type=EXPORT_MEDIA_TYPES[file_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @router.get(
     "/{station_id}/variables",
     response_model=List[str],
@@ -104,11 +265,13 @@ async def get_available_variables_for_the_station_historical_observations(
     """
     handle_validation_error(StationIDModel, id=station_id)
     try:
-        if not check_station_exists(station_id):
+        if not await run_blocking(check_station_exists, station_id, group="stations"):
             logger.error("Station not found: {}".format(station_id))
             raise HTTPException(status_code=404, detail="Station not found")
 
-        dates = get_available_dates_for_station(station_id)
+        dates = await run_blocking(
+            get_available_dates_for_station, station_id, group="stations"
+        )
         if not dates:
             raise HTTPException(
                 status_code=404, detail="No variables found in timeseries data"
@@ -118,8 +281,7 @@ async def get_available_variables_for_the_station_historical_observations(
         file_path = safe_join(
             LONG_TIMESERIES_PATH, station_id, f"{sample_date}.parquet"
         )
-        df = pd.read_parquet(file_path)
-        variables = list(df.columns)
+        variables = await run_blocking(get_parquet_columns, file_path, group="stations")
         if not variables:
             raise HTTPException(
                 status_code=404, detail="No variables found in timeseries data"
@@ -148,11 +310,13 @@ async def get_available_historical_time_range_for_a_station(
     handle_validation_error(StationIDModel, id=station_id)
 
     try:
-        if not check_station_exists(station_id):
+        if not await run_blocking(check_station_exists, station_id, group="stations"):
             logger.error("Station not found: {}".format(station_id))
             raise HTTPException(status_code=404, detail="Station not found")
 
-        dates = get_available_dates_for_station(station_id)
+        dates = await run_blocking(
+            get_available_dates_for_station, station_id, group="stations"
+        )
         if not dates:
             raise HTTPException(
                 status_code=404,
@@ -175,31 +339,22 @@ async def get_available_historical_time_range_for_a_station(
         )
 
 
-@router.get("/{station_id}", response_model=StationTimeseries)
-async def get_station_historical_observations(
+def load_station_timeseries(
     station_id: str,
-    start_date: str = Query(..., description="Start date in YYYY-MM-DD format"),
-    end_date: str = Query(..., description="End date in YYYY-MM-DD format"),
-    variables: Optional[List[str]] = Query(
-        None, description="List of variables to include"
-    ),
-    resample: bool = Query(
-        False, description="Enable resampling if data exceeds limit"
-    ),
-) -> StationTimeseries:
-    """
-    Get the historical time serie data for a given station.
+    start_date: str,
+    end_date: str,
+    variables: Optional[List[str]] = None,
+    resample: bool = False,
+    downsample: Optional[DownsamplingMethod] = None,
+) -> bytes:
     """
-    # Validate input using your Pydantic model
-    handle_validation_error(
-        StationDataRequestModel,
-        id=station_id,
-        start_date=start_date,
-        end_date=end_date,
-        variables=variables,
-        resample=resample,
-    )
+    Read, reduce and serialize the timeseries of a station over a date range.
+
+    Blocking and CPU bound, run it with run_blocking.
 
+    Returns:
+        bytes: The JSON encoded StationTimeseries.
+    """
     try:
         if not check_station_exists(station_id):
             logger.error("Station not found: {}".format(station_id))
@@ -226,45 +381,31 @@ async def get_station_historical_observations(
             for date in filtered_dates
         ]
 
-        ddf = dd.read_parquet(parquet_files)
-        if variables:
-            variables_availables = [var for var in variables if var in ddf.columns]
-            if "latitude" in ddf.columns and "longitude" in ddf.columns:
-                variables_availables.extend(["latitude", "longitude"])
-            ddf = ddf[variables_availables]
-        ddf = ddf.loc[start_date:end_date]
+        if resample and not downsample:
+            # Long ranges are served from the precomputed rollups
+            query = RollupQuery(
+                station_id,
+                filtered_dates,
+                start_date,
+                end_date,
+                LONG_TIMESERIES_PATH,
+                ROLLUP_PATH,
+            )
+            resampled = query.resample(MAX_TIMESTEPS, variables)
+            if resampled is not None:
+                return serialize_station_timeseries(station_id, resampled)
 
-        index = ddf.index.compute()
+        df = read_timeseries(parquet_files, start_date, end_date, variables)
 
-        if len(index) > MAX_TIMESTEPS and not resample:
+        if len(df.index) > MAX_TIMESTEPS and downsample:
+            df = downsample_timeseries(df, MAX_TIMESTEPS, downsample)
+        elif len(df.index) > MAX_TIMESTEPS:
             raise HTTPException(
                 status_code=400,
                 detail=f"Requested data exceeds maximum allowed timesteps ({MAX_TIMESTEPS}). Please narrow the date range or enable resampling.",
             )
-        elif len(index) > MAX_TIMESTEPS and resample:
-            total_minutes = (index.max() - index.min()).total_seconds() / 60
-            interval_minutes = total_minutes / MAX_TIMESTEPS
-            resample_interval = int(interval_minutes // 10) * 10
-            ddf = ddf.resample(f"{resample_interval}min").mean()
-
-        df = ddf.compute()
-
-        timeseries = []
-        for index, row in df.iterrows():
-            data_point = {}
-            if "latitude" in df.columns and "longitude" in df.columns:
-                data_point["location"] = StationPosition(
-                    lat=row.get("latitude"), lon=row.get("longitude")
-                )
-            for column in df.columns:
-                if column not in ["latitude", "longitude"]:
-                    data_point[column] = row.get(column)
-            timeseries.append(
-                StationTimeseriesDataPoint(
-                    timestamp=index.to_pydatetime(), **data_point
-                )
-            )
-        return StationTimeseries(id=station_id, timeseries=timeseries)
+
+        return serialize_station_timeseries(station_id, df)
 
     except HTTPException:
         raise
@@ -274,3 +415,51 @@ async def get_station_historical_observations(
             status_code=500,
             detail="Server error loading timeseries data range",
         )
+
+
+@router.get("/{station_id}", response_model=StationTimeseries)
+async def get_station_historical_observations(
+    station_id: str,
+    start_date: str = Query(..., description="Start date in YYYY-MM-DD format"),
+    end_date: str = Query(..., description="End date in YYYY-MM-DD format"),
+    variables: Optional[List[str]] = Query(
+        None, description="List of variables to include"
+    ),
+    resample: bool = Query(
+        False, description="Enable resampling if data exceeds limit"
+    ),
+    downsample: Optional[DownsamplingMethod] = Query(
+        None,
+        description="Reduce the data to the maximum number of timesteps with a shape preserving method (lttb, minmax) or bucket means (mean)",
+    ),
+) -> StationTimeseries:
+    """
+    Get the historical time serie data for a given station.
+
+    When the data exceeds the maximum number of timesteps, it is either
+    resampled to fixed intervals (resample=true) or reduced to exactly the
+    maximum number of timesteps with the given downsample method.
+    """
+    # Validate input using your Pydantic model
+    handle_validation_error(
+        StationDataRequestModel,
+        id=station_id,
+        start_date=start_date,
+        end_date=end_date,
+        variables=variables,
+        resample=resample,
+        downsample=downsample,
+    )
+
+    content = await run_blocking(
+        load_station_timeseries,
+        station_id,
+        start_date,
+        end_date,
+        variables,
+        resample,
+        downsample,
+        group="historical",
+        cpu_bound=True,
+    )
+    return Response(content=content, media_type="application/json")
@@ -1,19 +1,36 @@
-from fastapi import APIRouter, HTTPException
-from typing import List, Dict, Any
-from app.models.stations import StationTimeseries, StationIDModel
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, HTTPException, Query, Request
+from typing import Dict, List, NamedTuple, Optional
+from pydantic import TypeAdapter
+from app.models.stations import (
+    ObservationTimeline,
+    ObservationTimelineRequestModel,
+    StationColumnarTimeseries,
+    StationTimeseries,
+    StationIDModel,
+)
 from app.utils.error import handle_validation_error
+from app.utils.cache import HotFileStore, LRUCache
+from app.utils.executor import run_blocking
+from app.utils.response import (
+    RenderedPayload,
+    StationPayloads,
+    payload_response,
+    render_payload,
+)
+import asyncio
 import os
 import json
 from loguru import logger
 
 
-router = APIRouter()
-
 # Define paths as variables
 LATEST_DATA_PATH = "./data/000_latest_obs/latest_dict.json"
 HOURLY_DATA_PATH = "./data/000_hourly_data/{offset}.json"
 MIN_TIME_OFFSET = -24
 MAX_TIME_OFFSET = 24
+# Seconds between two checks of the observation files
+REFRESH_INTERVAL = float(os.getenv("SWI_METOBS_BACKEND_OBSERVATIONS_REFRESH", "15"))
 
 # Environment variable to enable forecast data
 enable_forecast = (
@@ -21,15 +38,145 @@ enable_forecast = (
     == "true"
 )
 
+# The clients may store the responses but must revalidate them (ETag)
+CACHE_CONTROL = "no-cache"
+
+ObservationsAdapter = TypeAdapter(List[StationTimeseries])
+
+
+TimelineAdapter = TypeAdapter(ObservationTimeline)
+
+# Rendered timelines, by request parameters and version of the files
+timeline_cache = LRUCache(maxsize=64)
+
+
+class ObservationSnapshot(NamedTuple):
+    """The observations of a file, validated and rendered."""
+
+    stations: Dict[str, StationTimeseries]
+    payloads: StationPayloads
+
+
+def render_observations(content: bytes) -> ObservationSnapshot:
+    """Render the responses of an observations file, for all and each station."""
+    stations = [
+        StationTimeseries(id=station_id, timeseries=station_data.get("timeseries", []))
+        for station_id, station_data in json.loads(content).items()
+    ]
+    return ObservationSnapshot(
+        stations={station.id: station for station in stations},
+        payloads=StationPayloads(
+            stations=render_payload(ObservationsAdapter.dump_json(stations)),
+            by_station={
+                station.id: render_payload(station.model_dump_json().encode())
+                for station in stations
+            },
+        ),
+    )
+
+
+def build_timeline(
+    snapshots: Dict[int, ObservationSnapshot],
+    start_offset: int,
+    end_offset: int,
+    stations: Optional[List[str]] = None,
+    variables: Optional[List[str]] = None,
+) -> ObservationTimeline:
+    """
+    Merge the observations of several offsets into one columnar timeseries per station.
+
+    A timestamp present at several offsets is taken from the latest offset.
+
+    Args:
+        snapshots: The observations of each available offset.
+        start_offset: The first requested offset.
+        end_offset: The last requested offset.
+        stations: The stations to include, all if None.
+        variables: The variables to include, all if None.
+    """
+    points: Dict[str, dict] = {}
+    for offset in sorted(snapshots):
+        for station_id, station in snapshots[offset].stations.items():
+            if stations and station_id not in stations:
+                continue
+            by_timestamp = points.setdefault(station_id, {})
+            for point in station.timeseries:
+                by_timestamp[point.timestamp] = (offset, point)
+
+    columns = []
+    for station_id, by_timestamp in points.items():
+        rows = [by_timestamp[timestamp] for timestamp in sorted(by_timestamp)]
+        names = dict.fromkeys(name for _, point in rows for name in point.model_extra)
+        if variables:
+            names = [name for name in variables if name in names]
+        columns.append(
+            StationColumnarTimeseries(
+                id=station_id,
+                offsets=[offset for offset, _ in rows],
+                timestamps=[point.timestamp for _, point in rows],
+                variables={
+                    name: [point.model_extra.get(name) for _, point in rows]
+                    for name in names
+                },
+            )
+        )
+
+    return ObservationTimeline(
+        start_offset=start_offset,
+        end_offset=end_offset,
+        offsets=sorted(snapshots),
+        stations=columns,
+    )
+
+
+def render_timeline(*args, **kwargs) -> RenderedPayload:
+    """Build and render a timeline, see build_timeline."""
+    return render_payload(TimelineAdapter.dump_json(build_timeline(*args, **kwargs)))
+
+
+def get_data_path(offset: int) -> str:
+    """Return the file of the observations at a time offset."""
+    if offset == 0:
+        return LATEST_DATA_PATH
+    return HOURLY_DATA_PATH.format(offset=offset)
+
+
+# Observations of every offset, kept in memory and refreshed in the
+# background so that scrubbing through the offsets does not touch the disk
+observation_store = HotFileStore(
+    {
+        offset: get_data_path(offset)
+        for offset in range(
+            MIN_TIME_OFFSET, (MAX_TIME_OFFSET if enable_forecast else 0) + 1
+        )
+    },
+    render_observations,
+    max_staleness=2 * REFRESH_INTERVAL,
+    group="observations",
+)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Preload the observations, then refresh them while the app runs."""
+    await run_blocking(observation_store.refresh, group="observations")
+    task = asyncio.create_task(observation_store.run(REFRESH_INTERVAL))
+    yield
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+router = APIRouter(lifespan=lifespan)
+
 
-def load_data(file_path: str) -> Dict[str, Any]:
+async def load_observations(offset: int) -> ObservationSnapshot:
+    """Get the rendered responses of the observations at a time offset."""
     try:
-        with open(file_path, "r") as file:
-            return json.load(file)
+        return await observation_store.get(offset)
     except FileNotFoundError:
-        logger.error("File {} not found".format(file_path))
+        logger.error("File {} not found".format(get_data_path(offset)))
         raise HTTPException(status_code=404, detail="Data not found")
-    except json.JSONDecodeError:
+    except ValueError:
         logger.error("Invalid JSON File")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
@@ -43,7 +190,7 @@ def load_data(file_path: str) -> Dict[str, Any]:
         500: {"description": "Invalid JSON data"},
     },
 )
-async def get_station_observations(station_id: str, offset: int = 0):
+async def get_station_observations(station_id: str, request: Request, offset: int = 0):
     """
     Get data for a specific station with optional time offset.
     - offset: 0 for latest data, negative for past data, positive for forecast data.
@@ -61,26 +208,14 @@ async def get_station_observations(station_id: str, offset: int = 0):
     if offset > 0 and not enable_forecast:
         raise HTTPException(status_code=400, detail="Forecast data is not enabled")
 
-    # Determine the file to read based on the offset
-    if offset == 0:
-        file_path = LATEST_DATA_PATH
-    else:
-        file_path = HOURLY_DATA_PATH.format(offset=offset)
-
-    # Load the data from the file
-    data = load_data(file_path)
+    # Get the rendered responses of the offset
+    payloads = (await load_observations(offset)).payloads
 
     # Check if the station_id exists in the data
-    if station_id not in data:
+    if station_id not in payloads.by_station:
         raise HTTPException(status_code=404, detail="Station not found")
 
-    # Extract the relevant station data
-    station_data = data[station_id]
-
-    # Create the response model
-    return StationTimeseries(
-        id=station_id, timeseries=station_data.get("timeseries", [])
-    )
+    return payload_response(request, payloads.by_station[station_id], CACHE_CONTROL)
 
 
 @router.get(
@@ -92,7 +227,7 @@ async def get_station_observations(station_id: str, offset: int = 0):
         500: {"description": "Invalid JSON data"},
     },
 )
-async def get_all_stations_observations(offset: int = 0):
+async def get_all_stations_observations(request: Request, offset: int = 0):
     """
     Get data for all stations with optional time offset.
     - offset: 0 for latest data, negative for past data, positive for forecast data.
@@ -107,22 +242,90 @@ async def get_all_stations_observations(offset: int = 0):
     if offset > 0 and not enable_forecast:
         raise HTTPException(status_code=400, detail="Forecast data is not enabled")
 
-    # Determine the file to read based on the offset
-    if offset == 0:
-        file_path = LATEST_DATA_PATH
-    else:
-        file_path = HOURLY_DATA_PATH.format(offset=offset)
-
-    # Load the data from the file
-    data = load_data(file_path)
-
-    # Format the response
-    stations = []
-    for station_id, station_data in data.items():
-        stations.append(
-            StationTimeseries(
-                id=station_id, timeseries=station_data.get("timeseries", [])
-            )
+    # Get the rendered responses of the offset
+    payloads = (await load_observations(offset)).payloads
+
+    return payload_response(request, payloads.stations, CACHE_CONTROL)
+
+
+@router.get(
+    "/timeline",
+    response_model=ObservationTimeline,
+    responses={
+        400: {"description": "Offset out of range or forecast data not enabled"},
+        404: {"description": "No data file found in the offset range"},
+        500: {"description": "Invalid JSON data"},
+    },
+)
+async def get_observations_timeline(
+    request: Request,
+    start_offset: int = Query(MIN_TIME_OFFSET, description="First offset"),
+    end_offset: int = Query(0, description="Last offset"),
+    stations: Optional[List[str]] = Query(
+        None, description="Stations to include, all if not provided"
+    ),
+    variables: Optional[List[str]] = Query(
+        None, description="Variables to include, all if not provided"
+    ),
+):
+    """
+    Get the observations of a range of offsets in one columnar response.
+
+    For each station, the timestamps, the offset they come from and the
+    values of each variable are returned as parallel arrays. Offsets whose
+    data file is missing are skipped, the available ones are listed in
+    `offsets`.
+    """
+    handle_validation_error(
+        ObservationTimelineRequestModel,
+        start_offset=start_offset,
+        end_offset=end_offset,
+        stations=stations,
+        variables=variables,
+    )
+
+    max_offset = MAX_TIME_OFFSET if enable_forecast else 0
+    if start_offset < MIN_TIME_OFFSET or end_offset > max_offset:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Offset out of range. Must be between {MIN_TIME_OFFSET} and {max_offset}.",
+        )
+
+    snapshots = {}
+    for offset in range(start_offset, end_offset + 1):
+        try:
+            snapshots[offset] = await load_observations(offset)
+        except HTTPException as e:
+            if e.status_code != 404:
+                raise
+
+    if not snapshots:
+        raise HTTPException(status_code=404, detail="Data not found")
+
+    # The timelines are cached by content of the files they are built from,
+    # the content ETags, so that the replaced files are not kept alive
+    version = tuple(
+        (offset, snapshot.payloads.stations.etag)
+        for offset, snapshot in sorted(snapshots.items())
+    )
+    key = (
+        start_offset,
+        end_offset,
+        tuple(stations or ()),
+        tuple(variables or ()),
+        version,
+    )
+    payload = timeline_cache.get(key)
+    if payload is None:
+        payload = await run_blocking(
+            render_timeline,
+            snapshots,
+            start_offset,
+            end_offset,
+            stations,
+            variables,
+            group="observations",
         )
+        timeline_cache.put(key, payload)
 
-    return stations
+    return payload_response(request, payload, CACHE_CONTROL)
@@ -1,16 +1,22 @@
-from fastapi import HTTPException, APIRouter
+from contextlib import asynccontextmanager
+from fastapi import HTTPException, APIRouter, Request
 from app.models.spheres import SphereGeojson, SphereNodePanorama, SphereNode
+from app.utils.cache import LRUCache
+from app.utils.executor import run_blocking
+from app.utils.response import RenderedPayload, payload_response, render_payload
+from app.utils.singleflight import SingleFlight
+import asyncio
+import json
 import os
+import tempfile
 import httpx
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 from datetime import datetime, timedelta
-import math
-from collections import defaultdict
+from pathlib import Path
+from weakref import WeakKeyDictionary
+import numpy as np
 from loguru import logger
 
-# Get the router from parent
-router = APIRouter()
-
 SphereProjectLinks = {
     "The Living Ice Project": {
         "geojson_url": os.getenv(
@@ -24,135 +30,319 @@ SphereProjectLinks = {
 # Cache for storing fetched GeoJSON data and spatial index
 _geojson_cache: Dict[str, Dict] = {}
 _cache_timestamp: Dict[str, datetime] = {}
+# Validators (ETag, Last-Modified) of the cached data, for conditional requests
+_geojson_validators: Dict[str, Dict[str, str]] = {}
 CACHE_TTL = timedelta(hours=1)  # Cache for 1 hour
+# Delay before loading again an index without any node (upstream unavailable)
+RETRY_INTERVAL = timedelta(minutes=1)
+
+# The current spatial index, replaced at once by a new one on refresh
+_sphere_index: Optional["SpatialIndex"] = None
+# Concurrent callers share the fetch of a URL, and the build of the index
+_geojson_fetches = SingleFlight()
+_index_builds = SingleFlight()
+# The GeoJSON response of each index, rendered once
+_geojson_payloads: "WeakKeyDictionary[SpatialIndex, RenderedPayload]" = (
+    WeakKeyDictionary()
+)
+_geojson_renders = SingleFlight()
+
+# The clients may store the GeoJSON but must revalidate it (ETag)
+GEOJSON_CACHE_CONTROL = "no-cache"
+
+# Shared HTTP client of the upstream fetches, keeping the connections alive
+# between refreshes. Clients are bound to the event loop they are used in.
+HTTP_TIMEOUT = httpx.Timeout(
+    float(os.getenv("SWI_METOBS_BACKEND_SPHERES_FETCH_TIMEOUT", "30")), connect=10.0
+)
+HTTP_LIMITS = httpx.Limits(max_connections=10, max_keepalive_connections=5)
+_http_clients: "WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    WeakKeyDictionary()
+)
+
+EARTH_RADIUS = 6371000  # meters
+# Side of the cubic cells of the grid over the 3D positions of the nodes (meters)
+CELL_SIZE = 5000.0
+# Offset making the cell coordinates positive, to pack them in one integer
+_CELL_OFFSET = int(EARTH_RADIUS // CELL_SIZE) + 2
+_CELL_BITS = 21
+
+# Snapshot of the index, shared by the workers and kept across restarts
+SNAPSHOT_PATH = Path(
+    os.getenv(
+        "SWI_METOBS_BACKEND_SPHERES_SNAPSHOT", "./data/000_spheres/sphere_index.npz"
+    )
+)
+SNAPSHOT_VERSION = 2
+_SNAPSHOT_ARRAYS = (
+    "coordinates",
+    "cell_rows",
+    "cell_keys",
+    "cell_starts",
+    "graph_starts",
+    "graph_rows",
+)
+
+# Navigation parameters used by the clients, whose links are precomputed
+DEFAULT_MAX_RANGE = 10000.0
+DEFAULT_SECTORS = 5
+# Number of links kept per index for the other parameters
+LINKS_CACHE_SIZE = int(os.getenv("SWI_METOBS_BACKEND_SPHERES_LINKS_CACHE", "4096"))
 
-# Spatial index for efficient neighbor search
-_spatial_index: Dict[str, SphereNodePanorama] = {}  # id -> node
-_position_grid: Dict[Tuple[float, float], List[str]] = defaultdict(
-    list
-)  # (grid_x, grid_y) -> [node_ids]
-GRID_SIZE = 0.001  # Approximately 111 meters at equator (0.001 degrees)
 
-# Distance matrix cache: node_id -> {other_node_id: distance}
-_distance_matrix: Dict[str, Dict[str, float]] = {}
-# Bearing matrix cache: node_id -> {other_node_id: bearing}
-_bearing_matrix: Dict[str, Dict[str, float]] = {}
+class SpatialIndex:
+    """
+    Spatial indexing system for efficient neighbor search.
+
+    An index is built at once from the nodes and not modified afterwards, so
+    that a new index can be built while the current one is in use, and then
+    replace it.
+
+    The coordinates of the nodes are stored in contiguous arrays, and the
+    nodes bucketed in the cells of a grid over their 3D positions, in
+    compressed sparse row layout: the rows of the nodes of the cell
+    cell_keys[i] are cell_rows[cell_starts[i]:cell_starts[i + 1]]. The
+    distances and bearings are computed for one node and its candidate
+    neighbors at a time: the memory stays O(N), and a search only examines
+    the nodes of the cells around the target node.
+
+    The links of every node for the default navigation parameters are
+    computed with the index (navigation graph, in the same layout).
+    """
 
+    def __init__(self, nodes: Iterable[SphereNodePanorama] = ()):
+        self.nodes: Dict[str, SphereNodePanorama] = {
+            node.id: node for node in nodes if len(node.gps) >= 2
+        }
+        self.built_at = datetime.now()
+
+        # Coordinates of the indexed nodes: (lon, lat) in degrees, one row per node
+        self.node_ids: List[str] = list(self.nodes.keys())
+        self.node_rows: Dict[str, int] = {
+            node_id: row for row, node_id in enumerate(self.node_ids)
+        }
+        self.coordinates = np.array(
+            [self.nodes[node_id].gps[:2] for node_id in self.node_ids], dtype=float
+        ).reshape(-1, 2)
+
+        keys = self._get_cell_key(
+            self._cell_coordinates(self.coordinates[:, 0], self.coordinates[:, 1])
+        )
+        self.cell_rows = np.argsort(keys, kind="stable")
+        self.cell_keys, starts = np.unique(keys[self.cell_rows], return_index=True)
+        self.cell_starts = np.append(starts, len(keys)).astype(np.int64)
 
-class SpatialIndex:
-    """Spatial indexing system for efficient neighbor search."""
+        self._links = LRUCache(LINKS_CACHE_SIZE)
+        self._build_graph(DEFAULT_MAX_RANGE, DEFAULT_SECTORS)
 
-    @staticmethod
-    def _get_grid_key(lon: float, lat: float) -> Tuple[float, float]:
-        """Convert coordinates to grid key."""
-        grid_x = round(lon / GRID_SIZE) * GRID_SIZE
-        grid_y = round(lat / GRID_SIZE) * GRID_SIZE
-        return (grid_x, grid_y)
+    def __len__(self) -> int:
+        return len(self.node_ids)
 
-    @staticmethod
-    def _haversine_distance(
-        lon1: float, lat1: float, lon2: float, lat2: float
-    ) -> float:
-        """Calculate Haversine distance between two points in meters."""
-        # Convert degrees to radians
-        lon1, lat1, lon2, lat2 = map(math.radians, [lon1, lat1, lon2, lat2])
+    def is_stale(self) -> bool:
+        """
+        Whether the index is older than CACHE_TTL, or RETRY_INTERVAL when it
+        has no node.
+        """
+        return self.stale_in() <= 0
 
-        # Haversine formula
-        dlon = lon2 - lon1
-        dlat = lat2 - lat1
-        a = (
-            math.sin(dlat / 2) ** 2
-            + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
-        )
-        c = 2 * math.asin(math.sqrt(a))
+    def stale_in(self) -> float:
+        """Return the number of seconds before the index is stale."""
+        ttl = CACHE_TTL if self.nodes else RETRY_INTERVAL
+        return (self.built_at + ttl - datetime.now()).total_seconds()
 
-        # Earth radius in meters
-        r = 6371000
-        return c * r
+    def save(self, path: Path, sources: Optional[Dict[str, Dict]] = None):
+        """
+        Write the index to a snapshot file, blocking.
 
-    @staticmethod
-    def _calculate_bearing(lon1: float, lat1: float, lon2: float, lat2: float) -> float:
-        """Calculate bearing from point 1 to point 2 in degrees."""
-        lon1, lat1, lon2, lat2 = map(math.radians, [lon1, lat1, lon2, lat2])
+        The snapshot is an uncompressed NumPy .npz archive holding the arrays
+        of the index, and a JSON document with the node table (in row order),
+        the build time and the given upstream sources. It is written to a
+        temporary file then renamed, so that the workers never read a
+        partial snapshot.
+        """
+        metadata = {
+            "version": SNAPSHOT_VERSION,
+            "built_at": self.built_at.isoformat(),
+            "nodes": [
+                self.nodes[node_id].model_dump(mode="json") for node_id in self.node_ids
+            ],
+            "sources": sources or {},
+        }
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as output:
+                np.savez(
+                    output,
+                    metadata=np.frombuffer(json.dumps(metadata).encode(), np.uint8),
+                    **{name: getattr(self, name) for name in _SNAPSHOT_ARRAYS},
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: Path) -> Tuple["SpatialIndex", Dict[str, Dict]]:
+        """
+        Read an index from a snapshot file written by save, blocking.
 
-        dlon = lon2 - lon1
-        y = math.sin(dlon) * math.cos(lat2)
-        x = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(
-            lat2
-        ) * math.cos(dlon)
+        The arrays are used as stored, only the node table is validated.
 
-        bearing = math.degrees(math.atan2(y, x))
-        return (bearing + 360) % 360  # Normalize to 0-360
+        Returns:
+            Tuple[SpatialIndex, Dict[str, Dict]]: The index and the upstream
+            sources stored with it.
 
-    @staticmethod
-    def add_node(node: SphereNodePanorama):
-        """Add a node to the spatial index."""
-        if len(node.gps) >= 2:
-            lon, lat = node.gps[0], node.gps[1]
-            grid_key = SpatialIndex._get_grid_key(lon, lat)
-            _position_grid[grid_key].append(node.id)
-            _spatial_index[node.id] = node
+        Raises:
+            ValueError: If the snapshot is not readable by this version.
+        """
+        with np.load(path, allow_pickle=False) as snapshot:
+            metadata = json.loads(snapshot["metadata"].tobytes())
+            if metadata.get("version") != SNAPSHOT_VERSION:
+                raise ValueError(
+                    f"Unsupported sphere snapshot version {metadata.get('version')}"
+                )
+            arrays = {name: snapshot[name] for name in _SNAPSHOT_ARRAYS}
+
+        nodes = [SphereNodePanorama.model_validate(node) for node in metadata["nodes"]]
+        if len(nodes) != len(arrays["coordinates"]):
+            raise ValueError("Sphere snapshot node table and arrays do not match")
+
+        index = cls.__new__(cls)
+        index.nodes = {node.id: node for node in nodes}
+        index.built_at = datetime.fromisoformat(metadata["built_at"])
+        index.node_ids = [node.id for node in nodes]
+        index.node_rows = {node_id: row for row, node_id in enumerate(index.node_ids)}
+        index._links = LRUCache(LINKS_CACHE_SIZE)
+        for name, array in arrays.items():
+            setattr(index, name, array)
+        return index, metadata["sources"]
 
     @staticmethod
-    def _compute_distance_and_bearing_matrices():
+    def _cell_coordinates(lon, lat) -> np.ndarray:
+        """
+        Return the (x, y, z) cell coordinates of positions on the 3D grid.
+
+        The positions are on the sphere of radius EARTH_RADIUS, so that the
+        straight line distance between two nodes is at most their distance
+        along the surface, whatever their latitude.
         """
-        Compute distance and bearing matrices for all nodes.
+        lon, lat = np.radians(lon), np.radians(lat)
+        positions = EARTH_RADIUS * np.stack(
+            [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)],
+            axis=-1,
+        )
+        return np.floor(positions / CELL_SIZE).astype(np.int64)
+
+    @staticmethod
+    def _get_cell_key(cells: np.ndarray) -> np.ndarray:
+        """Pack (x, y, z) cell coordinates into one integer key."""
+        cells = cells + _CELL_OFFSET
+        return (
+            (cells[..., 0] << (2 * _CELL_BITS))
+            | (cells[..., 1] << _CELL_BITS)
+            | cells[..., 2]
+        )
 
-        This method creates two N×N matrices where N is the number of nodes:
-        - Distance matrix: Stores the Haversine distance (in meters) between each pair of nodes
-        - Bearing matrix: Stores the compass bearing (in degrees) from each node to every other node
+    @staticmethod
+    def _haversine_distance(lon1, lat1, lon2, lat2):
+        """
+        Calculate Haversine distance between two points in meters.
 
-        The matrices are computed once when data is loaded and cached for efficient neighbor lookup.
-        This approach has O(N²) time complexity during initialization but enables O(1) distance
-        and bearing lookups during neighbor search operations.
+        The coordinates may be NumPy arrays, to compute the distances from a
+        point to many others at once.
         """
-        global _distance_matrix, _bearing_matrix
+        # Convert degrees to radians
+        lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
 
-        node_ids = list(_spatial_index.keys())
-        # n = len(node_ids)
+        # Haversine formula
+        dlon = lon2 - lon1
+        dlat = lat2 - lat1
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+        c = 2 * np.arcsin(np.sqrt(a))
 
-        # Initialize matrices
-        _distance_matrix = {node_id: {} for node_id in node_ids}
-        _bearing_matrix = {node_id: {} for node_id in node_ids}
+        return c * EARTH_RADIUS
 
-        # Compute distances and bearings between all pairs
-        for i, node_id1 in enumerate(node_ids):
-            node1 = _spatial_index[node_id1]
-            if len(node1.gps) < 2:
-                continue
+    @staticmethod
+    def _calculate_bearing(lon1, lat1, lon2, lat2):
+        """
+        Calculate bearing from point 1 to point 2 in degrees.
 
-            lon1, lat1 = node1.gps[0], node1.gps[1]
+        The coordinates may be NumPy arrays, like for _haversine_distance.
+        """
+        lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
 
-            for j, node_id2 in enumerate(node_ids):
-                if i == j:
-                    # Distance to self is 0
-                    _distance_matrix[node_id1][node_id2] = 0.0
-                    _bearing_matrix[node_id1][node_id2] = 0.0
-                    continue
+        dlon = lon2 - lon1
+        y = np.sin(dlon) * np.cos(lat2)
+        x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
 
-                node2 = _spatial_index[node_id2]
-                if len(node2.gps) < 2:
-                    continue
+        bearing = np.degrees(np.arctan2(y, x))
+        return (bearing + 360) % 360  # Normalize to 0-360
 
-                lon2, lat2 = node2.gps[0], node2.gps[1]
+    def candidates(self, node_id: str, max_range: float) -> np.ndarray:
+        """
+        Return the rows of the nodes that may be within max_range of a node,
+        sorted, i.e. the nodes of the cells around it.
 
-                # Compute distance
-                distance = SpatialIndex._haversine_distance(lon1, lat1, lon2, lat2)
-                _distance_matrix[node_id1][node_id2] = distance
+        All the nodes are returned when there are more cells to examine than
+        non-empty cells.
+        """
+        if not max_range >= 0:  # Negative or NaN
+            return np.empty(0, dtype=np.int64)
 
-                # Compute bearing
-                bearing = SpatialIndex._calculate_bearing(lon1, lat1, lon2, lat2)
-                _bearing_matrix[node_id1][node_id2] = bearing
+        # Straight line distance corresponding to max_range along the surface
+        chord = (
+            2 * EARTH_RADIUS * np.sin(min(max_range / (2 * EARTH_RADIUS), np.pi / 2))
+        )
+        reach = int(chord // CELL_SIZE) + 1
+        if (2 * reach + 1) ** 3 > len(self.cell_keys):
+            return np.arange(len(self.node_ids))
+
+        lon, lat = self.coordinates[self.node_rows[node_id]]
+        steps = np.arange(-reach, reach + 1)
+        offsets = np.stack(np.meshgrid(steps, steps, steps), axis=-1).reshape(-1, 3)
+        keys = self._get_cell_key(self._cell_coordinates(lon, lat) + offsets)
+
+        # Positions of the non-empty cells among them
+        positions = np.searchsorted(self.cell_keys, keys)
+        found = positions < len(self.cell_keys)
+        found[found] = self.cell_keys[positions[found]] == keys[found]
+        positions = positions[found]
+        if len(positions) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(
+            np.concatenate(
+                [
+                    self.cell_rows[self.cell_starts[p] : self.cell_starts[p + 1]]
+                    for p in positions
+                ]
+            )
+        )
+
+    def distances_and_bearings(
+        self, node_id: str, rows: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the distances (meters) and bearings (degrees) from a node to
+        the nodes of the given rows, every indexed node if None.
+        """
+        lon, lat = self.coordinates[self.node_rows[node_id]]
+        others = self.coordinates if rows is None else self.coordinates[rows]
+        lons, lats = others[:, 0], others[:, 1]
+        return (
+            self._haversine_distance(lon, lat, lons, lats),
+            self._calculate_bearing(lon, lat, lons, lats),
+        )
 
-    @staticmethod
     def find_neighbors(
-        target_node: SphereNodePanorama, max_range: float, sectors: int
+        self, target_node: SphereNodePanorama, max_range: float, sectors: int
     ) -> List[SphereNode]:
         """
-        Find neighboring nodes using precomputed distance matrix and bearing-based filtering.
+        Find neighboring nodes using distance and bearing-based filtering.
 
         This method implements an efficient neighbor search algorithm:
-        1. Uses the precomputed distance matrix to quickly find all nodes within max_range
+        1. Looks up the candidate nodes in the grid cells around the target node, computes
+           their distances at once (vectorized) and keeps the nodes within max_range
         2. Sorts neighbors by distance (closest first)
         3. Applies minimum angular separation filtering to ensure well-distributed neighbors
         4. Selects at most 'sectors' neighbors, each separated by at least (360°/sectors)/2
@@ -172,35 +362,70 @@ class SpatialIndex:
             logger.warning(f"Target node {target_node.id} has invalid GPS coordinates")
             return []
 
-        if target_node.id not in _distance_matrix:
-            logger.warning(f"Target node {target_node.id} not found in distance matrix")
+        row = self.node_rows.get(target_node.id)
+        if row is None:
+            logger.warning(f"Target node {target_node.id} not found in spatial index")
             return []
 
-        # Get all nodes within max_range distance
-        neighbors_within_range = []
+        return self._to_sphere_nodes(self._neighbor_rows(row, max_range, sectors))
 
-        for other_node_id, distance in _distance_matrix[target_node.id].items():
-            if other_node_id == target_node.id:
-                continue  # Skip self
+    def links(self, node_id: str, max_range: float, sectors: int) -> List[SphereNode]:
+        """
+        Return the neighbors of an indexed node, as find_neighbors.
 
-            if distance <= max_range:
-                other_node = _spatial_index.get(other_node_id)
-                if other_node and len(other_node.gps) >= 2:
-                    bearing = _bearing_matrix[target_node.id][other_node_id]
-                    neighbors_within_range.append((distance, bearing, other_node))
+        The links for the default parameters are read from the navigation
+        graph, the others are computed once then kept in a LRU cache.
+        """
+        if (max_range, sectors) == (DEFAULT_MAX_RANGE, DEFAULT_SECTORS):
+            row = self.node_rows[node_id]
+            start, end = self.graph_starts[row], self.graph_starts[row + 1]
+            return self._to_sphere_nodes(self.graph_rows[start:end])
+
+        key = (node_id, max_range, sectors)
+        links = self._links.get(key)
+        if links is None:
+            links = self.find_neighbors(self.nodes[node_id], max_range, sectors)
+            self._links.put(key, links)
+        return links
+
+    def _build_graph(self, max_range: float, sectors: int):
+        """
+        Compute the links of every node, in compressed sparse row layout: the
+        rows of the neighbors of the node of row i are
+        graph_rows[graph_starts[i]:graph_starts[i + 1]], closest first.
+        """
+        neighbors = [
+            self._neighbor_rows(row, max_range, sectors) for row in range(len(self))
+        ]
+        self.graph_starts = np.zeros(len(neighbors) + 1, dtype=np.int64)
+        np.cumsum([len(rows) for rows in neighbors], out=self.graph_starts[1:])
+        self.graph_rows = np.array(
+            [row for rows in neighbors for row in rows], dtype=np.int64
+        )
 
-        neighbors_within_range.sort(key=lambda x: x[0])
+    def _neighbor_rows(self, row: int, max_range: float, sectors: int) -> List[int]:
+        """Return the rows of the neighbors of the node of a row, see find_neighbors."""
+        node_id = self.node_ids[row]
+
+        # Get the nodes within max_range distance among the candidates of the
+        # cells around the target node, closest first
+        rows = self.candidates(node_id, max_range)
+        rows = rows[rows != row]
+        distances, bearings = self.distances_and_bearings(node_id, rows)
+        within_range = np.flatnonzero(distances <= max_range)
+        order = within_range[np.argsort(distances[within_range], kind="stable")]
 
         # If no neighbors within range, return empty list
-        if not neighbors_within_range:
+        if not len(order):
             return []
 
         # Apply minimum angular separation filtering
-        selected_neighbors = []
+        selected_rows = []
         selected_bearings = []
         min_angular_separation = 360.0 / sectors / 2  # Half of sector width
 
-        for distance, bearing, neighbor_node in neighbors_within_range:
+        for i in order:
+            bearing = float(bearings[i])
             # Check if this neighbor is sufficiently separated from already selected ones
             is_separated = True
             for selected_bearing in selected_bearings:
@@ -212,43 +437,96 @@ class SpatialIndex:
                     break
 
             if is_separated:
-                selected_neighbors.append((distance, bearing, neighbor_node))
+                selected_rows.append(int(rows[i]))
                 selected_bearings.append(bearing)
 
                 # If we have enough neighbors (one per sector), we can stop
-                if len(selected_neighbors) >= sectors:
+                if len(selected_rows) >= sectors:
                     break
 
-        # Convert selected neighbors to SphereNode objects
+        return selected_rows
+
+    def _to_sphere_nodes(self, rows: Iterable[int]) -> List[SphereNode]:
+        """Convert the rows of nodes to SphereNode objects."""
         result_nodes = []
-        for distance, bearing, neighbor_node in selected_neighbors:
+        for row in rows:
+            neighbor_node = self.nodes[self.node_ids[row]]
             result_nodes.append(SphereNode(id=neighbor_node.id, gps=neighbor_node.gps))
-
         return result_nodes
 
 
-async def fetch_geojson_from_url(url: str) -> Dict:
-    """Fetch GeoJSON data from a URL with caching."""
+async def fetch_geojson_from_url(url: str, force_refresh: bool = False) -> Dict:
+    """
+    Fetch GeoJSON data from a URL with caching.
+
+    Concurrent calls for a URL share a single fetch. When the fetch fails,
+    the previously fetched data is returned if any.
+    """
     # Check if we have cached data that's still valid
-    if url in _geojson_cache:
+    if url in _geojson_cache and not force_refresh:
         cached_time = _cache_timestamp.get(url)
         if cached_time and datetime.now() - cached_time < CACHE_TTL:
             logger.info(f"Using cached GeoJSON data for {url}")
             return _geojson_cache[url]
 
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            geojson_data = response.json()
+    return await _geojson_fetches.run(url, _fetch_geojson, url)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the HTTP client of the upstream fetches for the running loop."""
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS, follow_redirects=True
+        )
+        _http_clients[loop] = client
+    return client
 
-            # Cache the data
-            _geojson_cache[url] = geojson_data
-            _cache_timestamp[url] = datetime.now()
-            logger.info(f"Fetched and cached GeoJSON data from {url}")
 
-            return geojson_data
+async def close_http_client():
+    """Close the HTTP client of the running loop, if any."""
+    client = _http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def _fetch_geojson(url: str) -> Dict:
+    try:
+        # Ask for the data only if it changed since the cached version
+        headers = {}
+        if url in _geojson_cache:
+            validators = _geojson_validators.get(url, {})
+            if "etag" in validators:
+                headers["If-None-Match"] = validators["etag"]
+            if "last-modified" in validators:
+                headers["If-Modified-Since"] = validators["last-modified"]
+
+        response = await get_http_client().get(url, headers=headers)
+        if response.status_code == 304 and url in _geojson_cache:
+            _cache_timestamp[url] = datetime.now()
+            logger.info(f"GeoJSON data from {url} not modified")
+            return _geojson_cache[url]
+        response.raise_for_status()
+        geojson_data = response.json()
+
+        # Cache the data
+        _geojson_cache[url] = geojson_data
+        _cache_timestamp[url] = datetime.now()
+        _geojson_validators[url] = {
+            name: response.headers[name]
+            for name in ("etag", "last-modified")
+            if name in response.headers
+        }
+        logger.info(f"Fetched and cached GeoJSON data from {url}")
+
+        return geojson_data
     except Exception as e:
+        if url in _geojson_cache:
+            logger.warning(
+                f"Failed to fetch GeoJSON from {url}, using cached data: {e}"
+            )
+            return _geojson_cache[url]
         logger.error(f"Failed to fetch GeoJSON from {url}: {e}")
         raise HTTPException(
             status_code=500, detail=f"Failed to fetch GeoJSON data from {url}: {str(e)}"
@@ -307,86 +585,244 @@ def parse_geojson_feature_to_sphere_node(
     )
 
 
-async def get_all_sphere_nodes() -> List[SphereNodePanorama]:
-    """Fetch and parse all sphere nodes from all projects."""
-    all_nodes = []
+async def get_all_sphere_nodes(
+    force_refresh: bool = False,
+) -> List[SphereNodePanorama]:
+    """
+    Fetch and parse all sphere nodes from all projects.
 
-    for project_name, project_config in SphereProjectLinks.items():
-        try:
-            geojson_url = project_config["geojson_url"]
-            base_url = project_config.get("base_url", "")
+    The projects are fetched concurrently, and their nodes returned in the
+    order of SphereProjectLinks. A project failing to load has no node.
+    """
+    projects = await asyncio.gather(
+        *[
+            get_project_nodes(project_name, project_config, force_refresh)
+            for project_name, project_config in SphereProjectLinks.items()
+        ]
+    )
+    return [node for nodes in projects for node in nodes]
 
-            geojson_data = await fetch_geojson_from_url(geojson_url)
 
-            if geojson_data.get("type") == "FeatureCollection":
-                features = geojson_data.get("features", [])
+async def get_project_nodes(
+    project_name: str, project_config: Dict, force_refresh: bool = False
+) -> List[SphereNodePanorama]:
+    """Fetch and parse the sphere nodes of a project."""
+    nodes = []
+    try:
+        geojson_url = project_config["geojson_url"]
+        base_url = project_config.get("base_url", "")
+
+        geojson_data = await fetch_geojson_from_url(geojson_url, force_refresh)
+
+        if geojson_data.get("type") == "FeatureCollection":
+            features = geojson_data.get("features", [])
+
+            for feature in features:
+                try:
+                    node = parse_geojson_feature_to_sphere_node(feature, base_url)
+                    # Set the project if not already set in the feature
+                    if not node.project:
+                        node.project = project_name
+                    nodes.append(node)
+                except Exception as e:
+                    logger.error(f"Failed to parse feature in {project_name}: {e}")
+                    continue
 
-                for feature in features:
-                    try:
-                        node = parse_geojson_feature_to_sphere_node(feature, base_url)
-                        # Set the project if not already set in the feature
-                        if not node.project:
-                            node.project = project_name
-                        all_nodes.append(node)
-                    except Exception as e:
-                        logger.error(f"Failed to parse feature in {project_name}: {e}")
-                        continue
+    except Exception as e:
+        logger.error(f"Failed to process project {project_name}: {e}")
 
-        except Exception as e:
-            logger.error(f"Failed to process project {project_name}: {e}")
-            continue
+    return nodes
 
-    return all_nodes
 
+def load_snapshot() -> Optional[SpatialIndex]:
+    """
+    Load the index from the snapshot, blocking.
 
-async def ensure_data_loaded() -> List[SphereNodePanorama]:
-    """Ensure all sphere data is loaded and indexed."""
-    if not _spatial_index:
-        nodes = await get_all_sphere_nodes()
-        for node in nodes:
-            SpatialIndex.add_node(node)
+    The GeoJSON sources stored with it fill the fetch cache, so that the
+    refreshes revalidate them, and fall back to them when upstream is down.
 
-        # Compute distance and bearing matrices
-        SpatialIndex._compute_distance_and_bearing_matrices()
+    Returns:
+        Optional[SpatialIndex]: The index, None if there is no usable snapshot.
+    """
+    if not SNAPSHOT_PATH.exists():
+        return None
+    try:
+        index, sources = SpatialIndex.load(SNAPSHOT_PATH)
+    except Exception as e:
+        logger.warning(f"Failed to load the sphere snapshot {SNAPSHOT_PATH}: {e}")
+        return None
+
+    for url, source in sources.items():
+        if url not in _geojson_cache:
+            _geojson_cache[url] = source["geojson"]
+            _geojson_validators[url] = source["validators"]
+            _cache_timestamp[url] = index.built_at
+    logger.info(f"Loaded {len(index)} sphere nodes from {SNAPSHOT_PATH}")
+    return index
+
+
+def save_snapshot(index: SpatialIndex):
+    """Write the index and its GeoJSON sources to the snapshot, blocking."""
+    sources = {
+        url: {
+            "geojson": _geojson_cache[url],
+            "validators": _geojson_validators.get(url, {}),
+        }
+        for url in (config["geojson_url"] for config in SphereProjectLinks.values())
+        if url in _geojson_cache
+    }
+    try:
+        index.save(SNAPSHOT_PATH, sources)
+    except OSError as e:
+        logger.warning(f"Failed to write the sphere snapshot {SNAPSHOT_PATH}: {e}")
 
-        logger.info(f"Loaded and indexed {len(nodes)} sphere nodes")
-        logger.info(
-            f"Computed distance and bearing matrices for {len(_distance_matrix)} nodes"
-        )
-        return nodes
-    return list(_spatial_index.values())
+
+async def refresh_sphere_index() -> SpatialIndex:
+    """
+    Fetch the sphere data, build a new index off the event loop, then replace
+    the current index with it and write it to the snapshot.
+    """
+    global _sphere_index
+
+    try:
+        nodes = await get_all_sphere_nodes(force_refresh=True)
+        index = await run_blocking(SpatialIndex, nodes, group="spheres")
+        await get_geojson_payload(index)
+    except Exception as e:
+        logger.error(f"Failed to refresh the sphere index: {e}")
+        raise
+    _sphere_index = index
+    logger.info(f"Loaded and indexed {len(index)} sphere nodes")
+    # An empty index (upstream unavailable) does not replace a good snapshot
+    if len(index):
+        await run_blocking(save_snapshot, index, group="spheres")
+    return index
+
+
+async def load_sphere_index() -> SpatialIndex:
+    """
+    Load the first index of the worker, from the snapshot if there is one,
+    from the upstream sources otherwise.
+    """
+    global _sphere_index
+
+    index = await run_blocking(load_snapshot, group="spheres")
+    if index is None:
+        return await refresh_sphere_index()
+    await get_geojson_payload(index)
+    _sphere_index = index
+    return index
+
+
+def render_geojson(index: SpatialIndex) -> RenderedPayload:
+    """Render the GeoJSON response of an index, blocking."""
+    geojson = SphereGeojson.from_sphere_nodes(list(index.nodes.values()))
+    return render_payload(geojson.model_dump_json().encode())
+
+
+async def get_geojson_payload(index: SpatialIndex) -> RenderedPayload:
+    """Return the GeoJSON response of an index, rendering it on first use."""
+    payload = _geojson_payloads.get(index)
+    if payload is None:
+        payload = await _geojson_renders.run(index, _render_geojson_payload, index)
+    return payload
+
+
+async def _render_geojson_payload(index: SpatialIndex) -> RenderedPayload:
+    payload = await run_blocking(render_geojson, index, group="spheres")
+    _geojson_payloads[index] = payload
+    return payload
+
+
+def schedule_refresh() -> asyncio.Future:
+    """Refresh the index in the background, unless a refresh is in progress."""
+    return _index_builds.start("index", refresh_sphere_index)
+
+
+async def ensure_data_loaded() -> SpatialIndex:
+    """
+    Return the current sphere index.
+
+    A stale index is still served while a new one is built in the background.
+    Only the requests arriving before the first index of the worker is loaded
+    wait for it, sharing a single load.
+    """
+    index = _sphere_index
+    if index is None:
+        return await _index_builds.run("index", load_sphere_index)
+    if index.is_stale():
+        schedule_refresh()
+    return index
+
+
+async def refresh_periodically():
+    """
+    Load the index, then refresh it each time it is stale: CACHE_TTL after
+    it was built, or RETRY_INTERVAL after a failure.
+    """
+    while True:
+        try:
+            index = _sphere_index
+            if index is None:
+                index = await _index_builds.run("index", load_sphere_index)
+            if index.is_stale():
+                index = await _index_builds.run("index", refresh_sphere_index)
+            interval = max(index.stale_in(), RETRY_INTERVAL.total_seconds())
+        except Exception:
+            interval = RETRY_INTERVAL.total_seconds()
+        await asyncio.sleep(interval)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Load the sphere index (from the snapshot if any) in the background, then
+    keep it up to date.
+    """
+    task = asyncio.create_task(refresh_periodically())
+    yield
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await close_http_client()
+
+
+router = APIRouter(lifespan=lifespan)
 
 
 @router.get("/geojson", response_model=SphereGeojson)
-async def get_sphere_geojson() -> SphereGeojson:
+async def get_sphere_geojson(request: Request):
     """
     Return the GeoJSON of all sphere nodes from all projects to be displayed by Leaflet.
 
     This endpoint fetches and caches GeoJSON data from configured sphere projects,
     parses the features into SphereNodePanorama objects, and returns them in a
-    standardized GeoJSON FeatureCollection format.
+    standardized GeoJSON FeatureCollection format. The response is rendered and
+    compressed once per version of the sphere data, and served with an ETag.
 
     Returns:
         SphereGeojson: A GeoJSON FeatureCollection containing all available sphere nodes
                       with their positions, panorama URLs, and metadata
     """
-    nodes = await ensure_data_loaded()
-    return SphereGeojson.from_sphere_nodes(nodes)
+    index = await ensure_data_loaded()
+    payload = await get_geojson_payload(index)
+    return payload_response(request, payload, GEOJSON_CACHE_CONTROL)
 
 
 @router.get("/{node_id}", response_model=SphereNodePanorama)
 async def get_sphere_panorama_and_links(
-    node_id: str, max_range: float = 10000, sectors: int = 5
+    node_id: str, max_range: float = DEFAULT_MAX_RANGE, sectors: int = DEFAULT_SECTORS
 ) -> SphereNodePanorama:
     """
     Return the detail of one sphere with neighboring nodes within a distance of
     max_range (default 10000m) from the target sphere.
 
-    The algorithm uses a precomputed distance matrix for efficient neighbor search
-    and applies bearing-based filtering to ensure neighbors are well-distributed
+    The algorithm looks up the nodes of the grid cells around the target sphere,
+    computes their distances at once (vectorized) and applies bearing-based filtering to ensure neighbors are well-distributed
     around the target node. For each angular sector (360°/sectors), it selects
     the closest neighbor that maintains a minimum angular separation of
-    (360°/sectors)/2 from already selected neighbors.
+    (360°/sectors)/2 from already selected neighbors. The neighbors for the
+    default parameters are computed for every sphere when the data is loaded,
+    and the others cached.
 
     Args:
 
@@ -402,17 +838,17 @@ async def get_sphere_panorama_and_links(
                            filtered list of neighboring nodes
     """
     # Ensure data is loaded
-    await ensure_data_loaded()
+    index = await ensure_data_loaded()
 
     # Find the target node
-    target_node = _spatial_index.get(node_id)
+    target_node = index.nodes.get(node_id)
     if not target_node:
         raise HTTPException(
             status_code=404, detail=f"Sphere node with id {node_id} not found"
         )
 
     # Find neighbors using spatial indexing
-    neighbors = SpatialIndex.find_neighbors(target_node, max_range, int(sectors))
+    neighbors = index.links(target_node.id, max_range, int(sectors))
 
     # Create a copy of the target node with neighbors
     result = SphereNodePanorama(
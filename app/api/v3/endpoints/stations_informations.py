@@ -1,8 +1,12 @@
-from fastapi import HTTPException, APIRouter
-import json
+from fastapi import HTTPException, APIRouter, Request
 from pathlib import Path
+from typing import Dict
+from pydantic import TypeAdapter
 from app.models.stations import StationMetadata, StationIDModel
+from app.utils.cache import file_cache
 from app.utils.error import handle_validation_error
+from app.utils.executor import run_blocking
+from app.utils.response import StationPayloads, payload_response, render_payload
 
 # Get the router from parent
 router = APIRouter()
@@ -12,87 +16,72 @@ STATIONS_FILE = Path("./data/000_stations_status/all_dict.json")
 ONLINE_STATIONS_FILE = Path("./data/000_stations_status/online_dict.json")
 OFFLINE_STATIONS_FILE = Path("./data/000_stations_status/offline_dict.json")
 
+# The clients may store the responses but must revalidate them (ETag)
+CACHE_CONTROL = "no-cache"
 
-@router.get("/online", response_model=dict[str, StationMetadata])
-async def get_online_stations():
-    """Get information for online stations"""
+StationsAdapter = TypeAdapter(Dict[str, StationMetadata])
+
+
+def render_stations(content: bytes) -> StationPayloads:
+    """Validate a stations status file and render its responses."""
+    stations = StationsAdapter.validate_json(content)
+    return StationPayloads(
+        stations=render_payload(StationsAdapter.dump_json(stations)),
+        by_station={
+            station_id: render_payload(station.model_dump_json().encode())
+            for station_id, station in stations.items()
+        },
+    )
+
+
+def load_stations(file_path: Path) -> StationPayloads:
+    """Load the rendered responses of a stations status file, cached until it changes."""
     try:
-        with open(ONLINE_STATIONS_FILE) as f:
-            stations = json.load(f)
-        return stations
+        return file_cache.get(file_path, render_stations)
     except FileNotFoundError:
         raise HTTPException(
             status_code=503,
             detail="The service is temporarily unavailable. Please try again later.",
         )
-    except json.JSONDecodeError:
+    except ValueError:
         raise HTTPException(
             status_code=500,
             detail="An unexpected error occurred while processing your request.",
         )
 
 
+@router.get("/online", response_model=dict[str, StationMetadata])
+async def get_online_stations(request: Request):
+    """Get information for online stations"""
+    payloads = await run_blocking(load_stations, ONLINE_STATIONS_FILE, group="stations")
+    return payload_response(request, payloads.stations, CACHE_CONTROL)
+
+
 @router.get("/offline", response_model=dict[str, StationMetadata])
-async def get_offline_stations():
+async def get_offline_stations(request: Request):
     """Get information for offline stations"""
-    try:
-        with open(OFFLINE_STATIONS_FILE) as f:
-            stations = json.load(f)
-        return stations
-    except FileNotFoundError:
-        raise HTTPException(
-            status_code=503,
-            detail="The service is temporarily unavailable. Please try again later.",
-        )
-    except json.JSONDecodeError:
-        raise HTTPException(
-            status_code=500,
-            detail="An unexpected error occurred while processing your request.",
-        )
+    payloads = await run_blocking(
+        load_stations, OFFLINE_STATIONS_FILE, group="stations"
+    )
+    return payload_response(request, payloads.stations, CACHE_CONTROL)
 
 
 @router.get("/", response_model=dict[str, StationMetadata])
-async def get_all_stations():
+async def get_all_stations(request: Request):
     """Get information for all stations"""
-    try:
-        with open(STATIONS_FILE) as f:
-            stations = json.load(f)
-        return stations
-    except FileNotFoundError:
-        raise HTTPException(
-            status_code=503,
-            detail="The service is temporarily unavailable. Please try again later.",
-        )
-    except json.JSONDecodeError:
-        raise HTTPException(
-            status_code=500,
-            detail="An unexpected error occurred while processing your request.",
-        )
+    payloads = await run_blocking(load_stations, STATIONS_FILE, group="stations")
+    return payload_response(request, payloads.stations, CACHE_CONTROL)
 
 
 @router.get("/{station_id}", response_model=StationMetadata)
-async def get_station(station_id: str):
+async def get_station(station_id: str, request: Request):
     """Get information for a specific station"""
 
     handle_validation_error(StationIDModel, id=station_id)
 
-    try:
-        with open(STATIONS_FILE) as f:
-            stations = json.load(f)
+    payloads = await run_blocking(load_stations, STATIONS_FILE, group="stations")
 
-        if station_id not in stations:
-            raise HTTPException(
-                status_code=404, detail=f"Station {station_id} not found"
-            )
+    if station_id not in payloads.by_station:
+        raise HTTPException(status_code=404, detail=f"Station {station_id} not found")
 
-        return stations[station_id]
-    except FileNotFoundError:
-        raise HTTPException(
-            status_code=503,
-            detail="The service is temporarily unavailable. Please try again later.",
-        )
-    except json.JSONDecodeError:
-        raise HTTPException(
-            status_code=500,
-            detail="An unexpected error occurred while processing your request.",
-        )
+    return payload_response(request, payloads.by_station[station_id], CACHE_CONTROL)
@@ -1,9 +1,20 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.api.v3.router import api_router
+from app.utils.executor import executor_stats, loop_lag_monitor, shutdown_executors
 from fastapi.middleware.cors import CORSMiddleware
 import os
 
-app = FastAPI(title="SWI MetObs API", version="v3.0.1")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loop_lag_monitor.start()
+    yield
+    await loop_lag_monitor.stop()
+    await shutdown_executors()
+
+
+app = FastAPI(title="SWI MetObs API", version="v3.0.1", lifespan=lifespan)
 
 # Read the environment variable for allowed origins
 allowed_origins = os.getenv("CORS_ALLOWED_ORIGINS", "").split(",")
@@ -18,3 +29,13 @@ app.add_middleware(
 )
 
 app.include_router(api_router, prefix="/v3")
+
+
+@app.get("/health", tags=["Health"])
+async def health():
+    """Report the event loop lag and the load of the blocking worker pools."""
+    return {
+        "status": "ok",
+        "event_loop_lag": loop_lag_monitor.stats(),
+        "executors": executor_stats(),
+    }
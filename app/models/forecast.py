@@ -2,6 +2,8 @@ from pydantic import BaseModel, field_validator
 from typing import List, Optional, Literal
 import re
 
+from app.utils.velocity import parse_bbox
+
 
 class ForecastFile(BaseModel):
     model: str
@@ -12,6 +14,24 @@ class ForecastFile(BaseModel):
 ForecastResponse = List[ForecastFile]
 
 
+class ForecastManifestSeries(BaseModel):
+    # The variable for the COG files, {prefix}_{variable} for the velocity files
+    name: str
+    file_type: Literal["cog", "velocity"]
+    updated_at: str
+    timestamps: List[str]
+    file_paths: List[str]
+
+
+class ForecastManifestModel(BaseModel):
+    model: str
+    series: List[ForecastManifestSeries]
+
+
+class ForecastManifest(BaseModel):
+    models: List[ForecastManifestModel]
+
+
 class ForecastRequestModel(BaseModel):
     variable: str
     models: Optional[List[str]] = None
@@ -50,3 +70,64 @@ class ForecastRequestModel(BaseModel):
                     f"Invalid model name: '{model}'. Only letters, numbers, '_', and '-' are allowed."
                 )
         return v
+
+
+class VelocitySubsetRequestModel(BaseModel):
+    bbox: Optional[str] = None
+    stride: Optional[int] = None
+    zoom: Optional[int] = None
+
+    @field_validator("bbox")
+    def validate_bbox(cls, v: Optional[str]) -> Optional[str]:
+        """Ensure the bounding box is west,south,east,north in degrees."""
+        if v is not None:
+            parse_bbox(v)
+        return v
+
+    @field_validator("stride")
+    def validate_stride(cls, v: Optional[int]) -> Optional[int]:
+        if v is not None and not 1 <= v <= 100:
+            raise ValueError("Stride must be between 1 and 100")
+        return v
+
+    @field_validator("zoom")
+    def validate_zoom(cls, v: Optional[int]) -> Optional[int]:
+        if v is not None and not 0 <= v <= 20:
+            raise ValueError("Zoom must be between 0 and 20")
+        return v
+
+
+class PointForecastRequestModel(ForecastRequestModel):
+    lat: float
+    lon: float
+
+    @field_validator("lat")
+    def validate_lat(cls, v: float) -> float:
+        if not -90 <= v <= 90:
+            raise ValueError("Latitude must be between -90 and 90")
+        return v
+
+    @field_validator("lon")
+    def validate_lon(cls, v: float) -> float:
+        if not -180 <= v <= 360:
+            raise ValueError("Longitude must be between -180 and 360")
+        return v
+
+
+class PointForecastValue(BaseModel):
+    timestamp: str
+    u: Optional[float] = None
+    v: Optional[float] = None
+    speed: Optional[float] = None
+    direction: Optional[float] = None
+
+
+class PointForecast(BaseModel):
+    model: str
+    variable: str
+    lat: float
+    lon: float
+    values: List[PointForecastValue]
+
+
+PointForecastResponse = List[PointForecast]
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, field_validator
-from typing import List, Literal, Optional
+from pydantic import BaseModel, field_validator, model_validator
+from typing import Any, Dict, List, Literal, Optional
 from datetime import datetime
 import re
 
@@ -102,6 +102,7 @@ class StationDataRequestModel(StationIDModel):
     end_date: str
     variables: Optional[List[str]] = None
     resample: bool = False
+    downsample: Optional[Literal["lttb", "minmax", "mean"]] = None
 
     @field_validator("start_date", "end_date")
     def validate_iso_date(cls, v: str) -> str:
@@ -122,3 +123,71 @@ class StationDataRequestModel(StationIDModel):
                     f"Invalid variable name: '{var}'. Only letters, numbers, '_', and '-' are allowed."
                 )
         return v
+
+
+class StationExportRequestModel(DateRangeModel):
+    stations: List[str]
+    variables: Optional[List[str]] = None
+    format: Literal["ndjson", "csv", "parquet"] = "ndjson"
+
+    @field_validator("stations")
+    def validate_station_ids(cls, v: List[str]) -> List[str]:
+        if not v:
+            raise ValueError("At least one station is required.")
+        for station_id in v:
+            StationIDModel(id=station_id)
+        return v
+
+    @field_validator("variables", mode="before")
+    def validate_variable_names(cls, v: Optional[List[str]]) -> Optional[List[str]]:
+        if v is None:
+            return v
+        pattern = re.compile(r"^[a-zA-Z0-9_-]+$")
+        for var in v:
+            if not pattern.match(var):
+                raise ValueError(
+                    f"Invalid variable name: '{var}'. Only letters, numbers, '_', and '-' are allowed."
+                )
+        return v
+
+
+class StationColumnarTimeseries(StationIDModel):
+    offsets: List[int]
+    timestamps: List[datetime]
+    variables: Dict[str, List[Any]]
+
+
+class ObservationTimeline(BaseModel):
+    start_offset: int
+    end_offset: int
+    offsets: List[int]
+    stations: List[StationColumnarTimeseries]
+
+
+class ObservationTimelineRequestModel(BaseModel):
+    start_offset: int
+    end_offset: int
+    stations: Optional[List[str]] = None
+    variables: Optional[List[str]] = None
+
+    @field_validator("stations")
+    def validate_station_ids(cls, v: Optional[List[str]]) -> Optional[List[str]]:
+        for station_id in v or []:
+            StationIDModel(id=station_id)
+        return v
+
+    @field_validator("variables")
+    def validate_variable_names(cls, v: Optional[List[str]]) -> Optional[List[str]]:
+        pattern = re.compile(r"^[a-zA-Z0-9_-]+$")
+        for var in v or []:
+            if not pattern.match(var):
+                raise ValueError(
+                    f"Invalid variable name: '{var}'. Only letters, numbers, '_', and '-' are allowed."
+                )
+        return v
+
+    @model_validator(mode="after")
+    def validate_offset_order(self):
+        if self.start_offset > self.end_offset:
+            raise ValueError("start_offset must be lower than or equal to end_offset.")
+        return self
@@ -0,0 +1,228 @@
+"""
+In-memory cache of parsed data files, invalidated when the file changes.
+
+The data files are rewritten every few minutes by the data pipeline while they
+are read on every request. ``FileCache`` keeps the parsed content in memory
+and only reloads a file when its stat signature (mtime, size, inode) changes.
+
+The files may be replaced while they are read. A read is retried when the
+signature changed during it, and if the content can not be parsed (a half
+written file) the previously loaded value is served until the next change.
+
+``HotFileStore`` keeps a fixed set of files loaded in memory and refreshes
+them in the background, so that the requests are served without any I/O.
+
+``LRUCache`` keeps the most recently used values computed from those.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple, Union
+
+from loguru import logger
+
+from app.utils.executor import run_blocking
+
+PathLike = Union[str, Path]
+Signature = Tuple[int, int, int]
+
+MAX_READ_ATTEMPTS = 3
+
+
+def signature(path: PathLike) -> Signature:
+    """Return the (mtime_ns, size, inode) signature of a file."""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class FileCache:
+    """
+    Cache the value loaded from each file until the file changes.
+
+    The values are shared between the callers and must not be modified.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Hashable, Tuple[Signature, Any]] = {}
+        self._locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key: Hashable) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, path: PathLike, loader: Callable[[bytes], Any] = json.loads) -> Any:
+        """
+        Return the value loaded from a file, reloading it if it changed.
+
+        Args:
+            path: The file.
+            loader: Parse the content of the file. Each loader has its own
+                    entry for the same file.
+
+        Returns:
+            The loaded value.
+
+        Raises:
+            FileNotFoundError: If the file does not exist.
+            ValueError: If the file can not be parsed and was never loaded.
+        """
+        key = (str(path), loader)
+        current = signature(path)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == current:
+            return entry[1]
+
+        with self._key_lock(key):
+            # Another thread may have reloaded the file meanwhile
+            entry = self._entries.get(key)
+            for _ in range(MAX_READ_ATTEMPTS):
+                if entry is not None and entry[0] == current:
+                    return entry[1]
+                with open(path, "rb") as f:
+                    content = f.read()
+                after = signature(path)
+                if after == current:
+                    break
+                # Replaced while reading, read again
+                current = after
+
+            try:
+                value = loader(content)
+            except ValueError as e:
+                if entry is None:
+                    raise
+                logger.warning(
+                    "Could not parse {}, serving the previous version: {}".format(
+                        path, e
+                    )
+                )
+                return entry[1]
+
+            self._entries[key] = (current, value)
+            return value
+
+    def clear(self):
+        """Remove all the entries."""
+        with self._lock:
+            self._entries.clear()
+            self._locks.clear()
+
+
+file_cache = FileCache()
+
+
+class HotFileStore:
+    """
+    Keep the values loaded from a fixed set of files in memory.
+
+    The files are preloaded and periodically refreshed (through a FileCache,
+    so only the files that changed are parsed again) by ``run``, so reading a
+    value does not touch the disk. A value that was not refreshed for more
+    than ``max_staleness`` seconds, e.g. when ``run`` is not running, is
+    checked again on access.
+    """
+
+    def __init__(
+        self,
+        paths: Dict[Hashable, PathLike],
+        loader: Callable[[bytes], Any] = json.loads,
+        max_staleness: float = 30.0,
+        cache: FileCache = file_cache,
+        group: str = "default",
+    ):
+        self.paths = paths
+        self.loader = loader
+        self.max_staleness = max_staleness
+        self.group = group
+        self._cache = cache
+        self._values: Dict[Hashable, Tuple[float, Any]] = {}
+
+    def load(self, key: Hashable) -> Any:
+        """
+        Load the value of a file, blocking: only re-parsed if the file changed.
+
+        Raises:
+            KeyError: If the key is unknown.
+            FileNotFoundError: If the file does not exist.
+            ValueError: If the file can not be parsed and was never loaded.
+        """
+        try:
+            value = self._cache.get(self.paths[key], self.loader)
+        except FileNotFoundError:
+            self._values.pop(key, None)
+            raise
+        self._values[key] = (time.monotonic(), value)
+        return value
+
+    def refresh(self) -> int:
+        """Reload the files that changed, blocking. Return how many did."""
+        changed = 0
+        for key in self.paths:
+            previous = self._values.get(key, (None, None))[1]
+            try:
+                if self.load(key) is not previous:
+                    changed += 1
+            except (FileNotFoundError, ValueError) as e:
+                logger.warning("Could not load {}: {}".format(self.paths[key], e))
+        return changed
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """Return the value in memory if it is fresh enough, else None."""
+        entry = self._values.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.max_staleness:
+            return None
+        return entry[1]
+
+    async def get(self, key: Hashable) -> Any:
+        """Return the value of a file, from memory when it is fresh enough."""
+        value = self.peek(key)
+        if value is None:
+            value = await run_blocking(self.load, key, group=self.group)
+        return value
+
+    async def run(self, interval: float):
+        """Refresh the files every interval seconds, until cancelled."""
+        while True:
+            try:
+                changed = await run_blocking(self.refresh, group=self.group)
+                if changed:
+                    logger.info("Reloaded {} file(s)".format(changed))
+            except Exception as e:
+                logger.error("Error refreshing the files: {}".format(e))
+            await asyncio.sleep(interval)
+
+
+class LRUCache:
+    """Thread safe mapping keeping the ``maxsize`` most recently used items."""
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -0,0 +1,195 @@
+"""
+Shape-preserving downsampling of timeseries for charts.
+
+The methods reduce an input longer than ``n_out`` points:
+
+- lttb: Largest-Triangle-Three-Buckets, keeps the ``n_out`` rows that best
+  preserve the visual shape of the (normalised) numeric variables.
+- minmax: min/max envelope, keeps the rows of the minimum and maximum of
+  every variable in each bucket, at the time they occur. The number of
+  buckets is the largest for which these rows fit in ``n_out``, so fewer
+  points may be returned.
+- mean: ``n_out`` equal-count bucket averages.
+"""
+
+from typing import Literal
+
+import numpy as np
+import pandas as pd
+
+from app.utils.historical import LOCATION_COLUMNS
+
+DownsamplingMethod = Literal["lttb", "minmax", "mean"]
+
+
+def _bucket_starts(n: int, n_buckets: int) -> np.ndarray:
+    """Start positions of n_buckets consecutive buckets of (almost) equal size."""
+    return (np.arange(n_buckets) * n) // n_buckets
+
+
+def _signal_columns(df: pd.DataFrame) -> list:
+    return [c for c in df.select_dtypes("number").columns if c not in LOCATION_COLUMNS]
+
+
+def _normalise(values: np.ndarray) -> np.ndarray:
+    """Scale each column to [0, 1] so that every variable weighs the same."""
+    with np.errstate(invalid="ignore"):
+        low = np.nanmin(values, axis=0) if values.size else 0
+        span = np.nanmax(values, axis=0) - low if values.size else 1
+    span = np.where(np.isfinite(span) & (span > 0), span, 1.0)
+    return np.nan_to_num((values - low) / span)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Select n_out row positions with the Largest-Triangle-Three-Buckets method.
+
+    The first and last points are always kept. For each bucket, the point
+    forming the largest triangle with the previously selected point and the
+    average of the next bucket is kept. With several columns in ``y`` the
+    triangle areas of every column are summed.
+
+    Args:
+        x: The x coordinates (e.g. seconds), shape (n,).
+        y: The values, shape (n, k), without NaN.
+        n_out: The number of points to keep.
+    """
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1][:n_out])
+
+    # Buckets between the first and last points
+    edges = 1 + _bucket_starts(n - 2, n_out - 2)
+    edges = np.append(edges, n - 1)
+    sizes = np.diff(edges)
+    # Average of every bucket, the "next bucket" of the last one is the last point
+    avg_x = np.add.reduceat(x[:-1], edges[:-1]) / sizes
+    avg_y = np.add.reduceat(y[:-1], edges[:-1], axis=0) / sizes[:, None]
+    avg_x = np.append(avg_x[1:], x[-1])
+    avg_y = np.vstack([avg_y[1:], y[-1:]])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        area = np.abs(
+            (x[a] - avg_x[i]) * (y[start:end] - y[a])
+            - (x[a] - x[start:end, None]) * (avg_y[i] - y[a])
+        ).sum(axis=1)
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def _lttb(df: pd.DataFrame, n_out: int) -> pd.DataFrame:
+    x = df.index.as_unit("ns").asi8
+    x = (x - x[0]) / 1e9
+    columns = _signal_columns(df)
+    y = (
+        _normalise(df[columns].to_numpy(dtype=float))
+        if columns
+        else np.zeros((len(x), 1))
+    )
+    return df.iloc[lttb_indices(x, y, n_out)]
+
+
+def _extreme_rows(values: np.ndarray, n_buckets: int) -> np.ndarray:
+    """
+    Row positions of the first minimum and maximum of every column, in each of
+    n_buckets equal-count buckets, sorted and without duplicates.
+    """
+    n = len(values)
+    starts = _bucket_starts(n, n_buckets)
+    sizes = np.diff(np.append(starts, n))
+    positions = np.arange(n)[:, None]
+    rows = []
+    with np.errstate(invalid="ignore"):
+        extremes = (
+            np.fmin.reduceat(values, starts, axis=0),
+            np.fmax.reduceat(values, starts, axis=0),
+        )
+    for extreme in extremes:
+        # Buckets without any value of a column have no extreme (n)
+        first = np.minimum.reduceat(
+            np.where(values == np.repeat(extreme, sizes, axis=0), positions, n),
+            starts,
+            axis=0,
+        )
+        rows.append(first.ravel())
+    rows = np.unique(np.concatenate(rows))
+    return rows[rows < n]
+
+
+def _minmax(df: pd.DataFrame, n_out: int) -> pd.DataFrame:
+    n = len(df)
+    columns = _signal_columns(df)
+    if not columns:
+        return df.iloc[_bucket_starts(n, n_out)]
+    values = df[columns].to_numpy(dtype=float)
+
+    # The extremes of the variables fall on different rows: find the largest
+    # number of buckets whose extreme rows fit in n_out
+    low = max(1, n_out // (2 * len(columns)))
+    high = max(low, n_out // 2)
+    rows = _extreme_rows(values, low)
+    while low < high:
+        middle = (low + high + 1) // 2
+        candidate = _extreme_rows(values, middle)
+        if len(candidate) <= n_out:
+            rows, low = candidate, middle
+        else:
+            high = middle - 1
+    if len(rows) > n_out:  # More variables than points
+        rows = rows[_bucket_starts(len(rows), n_out)]
+    return df.iloc[rows]
+
+
+def _mean(df: pd.DataFrame, n_out: int) -> pd.DataFrame:
+    n = len(df)
+    starts = _bucket_starts(n, n_out)
+    sizes = np.diff(np.append(starts, n))
+    numeric = df.select_dtypes("number")
+    values = numeric.to_numpy(dtype=float)
+    valid = ~np.isnan(values)
+
+    sums = np.add.reduceat(np.where(valid, values, 0), starts, axis=0)
+    counts = np.add.reduceat(valid, starts, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(counts > 0, sums / counts, np.nan)
+
+    # Each bucket is located at the average time of its samples
+    timestamps = df.index.as_unit("ns").asi8
+    offsets = np.add.reduceat(timestamps - timestamps[0], starts) // sizes
+    index = df.index[:1].as_unit("ns").repeat(n_out)
+    index = (index + pd.to_timedelta(offsets, unit="ns")).as_unit(df.index.unit)
+    return pd.DataFrame(means, index=index, columns=numeric.columns)
+
+
+def downsample_timeseries(
+    df: pd.DataFrame, n_out: int, method: DownsamplingMethod = "lttb"
+) -> pd.DataFrame:
+    """
+    Reduce a timeseries to n_out points.
+
+    Args:
+        df: The timeseries, indexed by timestamp and sorted in time.
+        n_out: The number of points to return.
+        method: One of 'lttb', 'minmax' or 'mean'.
+
+    Returns:
+        pd.DataFrame: The downsampled timeseries, unchanged if it already has
+        at most n_out points. 'lttb' and 'minmax' return rows of the input,
+        'mean' only keeps numeric columns.
+    """
+    if len(df) <= n_out:
+        return df
+    if method == "lttb":
+        return _lttb(df, n_out)
+    if method == "minmax":
+        return _minmax(df, n_out)
+    if method == "mean":
+        return _mean(df, n_out)
+    raise ValueError(f"Unknown downsampling method: {method}")
@@ -0,0 +1,206 @@
+"""
+Content encodings of the gzipped files served as they are stored.
+
+The files are stored gzipped. For clients that do not accept gzip they are
+decompressed on the fly, chunk by chunk. For clients accepting a better
+encoding (brotli, zstd), the file is re-encoded once in the background into
+a sibling file next to the original (``name.json.gz`` -> ``name.json.br``),
+which is served from then on. The siblings whose original was removed are
+deleted when a new sibling is written in the directory (see remove_orphans),
+so that listing the directories has no side effect. When a
+directory turns out to be read-only, its files are no longer re-encoded and
+are served gzipped.
+
+brotli and zstd are optional, install the ``compression`` extra.
+"""
+
+import errno
+import gzip
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Set
+
+from loguru import logger
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+CHUNK_SIZE = 64 * 1024
+BROTLI_QUALITY = 9
+ZSTD_LEVEL = 19
+
+SIBLING_SUFFIXES = {"br": ".br", "zstd": ".zst"}
+# Suffix of the siblings, mapped to the suffix of their source
+DERIVED_SUFFIXES = {
+    f".json{suffix}": ".json.gz" for suffix in SIBLING_SUFFIXES.values()
+}
+
+# Errors of a directory the siblings cannot be written to
+READ_ONLY_ERRORS = {errno.EACCES, errno.EPERM, errno.EROFS}
+
+_encoding_in_progress: Set[Path] = set()
+_read_only_directories: Set[Path] = set()
+_lock = threading.Lock()
+
+
+def available_reencodings() -> List[str]:
+    """The encodings that files can be re-encoded to, in order of preference."""
+    encodings = []
+    if brotli is not None:
+        encodings.append("br")
+    if zstandard is not None:
+        encodings.append("zstd")
+    return encodings
+
+
+def can_reencode(path: Path) -> bool:
+    """Whether the siblings of a file can be written, as far as is known."""
+    return path.parent not in _read_only_directories
+
+
+def sibling_path(path: Path, encoding: str) -> Path:
+    """Return the path of the re-encoded sibling of a gzipped file."""
+    return path.with_name(path.name.removesuffix(".gz") + SIBLING_SUFFIXES[encoding])
+
+
+def is_fresh(sibling: Path, source_stat: os.stat_result) -> bool:
+    """Whether a sibling was encoded from the current version of its source."""
+    try:
+        return os.stat(sibling).st_mtime_ns == source_stat.st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def fresh_reencodings(path: Path, source_stat: os.stat_result) -> List[str]:
+    """The encodings whose sibling of a gzipped file is up to date."""
+    return [
+        encoding
+        for encoding in available_reencodings()
+        if is_fresh(sibling_path(path, encoding), source_stat)
+    ]
+
+
+def iter_gunzip(path: Path, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Decompress a gzipped file chunk by chunk."""
+    with gzip.open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def _compressor(encoding: str):
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    if encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        return compressor.compress, compressor.flush
+    raise ValueError(f"Unknown encoding: {encoding}")
+
+
+def write_sibling(sibling: Path, chunks: Iterable[bytes], source_stat: os.stat_result):
+    """
+    Write a file derived from a source file next to it, blocking.
+
+    The file is written to a temporary file then renamed, and gets the
+    modification time of its source to detect when it is outdated.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=sibling.parent, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as output:
+            for chunk in chunks:
+                output.write(chunk)
+        os.utime(tmp_path, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+        os.replace(tmp_path, sibling)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def encode_sibling(path: Path, encoding: str) -> bool:
+    """
+    Re-encode a gzipped file into its sibling, blocking.
+
+    See write_sibling.
+
+    Returns:
+        bool: False if the sibling is already being encoded, or cannot be
+        written because the directory is read-only (see can_reencode).
+    """
+    sibling = sibling_path(path, encoding)
+    with _lock:
+        if sibling in _encoding_in_progress or not can_reencode(path):
+            return False
+        _encoding_in_progress.add(sibling)
+
+    try:
+        source_stat = os.stat(path)
+        process, finish = _compressor(encoding)
+
+        def chunks():
+            for chunk in iter_gunzip(path):
+                yield process(chunk)
+            yield finish()
+
+        try:
+            write_sibling(sibling, chunks(), source_stat)
+        except OSError as e:
+            if e.errno not in READ_ONLY_ERRORS:
+                raise
+            with _lock:
+                _read_only_directories.add(path.parent)
+            logger.warning(
+                "Not re-encoding the files of {}, it is read-only: {}".format(
+                    path.parent, e
+                )
+            )
+            return False
+        logger.info("Encoded {} to {}".format(path, sibling.name))
+        return True
+    finally:
+        with _lock:
+            _encoding_in_progress.discard(sibling)
+
+
+def remove_orphans(directory: Path, suffixes: Dict[str, str]) -> bool:
+    """
+    Remove the files derived from a source file that was removed, blocking.
+
+    Called by the writers of the derived files, after writing one.
+
+    Args:
+        directory: The directory of the files.
+        suffixes: The suffix of the derived files, mapped to the suffix of
+                  their source (e.g. DERIVED_SUFFIXES).
+
+    Returns:
+        bool: Whether files were removed.
+    """
+    try:
+        names = set(os.listdir(directory))
+    except FileNotFoundError:
+        return False
+    removed = False
+    for name in names:
+        for suffix, source_suffix in suffixes.items():
+            if not name.endswith(suffix):
+                continue
+            if name.removesuffix(suffix) + source_suffix not in names:
+                try:
+                    os.unlink(directory / name)
+                    removed = True
+                    logger.info("Removed {}, its source was removed".format(name))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning("Failed to remove {}: {}".format(name, e))
+            break
+    return removed
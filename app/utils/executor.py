@@ -0,0 +1,217 @@
+"""
+Execution of blocking work outside of the event loop.
+
+File and Parquet I/O must not run on the event loop: a slow historical query
+would otherwise stall every other request of the uvicorn worker. The
+endpoints run such work through ``run_blocking``, which:
+
+- executes it in a shared thread pool, or in a process pool for CPU bound
+  work when SWI_METOBS_BACKEND_CPU_EXECUTOR=process,
+- limits the number of concurrent calls per group of endpoints, so that a
+  burst of expensive requests cannot take all the workers from the cheap ones.
+
+The limits are configured with SWI_METOBS_BACKEND_LIMIT_<GROUP> environment
+variables (e.g. SWI_METOBS_BACKEND_LIMIT_HISTORICAL=2).
+
+The ``EventLoopLagMonitor`` measures how late the event loop wakes up, which
+is the delay added to every request when something blocks the loop.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from weakref import WeakKeyDictionary
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, TypeVar
+
+from fastapi import HTTPException
+from loguru import logger
+
+T = TypeVar("T")
+
+MAX_WORKERS = int(os.getenv("SWI_METOBS_BACKEND_EXECUTOR_WORKERS", "16"))
+CPU_EXECUTOR = os.getenv("SWI_METOBS_BACKEND_CPU_EXECUTOR", "thread").lower()
+CPU_MAX_WORKERS = int(
+    os.getenv("SWI_METOBS_BACKEND_CPU_EXECUTOR_WORKERS", str(os.cpu_count() or 1))
+)
+
+# Default number of concurrent calls per group of endpoints
+DEFAULT_LIMITS = {
+    "default": 16,
+    "stations": 8,
+    "observations": 8,
+    "forecast": 8,
+    "historical": 4,
+    "export": 2,
+    "spheres": 2,
+    "rollups": 1,
+}
+
+_executors: Dict[str, Executor] = {}
+# Semaphores are bound to the event loop they are used in
+_semaphores: "WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = WeakKeyDictionary()
+_in_flight: Dict[str, int] = {}
+
+
+def get_limit(group: str) -> int:
+    """Return the concurrency limit of a group of endpoints."""
+    default = DEFAULT_LIMITS.get(group, DEFAULT_LIMITS["default"])
+    return int(os.getenv(f"SWI_METOBS_BACKEND_LIMIT_{group.upper()}", default))
+
+
+def _get_semaphore(group: str) -> asyncio.Semaphore:
+    semaphores = _semaphores.setdefault(asyncio.get_running_loop(), {})
+    if group not in semaphores:
+        semaphores[group] = asyncio.Semaphore(get_limit(group))
+        _in_flight.setdefault(group, 0)
+    return semaphores[group]
+
+
+def _get_executor(cpu_bound: bool) -> Executor:
+    kind = "process" if cpu_bound and CPU_EXECUTOR == "process" else "thread"
+    if kind not in _executors:
+        if kind == "process":
+            _executors[kind] = ProcessPoolExecutor(max_workers=CPU_MAX_WORKERS)
+        else:
+            _executors[kind] = ThreadPoolExecutor(
+                max_workers=MAX_WORKERS, thread_name_prefix="swi-blocking"
+            )
+    return _executors[kind]
+
+
+class _RemoteHTTPException(Exception):
+    """Picklable carrier of an HTTPException raised in a worker process."""
+
+
+def _call_in_process(func: Callable[..., T]) -> T:
+    try:
+        return func()
+    except HTTPException as e:
+        raise _RemoteHTTPException(e.status_code, e.detail, e.headers)
+
+
+async def run_blocking(
+    func: Callable[..., T],
+    *args: Any,
+    group: str = "default",
+    cpu_bound: bool = False,
+    **kwargs: Any,
+) -> T:
+    """
+    Run a blocking function in the worker pool and await its result.
+
+    Args:
+        func: The function to run. It must be picklable when cpu_bound and the
+              process executor is enabled.
+        *args: Positional arguments of the function.
+        group: The group of endpoints whose concurrency limit applies.
+        cpu_bound: Run in the process pool if it is enabled.
+        **kwargs: Keyword arguments of the function.
+
+    Returns:
+        The value returned by the function. Its exceptions are re-raised.
+    """
+    semaphore = _get_semaphore(group)
+    executor = _get_executor(cpu_bound)
+    call = partial(func, *args, **kwargs)
+    if isinstance(executor, ProcessPoolExecutor):
+        call = partial(_call_in_process, call)
+
+    async with semaphore:
+        _in_flight[group] += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, call)
+        except _RemoteHTTPException as e:
+            status_code, detail, headers = e.args
+            raise HTTPException(status_code=status_code, detail=detail, headers=headers)
+        finally:
+            _in_flight[group] -= 1
+
+
+async def iterate_blocking(
+    iterator: Iterator[T], group: str = "default"
+) -> AsyncIterator[T]:
+    """Consume a blocking iterator item by item in the worker pool."""
+    sentinel = object()
+    while True:
+        item = await run_blocking(next, iterator, sentinel, group=group)
+        if item is sentinel:
+            return
+        yield item
+
+
+def executor_stats() -> Dict[str, Dict[str, int]]:
+    """Return the number of running calls and the limit of each group."""
+    return {
+        group: {"in_flight": _in_flight[group], "limit": get_limit(group)}
+        for group in _in_flight
+    }
+
+
+async def shutdown_executors():
+    """
+    Shut the worker pools down, waiting for the running calls in a separate
+    thread so that the event loop is not blocked meanwhile.
+    """
+    executors = list(_executors.values())
+    _executors.clear()
+    for executor in executors:
+        await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+
+class EventLoopLagMonitor:
+    """
+    Measure the event loop lag: how late a periodic timer fires.
+
+    A lag above ``warning_threshold`` seconds is logged, as it means that
+    something blocked the event loop for that long.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.5,
+        warning_threshold: float = 0.1,
+        history: int = 120,
+    ):
+        self.interval = interval
+        self.warning_threshold = warning_threshold
+        self._lags = deque(maxlen=history)
+        self._max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            self._lags.append(lag)
+            self._max_lag = max(self._max_lag, lag)
+            if lag > self.warning_threshold:
+                logger.warning("Event loop lag of {:.0f} ms".format(lag * 1000))
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, float]:
+        """Return the last, mean and max lag in milliseconds."""
+        lags = list(self._lags)
+        return {
+            "last_ms": round(lags[-1] * 1000, 3) if lags else 0.0,
+            "mean_ms": round(sum(lags) / len(lags) * 1000, 3) if lags else 0.0,
+            "max_ms": round(self._max_lag * 1000, 3),
+        }
+
+
+loop_lag_monitor = EventLoopLagMonitor()
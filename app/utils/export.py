@@ -0,0 +1,174 @@
+"""
+Streaming encoders for the bulk export of historical observations.
+
+Each encoder consumes an iterator of (station_id, DataFrame) chunks, one per
+daily file, and yields the encoded bytes chunk by chunk so the memory use does
+not depend on the length of the exported range.
+"""
+
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pydantic_core import to_json
+
+from app.utils.historical import (
+    LOCATION_COLUMNS,
+    get_index_column,
+    unify_parquet_schemas,
+)
+from app.utils.serialization import column_records, format_timestamps
+
+Chunk = Tuple[str, pd.DataFrame]
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def export_columns(
+    files: Iterable[Path], variables: Optional[List[str]] = None
+) -> Tuple[List[str], Dict[str, pa.DataType]]:
+    """
+    Determine the exported columns from the footer of the exported files.
+
+    The types are unified over all the files (see unify_parquet_schemas), so
+    that every chunk fits the schema of a Parquet export decided before the
+    first one is sent.
+
+    Args:
+        files: The exported daily files.
+        variables: Variables to export. The position columns are always
+                   exported when available. If None, all the columns are.
+
+    Returns:
+        Tuple[List[str], Dict[str, pa.DataType]]: The variables, in order, and
+        the arrow type of the timestamp and of each variable.
+    """
+    schema = unify_parquet_schemas(list(files))
+    index_column = get_index_column(schema)
+    columns: List[str] = []
+    types: Dict[str, pa.DataType] = {}
+    for field in schema:
+        # Columns without any value in the files are exported as float
+        field_type = pa.float64() if pa.types.is_null(field.type) else field.type
+        if field.name == index_column:
+            types["timestamp"] = field_type
+            continue
+        if variables and field.name not in variables + LOCATION_COLUMNS:
+            continue
+        columns.append(field.name)
+        types[field.name] = field_type
+    if variables:
+        # Keep the requested order, then the position
+        columns = [v for v in variables if v in columns] + [
+            c for c in columns if c not in variables
+        ]
+    return columns, types
+
+
+def _records(
+    station_id: str, df: pd.DataFrame, columns: List[str], iso_timestamps=True
+) -> pd.DataFrame:
+    """Flatten a daily frame to the export columns: id, timestamp, variables."""
+    records = df.reindex(columns=columns)
+    timestamps = df.index
+    if iso_timestamps:
+        timestamps = format_timestamps(pd.DatetimeIndex(df.index))
+    records.insert(0, "timestamp", timestamps)
+    records.insert(0, "id", station_id)
+    return records.reset_index(drop=True)
+
+
+def stream_ndjson(chunks: Iterable[Chunk], columns: List[str]) -> Iterator[bytes]:
+    """Encode the chunks as newline delimited JSON, one object per timestamp."""
+    for station_id, df in chunks:
+        if df.empty:
+            continue
+        records = _records(station_id, df, columns)
+        # Python scalars, so that the floats are written in their shortest form
+        rows = column_records(
+            {
+                name: records[name].to_numpy(dtype=object, na_value=None)
+                for name in records.columns
+            }
+        )
+        yield b"".join(to_json(row) + b"\n" for row in rows)
+
+
+def stream_csv(chunks: Iterable[Chunk], columns: List[str]) -> Iterator[bytes]:
+    """Encode the chunks as CSV with a single header line."""
+    yield (",".join(["id", "timestamp", *columns]) + "\n").encode()
+    for station_id, df in chunks:
+        if df.empty:
+            continue
+        yield (
+            _records(station_id, df, columns).to_csv(index=False, header=False).encode()
+        )
+
+
+class _DrainableSink:
+    """Minimal writable file object whose content is drained after each write."""
+
+    def __init__(self):
+        self._buffers: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._buffers.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._buffers)
+        self._buffers = []
+        return data
+
+
+def stream_parquet(
+    chunks: Iterable[Chunk], columns: List[str], types: Dict[str, pa.DataType]
+) -> Iterator[bytes]:
+    """
+    Encode the chunks as a Parquet file, one row group per chunk.
+
+    Args:
+        chunks: The (station_id, DataFrame) chunks.
+        columns: The exported variables.
+        types: The arrow type of the timestamp and of each variable, missing
+               ones are exported as timestamp[us] and float64.
+    """
+    schema = pa.schema(
+        [
+            ("id", pa.string()),
+            ("timestamp", types.get("timestamp", pa.timestamp("us"))),
+            *[(c, types.get(c, pa.float64())) for c in columns],
+        ]
+    )
+    sink = _DrainableSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for station_id, df in chunks:
+            if df.empty:
+                continue
+            records = _records(station_id, df, columns, iso_timestamps=False)
+            writer.write_table(
+                pa.Table.from_pandas(records, schema=schema, preserve_index=False)
+            )
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
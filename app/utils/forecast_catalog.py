@@ -0,0 +1,209 @@
+"""
+In-memory catalog of the forecast files.
+
+Listing the forecast directories and parsing every filename on each request
+is slow with several models and hundreds of files per variable. The catalog
+keeps, for each model directory, the files of each variable sorted by valid
+time, so a time window is selected with a bisection.
+
+A model directory is listed again only when its signature (mtime, size,
+inode) changes, i.e. when files were added, removed or renamed.
+"""
+
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Literal, NamedTuple, Optional, Tuple
+
+from app.models.forecast import ForecastFile
+from app.utils.cache import Signature, signature
+from app.utils.path import safe_join
+
+FileType = Literal["cog", "velocity"]
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H%M%SZ"
+EXTENSIONS = {"cog": ".tif", "velocity": ".json.gz"}
+
+
+class CatalogSeries(NamedTuple):
+    """The files of one variable of a model directory, sorted by valid time."""
+
+    timestamps: List[datetime]
+    files: List[ForecastFile]
+    # Modification time of the most recently written file (seconds)
+    updated_at: float
+
+
+class CatalogDirectory(NamedTuple):
+    """The listing of a model directory, by stem."""
+
+    signature: Signature
+    series: Dict[str, CatalogSeries]
+
+
+def parse_filename(
+    filename: str, file_type: FileType
+) -> Optional[Tuple[str, str, datetime]]:
+    """
+    Split a forecast filename into its stem, timestamp string and valid time.
+
+    The COG files are named cog_{variable}_{timestamp}.tif and the velocity
+    files {prefix}_{variable}_{timestamp}.json.gz. The COG stem is the
+    variable, the velocity one includes the prefix.
+
+    Returns:
+        The (stem, timestamp string, valid time), or None if the filename is
+        not a forecast file.
+    """
+    if file_type == "cog":
+        if not filename.startswith("cog_"):
+            return None
+        name = filename[len("cog_") :].split(EXTENSIONS["cog"])[0]
+    else:
+        if not filename.endswith(EXTENSIONS["velocity"]):
+            return None
+        name = filename.split(EXTENSIONS["velocity"])[0]
+
+    stem, _, timestamp_str = name.rpartition("_")
+    if not stem:
+        return None
+    try:
+        timestamp = datetime.strptime(timestamp_str, TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+    return stem, timestamp_str, timestamp
+
+
+class ForecastCatalog:
+    """Index of the forecast files of every model, by file type and variable."""
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = base_dir
+        self._directories: Dict[Tuple[str, str], CatalogDirectory] = {}
+        self._models: Optional[Tuple[Signature, List[str]]] = None
+        self._lock = threading.Lock()
+
+    def models(self) -> List[str]:
+        """List the model directories."""
+        current = signature(self.base_dir)
+        models = self._models
+        if models is None or models[0] != current:
+            models = (
+                current,
+                sorted(
+                    d for d in os.listdir(self.base_dir) if (self.base_dir / d).is_dir()
+                ),
+            )
+            self._models = models
+        return models[1]
+
+    def _scan(self, model: str, file_type: FileType, model_dir: Path, current):
+        entries: Dict[str, List[Tuple[datetime, ForecastFile]]] = {}
+        updated_at: Dict[str, float] = {}
+        with os.scandir(model_dir) as listing:
+            for entry in listing:
+                parsed = parse_filename(entry.name, file_type)
+                if parsed is None:
+                    continue
+                stem, timestamp_str, timestamp = parsed
+                entries.setdefault(stem, []).append(
+                    (
+                        timestamp,
+                        ForecastFile(
+                            model=model,
+                            file_path=str(model_dir / entry.name)
+                            if file_type == "cog"
+                            else entry.name,
+                            timestamp=timestamp_str,
+                        ),
+                    )
+                )
+                try:
+                    mtime = entry.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                updated_at[stem] = max(updated_at.get(stem, 0.0), mtime)
+        series = {}
+        for stem, files in entries.items():
+            files.sort(key=lambda entry: (entry[0], entry[1].file_path))
+            series[stem] = CatalogSeries(
+                [timestamp for timestamp, _ in files],
+                [file for _, file in files],
+                updated_at.get(stem, 0.0),
+            )
+        return CatalogDirectory(current, series)
+
+    def directory(self, model: str, file_type: FileType) -> Optional[CatalogDirectory]:
+        """Return the listing of a model directory, None if it does not exist."""
+        model_dir = safe_join(self.base_dir, model, file_type, relative=True)
+        try:
+            current = signature(model_dir)
+        except (FileNotFoundError, NotADirectoryError):
+            self._directories.pop((model, file_type), None)
+            return None
+
+        key = (model, file_type)
+        directory = self._directories.get(key)
+        if directory is None or directory.signature != current:
+            with self._lock:
+                directory = self._directories.get(key)
+                if directory is None or directory.signature != current:
+                    directory = self._scan(model, file_type, model_dir, current)
+                    self._directories[key] = directory
+        return directory
+
+    def directories(self) -> Dict[Tuple[str, FileType], CatalogDirectory]:
+        """Return the up to date listing of every model directory."""
+        directories = {}
+        for model in self.models():
+            for file_type in EXTENSIONS:
+                directory = self.directory(model, file_type)
+                if directory is not None:
+                    directories[model, file_type] = directory
+        return directories
+
+    def files(
+        self,
+        variable: str,
+        models: Optional[List[str]],
+        file_type: FileType,
+        start_time: datetime,
+        end_time: datetime,
+    ) -> List[ForecastFile]:
+        """
+        Return the files of a variable valid between start_time and end_time.
+
+        Args:
+            variable: The forecast variable.
+            models: The models to search, all if None.
+            file_type: 'cog' or 'velocity'.
+            start_time: The first valid time, included.
+            end_time: The last valid time, included.
+
+        Returns:
+            The files, by model then by valid time.
+        """
+        files = []
+        for model in models if models is not None else self.models():
+            directory = self.directory(model, file_type)
+            if directory is None:
+                continue
+            if file_type == "cog":
+                stems = [variable] if variable in directory.series else []
+            else:
+                stems = [s for s in directory.series if s.endswith(f"_{variable}")]
+
+            selected = []
+            for stem in stems:
+                series = directory.series[stem]
+                start = bisect_left(series.timestamps, start_time)
+                end = bisect_right(series.timestamps, end_time)
+                selected.extend(
+                    zip(series.timestamps[start:end], series.files[start:end])
+                )
+            if len(stems) > 1:
+                selected.sort(key=lambda entry: entry[0])
+            files.extend(file for _, file in selected)
+        return files
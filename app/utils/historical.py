@@ -0,0 +1,102 @@
+from datetime import timedelta
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+LOCATION_COLUMNS = ["latitude", "longitude"]
+
+
+def get_index_column(schema: pa.Schema) -> Optional[str]:
+    """Return the name of the column holding the pandas time index, if any."""
+    metadata = schema.pandas_metadata or {}
+    for index_column in metadata.get("index_columns", []):
+        # RangeIndex are stored as a dict description, not as a column
+        if isinstance(index_column, str):
+            return index_column
+    return None
+
+
+def get_parquet_columns(file_path: Path) -> List[str]:
+    """
+    Return the data columns of a parquet file without reading its content.
+
+    Only the file footer is read, the index column is excluded so the result
+    matches the columns of the DataFrame that pandas would return.
+    """
+    schema = pq.read_schema(file_path)
+    index_column = get_index_column(schema)
+    return [name for name in schema.names if name != index_column]
+
+
+def unify_parquet_schemas(files: Sequence[Path]) -> pa.Schema:
+    """
+    Return the common schema of parquet files, from their footers.
+
+    The columns of every file are kept, in order of first appearance, with a
+    type holding the values of all the files: pandas stores a column as
+    int64 on a day without missing values and as float64 on the others.
+    """
+    return pa.unify_schemas(
+        [pq.read_schema(f) for f in files], promote_options="permissive"
+    )
+
+
+def read_timeseries(
+    files: Sequence[Path],
+    start_date: str,
+    end_date: str,
+    variables: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """
+    Read a time range of a station timeseries from its daily parquet files.
+
+    The files are scanned once through a pyarrow dataset doing both the column
+    projection and the timestamp filtering, so only the requested data is
+    materialised. The files may differ in columns and types, see
+    unify_parquet_schemas.
+
+    Args:
+        files: The daily parquet files to read.
+        start_date: First day of the range (YYYY-MM-DD), inclusive.
+        end_date: Last day of the range (YYYY-MM-DD), inclusive.
+        variables: Variables to keep. The position columns are always kept when
+                   available. If None, all the columns are returned.
+
+    Returns:
+        pd.DataFrame: The data indexed by timestamp and sorted in time.
+    """
+    dataset = ds.dataset(
+        [str(f) for f in files], format="parquet", schema=unify_parquet_schemas(files)
+    )
+    schema = dataset.schema
+    index_column = get_index_column(schema)
+
+    columns = None
+    if variables:
+        columns = [var for var in variables if var in schema.names]
+        if all(col in schema.names for col in LOCATION_COLUMNS):
+            columns.extend(col for col in LOCATION_COLUMNS if col not in columns)
+        if index_column:
+            columns.append(index_column)
+
+    row_filter = None
+    if index_column:
+        field_type = schema.field(index_column).type
+        tz = getattr(field_type, "tz", None)
+        # Same bounds as a pandas partial string slice: the whole end day is included
+        start = pd.Timestamp(start_date, tz=tz)
+        end = pd.Timestamp(end_date, tz=tz) + timedelta(days=1)
+        field = ds.field(index_column)
+        row_filter = (field >= pa.scalar(start, type=field_type)) & (
+            field < pa.scalar(end, type=field_type)
+        )
+
+    table = dataset.to_table(columns=columns, filter=row_filter)
+    df = table.to_pandas()
+    if index_column and index_column in df.columns:
+        df = df.set_index(index_column)
+    return df.sort_index()
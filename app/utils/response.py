@@ -0,0 +1,204 @@
+"""
+Pre-rendered JSON responses with content negotiation and conditional requests.
+
+Endpoints serving data that only changes when a file is rewritten render the
+response body once, compress it once (gzip, and brotli when the optional
+``brotli`` package is installed), and then serve the stored bytes:
+
+- the encoding is selected from the Accept-Encoding request header,
+- a strong ETag derived from the content is sent, and a request whose
+  If-None-Match header matches it gets a 304 Not Modified without a body.
+"""
+
+import gzip
+import hashlib
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterable, NamedTuple, Optional
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 9
+
+# Suffix of the ETag of each encoding: the representations differ, but they
+# are all current when the content is
+ETAG_SUFFIXES = {"identity": "", "gzip": "-gzip", "br": "-br", "zstd": "-zstd"}
+
+
+class RenderedPayload(NamedTuple):
+    """A response body in each available encoding, with its ETag."""
+
+    bodies: Dict[str, bytes]
+    etag: str
+    media_type: str = "application/json"
+
+    def etag_for(self, encoding: str) -> str:
+        return f'"{self.etag}{ETAG_SUFFIXES[encoding]}"'
+
+
+class StationPayloads(NamedTuple):
+    """The rendered response of a data file, and of each of its stations."""
+
+    stations: RenderedPayload
+    by_station: Dict[str, RenderedPayload]
+
+
+def render_payload(content: bytes, media_type: str = "application/json"):
+    """
+    Compress a response body in every available encoding.
+
+    Args:
+        content: The identity encoded body.
+        media_type: The media type of the body.
+
+    Returns:
+        RenderedPayload: The encoded bodies and the content ETag.
+    """
+    bodies = {
+        "identity": content,
+        # mtime=0 keeps the output, and so the ETag, deterministic
+        "gzip": gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0),
+    }
+    if brotli is not None:
+        bodies["br"] = brotli.compress(content, quality=BROTLI_QUALITY)
+    etag = hashlib.blake2b(content, digest_size=16).hexdigest()
+    return RenderedPayload(bodies, etag, media_type)
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """Parse an Accept-Encoding header into a {coding: q-value} mapping."""
+    codings = {}
+    for item in (header or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding] = q
+    return codings
+
+
+def select_encoding(header: Optional[str], available: Iterable[str]) -> Optional[str]:
+    """
+    Select the preferred available content coding (RFC 9110, section 12.5.3).
+
+    Args:
+        header: The Accept-Encoding request header.
+        available: The available codings, in order of server preference,
+                   including "identity".
+
+    Returns:
+        The selected coding, or None if none of them is acceptable.
+    """
+    codings = parse_accept_encoding(header)
+    wildcard = codings.get("*")
+
+    def quality(coding: str) -> float:
+        if coding in codings:
+            return codings[coding]
+        if wildcard is not None:
+            return wildcard
+        # identity is acceptable unless explicitly excluded
+        return 1.0 if coding == "identity" else 0.0
+
+    best, best_q = None, 0.0
+    for coding in available:
+        q = quality(coding)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def _etag_base(etag: str) -> str:
+    """Strip the weak prefix, the quotes and the encoding suffix of an ETag."""
+    etag = etag.strip().removeprefix("W/").strip('"')
+    for suffix in ETAG_SUFFIXES.values():
+        if suffix and etag.endswith(suffix):
+            return etag[: -len(suffix)]
+    return etag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header with the content ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    etag = _etag_base(etag)
+    return any(_etag_base(candidate) == etag for candidate in if_none_match.split(","))
+
+
+def is_not_modified(
+    request_headers, etag: str, last_modified: Optional[str] = None
+) -> bool:
+    """
+    Evaluate the conditional request headers (RFC 9110, section 13.2.2).
+
+    If-None-Match takes precedence over If-Modified-Since.
+
+    Args:
+        request_headers: The request headers.
+        etag: The current ETag, quoted or not.
+        last_modified: The current Last-Modified HTTP date.
+
+    Returns:
+        True if a 304 Not Modified must be returned.
+    """
+    if_none_match = request_headers.get("If-None-Match")
+    if if_none_match:
+        return etag_matches(if_none_match, etag)
+
+    if_modified_since = request_headers.get("If-Modified-Since")
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(
+                if_modified_since
+            )
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def payload_response(
+    request: Request,
+    payload: RenderedPayload,
+    cache_control: Optional[str] = None,
+) -> Response:
+    """
+    Serve a pre-rendered payload, negotiating its encoding.
+
+    Returns a 304 Not Modified when the client already has the content.
+    """
+    available = [coding for coding in ("br", "gzip") if coding in payload.bodies]
+    encoding = (
+        select_encoding(
+            request.headers.get("Accept-Encoding"), available + ["identity"]
+        )
+        or "identity"
+    )
+    headers = {"ETag": payload.etag_for(encoding), "Vary": "Accept-Encoding"}
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+
+    if etag_matches(request.headers.get("If-None-Match"), payload.etag):
+        return Response(status_code=304, headers=headers)
+
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(
+        content=payload.bodies[encoding],
+        media_type=payload.media_type,
+        headers=headers,
+    )
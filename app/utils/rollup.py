@@ -0,0 +1,402 @@
+"""
+Multi-resolution rollups of the long timeseries.
+
+Each station's daily parquet files are pre-aggregated into a pyramid of levels
+(10 min, 1 h, 6 h and 1 day buckets) holding the mean, min, max and count of
+every numeric variable. A level is stored as a few partition files:
+
+    ROLLUP_PATH/<level>/<station_id>/<partition>.parquet
+
+so a resampled request over a long range reads a handful of small files
+instead of every daily file. Days whose rollup partition is missing or older
+than the daily file are aggregated on the fly from the raw data, which keeps
+the results correct while the rollups are being rebuilt.
+
+The service refreshes the pyramid in the background every
+SWI_METOBS_BACKEND_ROLLUP_REFRESH seconds (one worker process at a time), and
+it can be refreshed by hand after an ingest by running:
+
+    python -m app.utils.rollup [station_id ...]
+"""
+
+import argparse
+import fcntl
+import math
+import os
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from app.utils.historical import LOCATION_COLUMNS, read_timeseries
+from app.utils.path import safe_join
+
+LONG_TIMESERIES_PATH = Path("./data/000_long_timeseries")
+ROLLUP_PATH = Path("./data/000_long_timeseries_rollups")
+REFRESH_INTERVAL = float(os.getenv("SWI_METOBS_BACKEND_ROLLUP_REFRESH", "3600"))
+
+ROWS_COLUMN = "__rows"
+FIRST_COLUMN = "__first"
+LAST_COLUMN = "__last"
+STATISTICS = ("mean", "min", "max", "count")
+
+
+class RollupLevel(NamedTuple):
+    name: str
+    freq: pd.Timedelta
+    partition: str  # strftime format of the partition files
+
+
+# From the finest to the coarsest, every bucket size divides a day
+ROLLUP_LEVELS = [
+    RollupLevel("10min", pd.Timedelta(minutes=10), "%Y-%m"),
+    RollupLevel("1h", pd.Timedelta(hours=1), "%Y-%m"),
+    RollupLevel("6h", pd.Timedelta(hours=6), "%Y"),
+    RollupLevel("1d", pd.Timedelta(days=1), "%Y"),
+]
+
+
+def _minutes(freq: pd.Timedelta) -> int:
+    return int(freq.total_seconds() // 60)
+
+
+def rollup_variables(columns: Iterable[str]) -> List[str]:
+    """Return the variables stored in a rollup frame, in storage order."""
+    return [c[: -len("__mean")] for c in columns if c.endswith("__mean")]
+
+
+def aggregate(df: pd.DataFrame, freq: pd.Timedelta) -> pd.DataFrame:
+    """
+    Aggregate raw observations into rollup buckets.
+
+    Only the numeric columns are kept. Empty buckets are dropped.
+    """
+    numeric = df.select_dtypes("number")
+    grouped = numeric.resample(freq)
+    stats = grouped.agg(list(STATISTICS))
+    stats.columns = [f"{var}__{stat}" for var, stat in stats.columns]
+
+    index = df.index.to_series()
+    stats[ROWS_COLUMN] = index.resample(freq).count()
+    stats[FIRST_COLUMN] = index.resample(freq).min()
+    stats[LAST_COLUMN] = index.resample(freq).max()
+    return stats[stats[ROWS_COLUMN] > 0]
+
+
+def combine(rolled: pd.DataFrame, freq: pd.Timedelta) -> pd.DataFrame:
+    """
+    Re-aggregate a rollup frame into coarser buckets.
+
+    Means are weighted by their count so the result is the same as aggregating
+    the raw data directly, as long as the buckets of ``rolled`` nest in the new
+    ones. Empty buckets are kept (with NaN values) like a pandas resample.
+    """
+    variables = rollup_variables(rolled.columns)
+    means = rolled[[f"{var}__mean" for var in variables]].to_numpy(dtype=float)
+    counts = rolled[[f"{var}__count" for var in variables]].to_numpy(dtype=float)
+
+    weighted = pd.DataFrame(
+        np.nan_to_num(means * counts), index=rolled.index, columns=variables
+    ).resample(freq)
+    count_sum = (
+        pd.DataFrame(counts, index=rolled.index, columns=variables).resample(freq).sum()
+    )
+    weighted_sum = weighted.sum()
+
+    result = {}
+    minimums = rolled[[f"{var}__min" for var in variables]].resample(freq).min()
+    maximums = rolled[[f"{var}__max" for var in variables]].resample(freq).max()
+    for var in variables:
+        total = count_sum[var]
+        result[f"{var}__mean"] = weighted_sum[var] / total.where(total > 0)
+        result[f"{var}__min"] = minimums[f"{var}__min"]
+        result[f"{var}__max"] = maximums[f"{var}__max"]
+        result[f"{var}__count"] = total
+    result[ROWS_COLUMN] = rolled[ROWS_COLUMN].resample(freq).sum()
+    result[FIRST_COLUMN] = rolled[FIRST_COLUMN].resample(freq).min()
+    result[LAST_COLUMN] = rolled[LAST_COLUMN].resample(freq).max()
+    return pd.DataFrame(result)
+
+
+def to_means(
+    rolled: pd.DataFrame, variables: Optional[List[str]] = None
+) -> pd.DataFrame:
+    """Return the mean of each variable under its original column name."""
+    available = rollup_variables(rolled.columns)
+    columns = [var for var in variables if var in available] if variables else []
+    if not variables:
+        columns = list(available)
+    elif all(col in available for col in LOCATION_COLUMNS):
+        columns.extend(col for col in LOCATION_COLUMNS if col not in columns)
+    means = rolled[[f"{var}__mean" for var in columns]]
+    means.columns = columns
+    return means
+
+
+def _bucket_count(first: pd.Timestamp, last: pd.Timestamp, minutes: int) -> int:
+    """Number of buckets a resample spans, with the bins aligned on midnight."""
+    freq = pd.Timedelta(minutes=minutes)
+    origin = first.normalize()
+    return (last - origin) // freq - (first - origin) // freq + 1
+
+
+def plan_rollup(
+    first: pd.Timestamp, last: pd.Timestamp, max_timesteps: int
+) -> Tuple[Optional[RollupLevel], int]:
+    """
+    Pick the resample interval and the rollup level of a resampled query.
+
+    The interval is the finest one whose buckets between first and last stay
+    within max_timesteps, counted in steps of the coarsest level that is at
+    most a tenth of it (whole minutes below 100 minutes). The level is then the
+    coarsest one whose buckets divide the interval, so that they nest exactly.
+
+    Returns:
+        Tuple[Optional[RollupLevel], int]: The level, or None when the
+        interval must be aggregated from the raw data, and the resample
+        interval in minutes.
+    """
+    total_minutes = (last - first).total_seconds() / 60
+    target = max(1, math.ceil(total_minutes / max_timesteps))
+    granularity = 1
+    for candidate in ROLLUP_LEVELS:
+        if 10 * _minutes(candidate.freq) <= target:
+            granularity = _minutes(candidate.freq)
+    interval = math.ceil(target / granularity) * granularity
+    # The bins are aligned on midnight, not on the first timestamp
+    while _bucket_count(first, last, interval) > max_timesteps:
+        interval += granularity
+
+    level = None
+    for candidate in ROLLUP_LEVELS:
+        if interval % _minutes(candidate.freq) == 0:
+            level = candidate
+    return level, interval
+
+
+def _partition_key(level: RollupLevel, date: str) -> str:
+    return pd.Timestamp(date).strftime(level.partition)
+
+
+def _write_parquet(df: pd.DataFrame, path: Path):
+    """Write atomically so that readers never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    df.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _mtime(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _list_parquet(directory: Path) -> Dict[str, Path]:
+    """Map the parquet files of a directory by name, without extension."""
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return {}
+    return {
+        f.name[: -len(".parquet")]: directory / f.name
+        for f in entries
+        if f.name.endswith(".parquet")
+    }
+
+
+def build_station_rollups(
+    station_id: str,
+    source_dir: Path = LONG_TIMESERIES_PATH,
+    rollup_dir: Path = ROLLUP_PATH,
+) -> int:
+    """
+    Build or refresh the rollup pyramid of a station.
+
+    Only the partitions older than their source files are rebuilt: the finest
+    level from the daily files, each coarser level from the level below.
+
+    Returns:
+        int: The number of partition files written.
+    """
+    sources = _list_parquet(safe_join(source_dir, station_id))
+    written = 0
+    for position, level in enumerate(ROLLUP_LEVELS):
+        level_dir = safe_join(rollup_dir, level.name, station_id)
+        groups: Dict[str, List[Path]] = defaultdict(list)
+        for name, path in sources.items():
+            groups[_partition_key(level, name)].append(path)
+
+        for key, files in sorted(groups.items()):
+            target = level_dir / f"{key}.parquet"
+            target_mtime = _mtime(target)
+            if target_mtime is not None and target_mtime >= max(
+                _mtime(f) or 0 for f in files
+            ):
+                continue
+            files = sorted(files)
+            if position == 0:
+                raw = read_timeseries(files, files[0].stem, files[-1].stem)
+                rolled = aggregate(raw, level.freq)
+            else:
+                finer = pd.concat([pd.read_parquet(f) for f in files]).sort_index()
+                rolled = combine(finer, level.freq)
+                rolled = rolled[rolled[ROWS_COLUMN] > 0]
+            _write_parquet(rolled, target)
+            written += 1
+
+        sources = _list_parquet(level_dir)
+    return written
+
+
+def build_rollups(
+    stations: Optional[List[str]] = None,
+    source_dir: Path = LONG_TIMESERIES_PATH,
+    rollup_dir: Path = ROLLUP_PATH,
+) -> Optional[int]:
+    """
+    Build or refresh the rollup pyramid of several stations (all by default).
+
+    The build holds a lock file in rollup_dir, so that the worker processes of
+    the service do not build the same partitions at once.
+
+    Returns:
+        Optional[int]: The number of partition files written, or None if
+        another process is already building the rollups.
+    """
+    if not source_dir.is_dir():
+        return 0
+    rollup_dir.mkdir(parents=True, exist_ok=True)
+    with open(rollup_dir / ".lock", "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        if not stations:
+            stations = sorted(d.name for d in os.scandir(source_dir) if d.is_dir())
+        written = 0
+        for station_id in stations:
+            station_written = build_station_rollups(station_id, source_dir, rollup_dir)
+            if station_written:
+                logger.info(
+                    "Rollups of {}: {} partitions written".format(
+                        station_id, station_written
+                    )
+                )
+            written += station_written
+        return written
+
+
+class RollupQuery:
+    """
+    Read a station date range at the different rollup levels.
+
+    Days which are not covered by an up to date rollup partition are read from
+    the daily files, once per query, and aggregated on the fly.
+    """
+
+    def __init__(
+        self,
+        station_id: str,
+        dates: List[str],
+        start_date: str,
+        end_date: str,
+        source_dir: Path = LONG_TIMESERIES_PATH,
+        rollup_dir: Path = ROLLUP_PATH,
+    ):
+        self.station_id = station_id
+        self.dates = dates
+        self.start_date = start_date
+        self.end_date = end_date
+        self.source_dir = source_dir
+        self.rollup_dir = rollup_dir
+        self._raw: Dict[Tuple[str, ...], pd.DataFrame] = {}
+
+    def _source(self, date: str) -> Path:
+        return safe_join(self.source_dir, self.station_id, f"{date}.parquet")
+
+    def raw(self, dates: Optional[List[str]] = None) -> pd.DataFrame:
+        """Return the raw observations of the given dates (all by default)."""
+        key = tuple(self.dates if dates is None else dates)
+        if key not in self._raw:
+            self._raw[key] = read_timeseries(
+                [self._source(d) for d in key], self.start_date, self.end_date
+            )
+        return self._raw[key]
+
+    def level(self, level: RollupLevel) -> pd.DataFrame:
+        """Return the rollup frame of the date range at the given level."""
+        groups: Dict[str, List[str]] = defaultdict(list)
+        for date in self.dates:
+            groups[_partition_key(level, date)].append(date)
+
+        partitions, stale_dates = [], []
+        for key, dates in groups.items():
+            path = safe_join(self.rollup_dir, level.name, self.station_id)
+            path = path / f"{key}.parquet"
+            path_mtime = _mtime(path)
+            if path_mtime is not None and path_mtime >= max(
+                _mtime(self._source(d)) or 0 for d in dates
+            ):
+                partitions.append(path)
+            else:
+                stale_dates.extend(dates)
+
+        frames = []
+        if partitions:
+            frames.append(read_timeseries(partitions, self.start_date, self.end_date))
+        if stale_dates:
+            logger.debug(
+                "Aggregating {} days of {} on the fly for level {}".format(
+                    len(stale_dates), self.station_id, level.name
+                )
+            )
+            frames.append(aggregate(self.raw(stale_dates), level.freq))
+        return pd.concat(frames).sort_index() if len(frames) > 1 else frames[0]
+
+    def resample(
+        self, max_timesteps: int, variables: Optional[List[str]] = None
+    ) -> Optional[pd.DataFrame]:
+        """
+        Resample the date range so it fits in max_timesteps.
+
+        Returns:
+            Optional[pd.DataFrame]: The resampled means, or None if the raw
+            data already fits in max_timesteps.
+        """
+        daily = self.level(ROLLUP_LEVELS[-1])
+        if daily[ROWS_COLUMN].sum() <= max_timesteps:
+            return None
+
+        level, interval = plan_rollup(
+            daily[FIRST_COLUMN].min(), daily[LAST_COLUMN].max(), max_timesteps
+        )
+        freq = pd.Timedelta(minutes=interval)
+        if level is None:
+            rolled = aggregate(self.raw(), freq)
+        else:
+            rolled = daily if level is ROLLUP_LEVELS[-1] else self.level(level)
+        return to_means(combine(rolled, freq), variables)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Build the rollup pyramid of the long timeseries."
+    )
+    parser.add_argument(
+        "stations", nargs="*", help="Stations to process (default: all stations)"
+    )
+    parser.add_argument("--source", type=Path, default=LONG_TIMESERIES_PATH)
+    parser.add_argument("--output", type=Path, default=ROLLUP_PATH)
+    args = parser.parse_args(argv)
+
+    if build_rollups(args.stations, args.source, args.output) is None:
+        logger.warning("The rollups are already being built by another process")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+from pydantic_core import to_json
+
+from app.utils.historical import LOCATION_COLUMNS
+
+
+def format_timestamps(index: pd.DatetimeIndex) -> np.ndarray:
+    """
+    Format a DatetimeIndex as ISO 8601 strings in one vectorized call.
+
+    The output matches the pydantic datetime serialization: seconds precision
+    unless some timestamps have a sub-second part, and a 'Z' suffix for
+    timezone aware timestamps (converted to UTC).
+    """
+    suffix = ""
+    if index.tz is not None:
+        index = index.tz_convert("UTC").tz_localize(None)
+        suffix = "Z"
+    values = index.values.astype("datetime64[us]")
+    has_fraction = bool((values.astype(np.int64) % 1_000_000).any())
+    strings = np.datetime_as_string(values, unit="us" if has_fraction else "s")
+    return np.char.add(strings, suffix) if suffix else strings
+
+
+def column_records(columns: Dict[str, Sequence[Any]]) -> List[Dict[str, Any]]:
+    """
+    Transpose columns into one dict per row, for pydantic_core.to_json.
+
+    The NumPy columns are converted to Python scalars at once with tolist(),
+    so that the floats are written in their shortest form like pydantic.
+    """
+    names = list(columns)
+    values = [
+        column.tolist() if isinstance(column, np.ndarray) else list(column)
+        for column in columns.values()
+    ]
+    return [dict(zip(names, row)) for row in zip(*values)]
+
+
+def serialize_station_timeseries(station_id: str, df: pd.DataFrame) -> bytes:
+    """
+    Serialize a timeseries DataFrame to the JSON wire format of StationTimeseries.
+
+    The frame is converted column by column, then written by the pydantic JSON
+    serializer as plain dicts instead of building one pydantic model per row,
+    which is what makes large historical responses expensive. The output is
+    the same, byte for byte.
+
+    Args:
+        station_id: The station identifier.
+        df: The timeseries, indexed by timestamp. The latitude/longitude columns
+            are nested in a 'location' object like StationPosition.
+
+    Returns:
+        bytes: The JSON document {"id": ..., "timeseries": [...]}.
+    """
+    records = {"timestamp": format_timestamps(pd.DatetimeIndex(df.index))}
+    if all(col in df.columns for col in LOCATION_COLUMNS):
+        lat = df["latitude"].astype(float).tolist()
+        lon = df["longitude"].astype(float).tolist()
+        records["location"] = [{"lat": a, "lon": b} for a, b in zip(lat, lon)]
+    for column in df.columns:
+        if column not in LOCATION_COLUMNS:
+            records[column] = df[column].to_numpy()
+
+    return to_json(
+        {"id": station_id, "timeseries": column_records(records)},
+        inf_nan_mode="null",
+    )
@@ -0,0 +1,56 @@
+"""
+Coalescing of concurrent calls doing the same work.
+
+When a worker starts cold, many requests may need the same missing data at
+once (e.g. an upstream fetch). With ``SingleFlight``, the first caller starts
+the work and the concurrent callers with the same key await that call and
+share its result, or its exception, instead of repeating it.
+
+The call is shielded: a caller cancelled (e.g. a client disconnecting) does
+not cancel the work the other callers are waiting for.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from loguru import logger
+
+
+class SingleFlight:
+    """At most one call in flight per key, shared by the concurrent callers."""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    def get(self, key: Hashable) -> Optional[asyncio.Future]:
+        """Return the call in flight for a key, None if there is none."""
+        return self._calls.get(key)
+
+    def start(
+        self, key: Hashable, func: Callable[..., Awaitable[Any]], *args, **kwargs
+    ) -> asyncio.Future:
+        """
+        Start a call in the background, unless one is in flight for the key.
+
+        Returns:
+            asyncio.Future: The call in flight for the key.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = call
+            call.add_done_callback(lambda done: self._done(key, done))
+        return call
+
+    async def run(
+        self, key: Hashable, func: Callable[..., Awaitable[Any]], *args, **kwargs
+    ) -> Any:
+        """Await the call in flight for the key, starting it if there is none."""
+        return await asyncio.shield(self.start(key, func, *args, **kwargs))
+
+    def _done(self, key: Hashable, call: asyncio.Future):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # Retrieve the exception, the callers may all have been cancelled
+        if not call.cancelled() and call.exception() is not None:
+            logger.debug("Call {} failed: {}".format(key, call.exception()))
@@ -0,0 +1,411 @@
+"""
+Decoding and subsetting of leaflet-velocity wind fields.
+
+A velocity file is a gzipped JSON list of grids (usually the U and V wind
+components), each with a header describing a regular lat/lon grid and its
+values in row major order, starting from (la1, lo1):
+
+    [{"header": {"nx": 3, "ny": 2, "lo1": 10.0, "la1": 80.0, "dx": 0.5,
+                 "dy": 0.5, ...}, "data": [...]}, ...]
+
+The rows go from la1 to la2, north to south unless la2 is north of la1.
+
+The grids can also be encoded to a compact binary format, the values being
+quantized to int16 with a scale and an offset per grid:
+
+    b"SWIV" | header length (uint32 LE) | JSON header, space padded |
+    values of each grid (int16 LE, row major)
+
+The JSON header is {"version": 1, "grids": [{"header": {...}, "scale": s,
+"offset": o}, ...]}, a value v being stored as round((v - o) / s), and
+missing values as MISSING_VALUE. The values start at a multiple of 8 bytes,
+so that the arrays can be read without copy (e.g. with an Int16Array).
+"""
+
+import gzip
+import json
+import math
+import os
+import struct
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from app.utils.encoding import (
+    DERIVED_SUFFIXES,
+    is_fresh,
+    remove_orphans,
+    write_sibling,
+)
+
+BBox = Tuple[float, float, float, float]
+
+# The bounding boxes are snapped outwards to this grid (degrees), so that
+# close views share the same subset
+TILE_DEGREES = 1.0
+# Number of grid points per 256 pixels map tile wanted at a zoom level
+POINTS_PER_TILE = 32
+# Tolerance on the grid coordinates (degrees)
+EPSILON = 1e-9
+# Decimals of the coordinates in the subset headers
+COORDINATE_DECIMALS = 8
+
+BINARY_MAGIC = b"SWIV"
+BINARY_VERSION = 1
+MISSING_VALUE = -32768
+# The quantized values are in [-QUANTIZATION_RANGE, QUANTIZATION_RANGE]
+QUANTIZATION_RANGE = 32767
+
+
+class VelocityGrid(NamedTuple):
+    """A decoded grid: its header and its values, shape (ny, nx)."""
+
+    header: Dict[str, Any]
+    data: np.ndarray
+
+
+def decode_velocity(content: bytes) -> List[VelocityGrid]:
+    """Decode the (decompressed) JSON content of a velocity file."""
+    grids = []
+    for record in json.loads(content):
+        header = record["header"]
+        nx, ny = int(header["nx"]), int(header["ny"])
+        # The values may be numbers, decimal strings or null
+        data = np.array(
+            [np.nan if v is None else v for v in record["data"]], dtype=float
+        )
+        grids.append(VelocityGrid(header, data.reshape(ny, nx)))
+    return grids
+
+
+def load_velocity(path: Path) -> List[VelocityGrid]:
+    """Read and decode a gzipped velocity file."""
+    with gzip.open(path, "rb") as f:
+        return decode_velocity(f.read())
+
+
+def grid_steps(header: Dict[str, Any]) -> Tuple[float, float]:
+    """
+    Return the signed (longitude, latitude) steps between two grid points.
+
+    The latitude step is negative when the rows go from north to south.
+    """
+    nx, ny = int(header["nx"]), int(header["ny"])
+    lo1, la1 = float(header["lo1"]), float(header["la1"])
+    dx = header.get("dx")
+    if dx is None:
+        dx = (float(header["lo2"]) - lo1) / max(nx - 1, 1)
+    dy = header.get("dy")
+    if dy is None:
+        dy = abs(float(header["la2"]) - la1) / max(ny - 1, 1)
+    north_to_south = float(header.get("la2", la1 - 1)) < la1
+    return float(dx), -float(dy) if north_to_south else float(dy)
+
+
+def sample_bilinear(grid: VelocityGrid, lat: float, lon: float) -> Optional[float]:
+    """
+    Interpolate the value of a grid at a location.
+
+    Returns:
+        The interpolated value, or None if the location is outside the grid or
+        next to a missing value.
+    """
+    header, data = grid
+    ny, nx = data.shape
+    lo1, la1 = float(header["lo1"]), float(header["la1"])
+    dx, dy = grid_steps(header)
+
+    # The longitudes may be given in [-180, 180] or [0, 360]
+    column = ((lon - lo1) % 360) / dx
+    row = (lat - la1) / dy
+    if not (
+        -EPSILON <= column <= nx - 1 + EPSILON and -EPSILON <= row <= ny - 1 + EPSILON
+    ):
+        return None
+
+    column0 = min(max(int(math.floor(column)), 0), max(nx - 2, 0))
+    row0 = min(max(int(math.floor(row)), 0), max(ny - 2, 0))
+    column1, row1 = min(column0 + 1, nx - 1), min(row0 + 1, ny - 1)
+    fx = min(max(column - column0, 0.0), 1.0)
+    fy = min(max(row - row0, 0.0), 1.0)
+
+    value = (
+        data[row0, column0] * (1 - fx) * (1 - fy)
+        + data[row0, column1] * fx * (1 - fy)
+        + data[row1, column0] * (1 - fx) * fy
+        + data[row1, column1] * fx * fy
+    )
+    return None if math.isnan(value) else float(value)
+
+
+def wind_components(grids: List[VelocityGrid]) -> Tuple[VelocityGrid, VelocityGrid]:
+    """
+    Return the (U, V) grids of a velocity file.
+
+    The components are identified by their GRIB parameter number (2 for U,
+    3 for V), in the order of the file otherwise.
+    """
+    by_number = {grid.header.get("parameterNumber"): grid for grid in grids}
+    if 2 in by_number and 3 in by_number:
+        return by_number[2], by_number[3]
+    if len(grids) < 2:
+        raise ValueError("A velocity file must have U and V grids")
+    return grids[0], grids[1]
+
+
+def wind_speed_direction(u: float, v: float) -> Tuple[float, float]:
+    """
+    Return the wind speed and the direction it is coming from, in degrees
+    clockwise from the north.
+    """
+    return math.hypot(u, v), math.degrees(math.atan2(-u, -v)) % 360
+
+
+def parse_bbox(bbox: str) -> BBox:
+    """
+    Parse a "west,south,east,north" bounding box in degrees.
+
+    Raises:
+        ValueError: If the bounding box is malformed or empty.
+    """
+    values = [float(v) for v in bbox.split(",")]
+    if len(values) != 4 or not all(math.isfinite(v) for v in values):
+        raise ValueError("The bounding box must be 4 numbers: west,south,east,north")
+    west, south, east, north = values
+    if not (west < east and -90 <= south < north <= 90):
+        raise ValueError("Invalid bounding box: west < east and south < north")
+    return west, south, east, north
+
+
+def snap_bbox(bbox: BBox, tile: float = TILE_DEGREES) -> BBox:
+    """Enlarge a (west, south, east, north) bounding box to the tile grid."""
+    west, south, east, north = bbox
+    return (
+        math.floor(west / tile) * tile,
+        max(math.floor(south / tile) * tile, -90.0),
+        math.ceil(east / tile) * tile,
+        min(math.ceil(north / tile) * tile, 90.0),
+    )
+
+
+def stride_for_zoom(header: Dict[str, Any], zoom: int) -> int:
+    """Return the decimation stride giving POINTS_PER_TILE points per map tile."""
+    dx, _ = grid_steps(header)
+    wanted = 360.0 / 2**zoom / POINTS_PER_TILE
+    return max(1, int(wanted / abs(dx)))
+
+
+def _axis_slice(start: float, step: float, n: int, low: float, high: float, stride):
+    """Positions of the points of an axis between low and high, as a slice."""
+    bounds = sorted(((low - start) / step, (high - start) / step))
+    first = max(math.ceil(bounds[0] - EPSILON), 0)
+    last = min(math.floor(bounds[1] + EPSILON), n - 1)
+    if first > last:
+        return None
+    return slice(first, last + 1, stride)
+
+
+def _longitude_columns(
+    lo1: float, dx: float, nx: int, west: float, east: float, stride: int
+) -> Optional[Tuple[np.ndarray, float]]:
+    """
+    Columns of the points of a longitude axis between west and east, and the
+    longitude of the first one (in the range of the bounding box).
+
+    The longitudes wrap around like in sample_bilinear, so a bounding box
+    crossing the 0/360 or -180/180 seam gets the columns of both sides, in
+    order from west to east. If the bounding box covers two separate parts of
+    the grid, the larger one is kept.
+    """
+    if east - west >= 360:
+        return np.arange(0, nx, stride), lo1
+    tolerance = EPSILON * abs(dx)
+    longitudes = lo1 + np.arange(nx) * dx
+    shifted = west + np.mod(longitudes - west + tolerance, 360) - tolerance
+    columns = np.flatnonzero(shifted <= east + tolerance)
+    if not columns.size:
+        return None
+    columns = columns[np.argsort(shifted[columns], kind="stable")]
+    # A global grid may repeat its first column at +360 degrees
+    columns = columns[np.diff(shifted[columns], prepend=-np.inf) > tolerance]
+    gaps = np.flatnonzero(np.diff(shifted[columns]) > abs(dx) + tolerance)
+    columns = max(np.split(columns, gaps + 1), key=len)
+    return columns[::stride], float(shifted[columns[0]])
+
+
+def subset_velocity(
+    grids: List[VelocityGrid], bbox: Optional[BBox] = None, stride: int = 1
+) -> Optional[List[VelocityGrid]]:
+    """
+    Cut the grids to a bounding box, keeping one point every stride.
+
+    The longitudes wrap around, so the bounding box may cross the seam of a
+    global grid (see _longitude_columns).
+
+    Args:
+        grids: The decoded grids.
+        bbox: The (west, south, east, north) bounding box, the whole grid if None.
+        stride: Keep one point every stride points in both directions.
+
+    Returns:
+        The subsets with updated headers, or None if no grid point is in the
+        bounding box.
+    """
+    subsets = []
+    for header, data in grids:
+        ny, nx = data.shape
+        lo1, la1 = float(header["lo1"]), float(header["la1"])
+        dx, dy = grid_steps(header)
+        if bbox is None:
+            columns, rows = slice(0, nx, stride), slice(0, ny, stride)
+            first_lon = lo1
+        else:
+            west, south, east, north = bbox
+            longitude_columns = _longitude_columns(lo1, dx, nx, west, east, stride)
+            rows = _axis_slice(la1, dy, ny, south, north, stride)
+            if longitude_columns is None or rows is None:
+                return None
+            columns, first_lon = longitude_columns
+        values = data[rows][:, columns]
+
+        first_lat = la1 + rows.start * dy
+        subset_header = dict(header)
+        subset_header.update(
+            nx=values.shape[1],
+            ny=values.shape[0],
+            lo1=round(first_lon, COORDINATE_DECIMALS),
+            la1=round(first_lat, COORDINATE_DECIMALS),
+            lo2=round(
+                first_lon + (values.shape[1] - 1) * dx * stride, COORDINATE_DECIMALS
+            ),
+            la2=round(
+                first_lat + (values.shape[0] - 1) * dy * stride, COORDINATE_DECIMALS
+            ),
+            dx=round(abs(dx) * stride, COORDINATE_DECIMALS),
+            dy=round(abs(dy) * stride, COORDINATE_DECIMALS),
+        )
+        if "numberPoints" in header:
+            subset_header["numberPoints"] = values.size
+        subsets.append(VelocityGrid(subset_header, values))
+    return subsets
+
+
+def encode_velocity(grids: List[VelocityGrid]) -> bytes:
+    """Encode grids to the leaflet-velocity JSON format."""
+    return json.dumps(
+        [
+            {
+                "header": header,
+                "data": [None if math.isnan(v) else v for v in data.ravel().tolist()],
+            }
+            for header, data in grids
+        ],
+        separators=(",", ":"),
+    ).encode()
+
+
+def quantize(data: np.ndarray) -> Tuple[np.ndarray, float, float]:
+    """
+    Quantize values to int16, mapping their range to the int16 range.
+
+    Returns:
+        The quantized values, the scale and the offset.
+    """
+    finite = data[np.isfinite(data)]
+    if finite.size == 0:
+        return np.full(data.shape, MISSING_VALUE, dtype="<i2"), 1.0, 0.0
+    low, high = float(finite.min()), float(finite.max())
+    offset = (low + high) / 2
+    scale = (high - low) / (2 * QUANTIZATION_RANGE) or 1.0
+    with np.errstate(invalid="ignore"):
+        values = np.rint((data - offset) / scale)
+    values = np.clip(values, -QUANTIZATION_RANGE, QUANTIZATION_RANGE)
+    values[~np.isfinite(data)] = MISSING_VALUE
+    return values.astype("<i2"), scale, offset
+
+
+def encode_velocity_binary(grids: List[VelocityGrid]) -> bytes:
+    """Encode grids to the binary format, see the module documentation."""
+    arrays, descriptions = [], []
+    for header, data in grids:
+        values, scale, offset = quantize(data)
+        arrays.append(values)
+        descriptions.append({"header": header, "scale": scale, "offset": offset})
+
+    header = json.dumps(
+        {"version": BINARY_VERSION, "grids": descriptions}, separators=(",", ":")
+    ).encode()
+    # Pad the header so that the values are aligned on 8 bytes
+    prefix_size = len(BINARY_MAGIC) + 4
+    header += b" " * (-(prefix_size + len(header)) % 8)
+    return b"".join(
+        [BINARY_MAGIC, struct.pack("<I", len(header)), header]
+        + [values.tobytes() for values in arrays]
+    )
+
+
+def decode_velocity_binary(content: bytes) -> List[VelocityGrid]:
+    """Decode grids encoded with encode_velocity_binary."""
+    if content[:4] != BINARY_MAGIC:
+        raise ValueError("Not a binary velocity file")
+    (header_size,) = struct.unpack_from("<I", content, 4)
+    header = json.loads(content[8 : 8 + header_size])
+    if header["version"] != BINARY_VERSION:
+        raise ValueError(f"Unsupported version: {header['version']}")
+
+    grids, position = [], 8 + header_size
+    for description in header["grids"]:
+        grid_header = description["header"]
+        shape = (int(grid_header["ny"]), int(grid_header["nx"]))
+        values = np.frombuffer(
+            content, dtype="<i2", count=shape[0] * shape[1], offset=position
+        )
+        position += values.nbytes
+        data = values * description["scale"] + description["offset"]
+        data[values == MISSING_VALUE] = np.nan
+        grids.append(VelocityGrid(grid_header, data.reshape(shape)))
+    return grids
+
+
+BINARY_SUFFIX = ".swiv.gz"
+# Suffix of the files derived from the velocity files, mapped to ".json.gz"
+VELOCITY_DERIVED_SUFFIXES = {**DERIVED_SUFFIXES, BINARY_SUFFIX: ".json.gz"}
+
+
+def binary_path(path: Path) -> Path:
+    """Return the path of the binary sibling of a gzipped velocity file."""
+    return path.with_name(
+        path.name.removesuffix(".gz").removesuffix(".json") + BINARY_SUFFIX
+    )
+
+
+def write_velocity_binary(
+    path: Path, source_stat: os.stat_result, content: Optional[bytes] = None
+) -> Path:
+    """
+    Write the gzipped binary sibling of a velocity file if outdated, blocking.
+
+    The derived files of the velocity files that were removed are then
+    deleted from the directory (see remove_orphans).
+
+    Args:
+        path: The gzipped velocity file.
+        source_stat: The stat of the velocity file.
+        content: The binary file, encoded from the velocity file if None.
+
+    Returns:
+        Path: The path of the binary sibling.
+
+    Raises:
+        OSError: If the sibling cannot be written (e.g. read-only directory).
+    """
+    sibling = binary_path(path)
+    if not is_fresh(sibling, source_stat):
+        if content is None:
+            content = encode_velocity_binary(load_velocity(path))
+        write_sibling(sibling, [gzip.compress(content, mtime=0)], source_stat)
+        logger.info("Encoded {} to {}".format(path, sibling.name))
+        remove_orphans(path.parent, VELOCITY_DERIVED_SUFFIXES)
+    return sibling
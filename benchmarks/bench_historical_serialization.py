@@ -0,0 +1,78 @@
+"""
+Benchmark of the historical timeseries serialization.
+
+Compares the per-row pydantic construction previously used by
+get_station_historical_observations with the columnar serializer.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_historical_serialization
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.models.stations import (
+    StationPosition,
+    StationTimeseries,
+    StationTimeseriesDataPoint,
+)
+from app.utils.serialization import serialize_station_timeseries
+
+SIZES = [200, 10_000, 100_000]
+VARIABLES = ["temperature", "humidity", "wind_speed", "wind_direction", "pressure"]
+
+
+def make_frame(rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    index = pd.date_range("2023-01-01", periods=rows, freq="1min", tz="UTC")
+    data = {var: rng.normal(size=rows) for var in VARIABLES}
+    data["latitude"] = 78.2 + rng.normal(scale=0.01, size=rows)
+    data["longitude"] = 15.6 + rng.normal(scale=0.01, size=rows)
+    return pd.DataFrame(data, index=index)
+
+
+def serialize_with_models(station_id: str, df: pd.DataFrame) -> bytes:
+    timeseries = []
+    for index, row in df.iterrows():
+        data_point = {}
+        if "latitude" in df.columns and "longitude" in df.columns:
+            data_point["location"] = StationPosition(
+                lat=row.get("latitude"), lon=row.get("longitude")
+            )
+        for column in df.columns:
+            if column not in ["latitude", "longitude"]:
+                data_point[column] = row.get(column)
+        timeseries.append(
+            StationTimeseriesDataPoint(timestamp=index.to_pydatetime(), **data_point)
+        )
+    model = StationTimeseries(id=station_id, timeseries=timeseries)
+    # FastAPI validates the returned model against response_model once more
+    return StationTimeseries.model_validate(model).model_dump_json().encode()
+
+
+def best_of(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    print(f"{'rows':>8} {'pydantic (s)':>14} {'columnar (s)':>14} {'speedup':>9}")
+    for rows in SIZES:
+        df = make_frame(rows)
+        repeat = 5 if rows <= 10_000 else 1
+        legacy = best_of(lambda df=df: serialize_with_models("BENCH", df), repeat)
+        columnar = best_of(
+            lambda df=df: serialize_station_timeseries("BENCH", df), repeat
+        )
+        print(f"{rows:>8} {legacy:>14.4f} {columnar:>14.4f} {legacy / columnar:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
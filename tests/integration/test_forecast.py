@@ -1,6 +1,15 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
+from app.api.v3.endpoints import forecast_rasters
+from app.utils.cache import LRUCache
+from app.utils.velocity import binary_path, decode_velocity_binary
 
 
 @pytest.mark.asyncio
@@ -64,3 +73,338 @@ class TestForecastEndpoints:
         data = response.json()
         assert "detail" in data
         assert "not found" in data["detail"]
+
+
+class TestVelocityFileStreaming:
+    """Test cases for serving the velocity files from disk."""
+
+    @pytest.fixture
+    def client(self):
+        return TestClient(app)
+
+    @pytest.fixture
+    def velocity_file(self):
+        """A gzipped velocity file of the test model."""
+        content = json.dumps([{"header": {"nx": 2, "ny": 2}, "data": [1, 2, 3, 4]}])
+        velocity_dir = Path("./data/forecast/test_model/velocity")
+        velocity_dir.mkdir(parents=True, exist_ok=True)
+        path = velocity_dir / "aa_wind_2023-01-01T000000Z.json.gz"
+        path.write_bytes(gzip.compress(content.encode()))
+        yield path
+        path.unlink()
+
+    def test_headers(self, client, velocity_file):
+        """Test the content and the caching headers."""
+        response = client.get(
+            "/v3/forecast/files/velocity/test_model/aa_wind_2023-01-01T000000Z.json.gz",
+            headers={"Accept-Encoding": "gzip"},
+        )
+        assert response.status_code == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.headers["Content-Length"] == str(velocity_file.stat().st_size)
+        assert "ETag" in response.headers
+        assert "Last-Modified" in response.headers
+        assert response.headers["Accept-Ranges"] == "bytes"
+        assert response.json()[0]["data"] == [1, 2, 3, 4]
+
+    def test_conditional_requests(self, client, velocity_file):
+        """Test If-None-Match and If-Modified-Since."""
+        url = (
+            "/v3/forecast/files/velocity/test_model/aa_wind_2023-01-01T000000Z.json.gz"
+        )
+        response = client.get(url, headers={"Accept-Encoding": "gzip"})
+        etag = response.headers["ETag"]
+        last_modified = response.headers["Last-Modified"]
+
+        response = client.get(
+            url, headers={"Accept-Encoding": "gzip", "If-None-Match": etag}
+        )
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+
+        response = client.get(
+            url,
+            headers={"Accept-Encoding": "gzip", "If-Modified-Since": last_modified},
+        )
+        assert response.status_code == 304
+
+        response = client.get(
+            url, headers={"Accept-Encoding": "gzip", "If-None-Match": '"other"'}
+        )
+        assert response.status_code == 200
+
+    def test_decompressed_for_clients_without_gzip(self, client, velocity_file):
+        """Test streaming the decompressed file."""
+        response = client.get(
+            "/v3/forecast/files/velocity/test_model/aa_wind_2023-01-01T000000Z.json.gz",
+            headers={"Accept-Encoding": "identity"},
+        )
+        assert response.status_code == 200
+        assert "Content-Encoding" not in response.headers
+        assert response.json()[0]["data"] == [1, 2, 3, 4]
+        assert not response.headers["ETag"].endswith('-gzip"')
+
+    def test_no_acceptable_encoding(self, client, velocity_file):
+        """Test a client refusing every available encoding."""
+        response = client.get(
+            "/v3/forecast/files/velocity/test_model/aa_wind_2023-01-01T000000Z.json.gz",
+            headers={"Accept-Encoding": "gzip;q=0, identity;q=0"},
+        )
+        assert response.status_code == 406
+
+    def test_range_request(self, client, velocity_file):
+        """Test resuming a download with a byte range."""
+        response = client.get(
+            "/v3/forecast/files/velocity/test_model/aa_wind_2023-01-01T000000Z.json.gz",
+            headers={"Accept-Encoding": "identity, gzip", "Range": "bytes=0-9"},
+        )
+        assert response.status_code == 206
+        size = velocity_file.stat().st_size
+        assert response.headers["Content-Range"] == f"bytes 0-9/{size}"
+        # Compare the raw bytes, the client would decode a complete body only
+        assert response.num_bytes_downloaded == 10
+
+
+class TestVelocitySubsetting:
+    """Test cases for the bounding box and stride subsetting of velocity files."""
+
+    URL = "/v3/forecast/files/velocity/test_model/aa_wind_2023-01-02T000000Z.json.gz"
+
+    @pytest.fixture
+    def client(self):
+        return TestClient(app)
+
+    @pytest.fixture
+    def velocity_file(self):
+        """A gzipped 4x4 velocity grid from 10E to 13E and 80N to 77N."""
+        header = {"nx": 4, "ny": 4, "lo1": 10.0, "la1": 80.0, "dx": 1.0, "dy": 1.0}
+        header.update(lo2=13.0, la2=77.0)
+        content = json.dumps([{"header": header, "data": list(range(16))}])
+        velocity_dir = Path("./data/forecast/test_model/velocity")
+        velocity_dir.mkdir(parents=True, exist_ok=True)
+        path = velocity_dir / "aa_wind_2023-01-02T000000Z.json.gz"
+        path.write_bytes(gzip.compress(content.encode()))
+        yield path
+        path.unlink()
+
+    def test_bbox(self, client, velocity_file):
+        """Test cutting the grid to a bounding box snapped to the tile grid."""
+        response = client.get(self.URL, params={"bbox": "10.5,77.5,11.5,78.5"})
+        assert response.status_code == 200
+        (grid,) = response.json()
+        assert grid["header"]["nx"] == 3
+        assert grid["header"]["ny"] == 3
+        assert grid["header"]["lo1"] == 10.0
+        assert grid["header"]["la1"] == 79.0
+        assert grid["data"] == [4, 5, 6, 8, 9, 10, 12, 13, 14]
+        assert "ETag" in response.headers
+
+        # The same tile is served from the cache, with the same validator
+        etag = response.headers["ETag"]
+        response = client.get(
+            self.URL,
+            params={"bbox": "10.2,77.1,11.9,78.9"},
+            headers={"If-None-Match": etag},
+        )
+        assert response.status_code == 304
+
+    def test_stride(self, client, velocity_file):
+        """Test decimating the grid."""
+        response = client.get(self.URL, params={"stride": 2})
+        assert response.status_code == 200
+        (grid,) = response.json()
+        assert grid["data"] == [0, 2, 8, 10]
+        assert grid["header"]["dx"] == 2.0
+
+    def test_invalid_parameters(self, client, velocity_file):
+        """Test invalid bounding boxes and strides."""
+        assert client.get(self.URL, params={"bbox": "11,78,10,79"}).status_code == 400
+        assert client.get(self.URL, params={"stride": 0}).status_code == 400
+        response = client.get(self.URL, params={"bbox": "30,60,31,61"})
+        assert response.status_code == 404
+
+
+class TestBinaryVelocityFile:
+    """Test cases for the binary velocity files."""
+
+    URL = "/v3/forecast/files/velocity-binary/test_model/aa_wind_2023-01-03T000000Z.json.gz"
+
+    @pytest.fixture
+    def client(self):
+        return TestClient(app)
+
+    @pytest.fixture
+    def velocity_file(self):
+        """A gzipped velocity file of the test model, and its binary sibling."""
+        content = json.dumps([{"header": {"nx": 2, "ny": 2}, "data": [1, 2, 3, 4]}])
+        velocity_dir = Path("./data/forecast/test_model/velocity")
+        velocity_dir.mkdir(parents=True, exist_ok=True)
+        path = velocity_dir / "aa_wind_2023-01-03T000000Z.json.gz"
+        path.write_bytes(gzip.compress(content.encode()))
+        yield path
+        path.unlink()
+        binary_path(path).unlink(missing_ok=True)
+
+    def test_binary_file(self, client, velocity_file):
+        """Test the content and the caching of the binary file."""
+        response = client.get(self.URL, headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == "application/octet-stream"
+        assert response.headers["Content-Encoding"] == "gzip"
+        (grid,) = decode_velocity_binary(response.content)
+        np.testing.assert_allclose(grid.data, [[1, 2], [3, 4]], atol=1e-3)
+        assert binary_path(velocity_file).exists()
+
+        response = client.get(
+            self.URL,
+            headers={
+                "Accept-Encoding": "gzip",
+                "If-None-Match": response.headers["ETag"],
+            },
+        )
+        assert response.status_code == 304
+
+    def test_decompressed_for_clients_without_gzip(self, client, velocity_file):
+        """Test streaming the decompressed binary file."""
+        response = client.get(self.URL, headers={"Accept-Encoding": "identity"})
+        assert response.status_code == 200
+        assert "Content-Encoding" not in response.headers
+        assert response.content.startswith(b"SWIV")
+
+    def test_read_only_directory(self, client, velocity_file, monkeypatch):
+        """Test the binary file served from memory when it cannot be written."""
+
+        def write_velocity_binary(*args, **kwargs):
+            raise PermissionError("Read-only file system")
+
+        monkeypatch.setattr(
+            forecast_rasters, "write_velocity_binary", write_velocity_binary
+        )
+        monkeypatch.setattr(forecast_rasters, "velocity_binaries", LRUCache(4))
+
+        response = client.get(self.URL, headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == "application/octet-stream"
+        assert response.headers["Content-Encoding"] == "gzip"
+        (grid,) = decode_velocity_binary(response.content)
+        np.testing.assert_allclose(grid.data, [[1, 2], [3, 4]], atol=1e-3)
+        assert not binary_path(velocity_file).exists()
+        assert len(forecast_rasters.velocity_binaries) == 1
+
+        response = client.get(
+            self.URL,
+            headers={
+                "Accept-Encoding": "gzip",
+                "If-None-Match": response.headers["ETag"],
+            },
+        )
+        assert response.status_code == 304
+
+    def test_not_found(self, client):
+        """Test the binary file of a missing velocity file."""
+        response = client.get(
+            "/v3/forecast/files/velocity-binary/test_model/missing.json.gz"
+        )
+        assert response.status_code == 404
+
+
+class TestPointForecast:
+    """Test cases for the point forecast (meteogram)."""
+
+    @pytest.fixture
+    def client(self):
+        return TestClient(app)
+
+    @pytest.fixture
+    def velocity_files(self):
+        """Two hourly velocity files valid now, with a 2x2 grid around 78N 15E."""
+        velocity_dir = Path("./data/forecast/test_model/velocity")
+        velocity_dir.mkdir(parents=True, exist_ok=True)
+        now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        header = {"nx": 2, "ny": 2, "lo1": 15.0, "la1": 78.5, "dx": 1.0, "dy": 1.0}
+        header.update(lo2=16.0, la2=77.5)
+        paths = []
+        for hour in range(2):
+            timestamp = (now + timedelta(hours=hour)).strftime("%Y-%m-%dT%H%M%SZ")
+            content = [
+                {"header": {**header, "parameterNumber": 2}, "data": [0, 0, 0, 0]},
+                {"header": {**header, "parameterNumber": 3}, "data": [hour] * 4},
+            ]
+            path = velocity_dir / f"aa_pointwind_{timestamp}.json.gz"
+            path.write_bytes(gzip.compress(json.dumps(content).encode()))
+            paths.append(path)
+        yield paths
+        for path in paths:
+            path.unlink()
+
+    def test_point_forecast(self, client, velocity_files):
+        """Test the wind interpolated at a location, for each timestamp."""
+        response = client.get(
+            "/v3/forecast/point/",
+            params={"variable": "pointwind", "lat": 78.0, "lon": 15.5},
+        )
+        assert response.status_code == 200
+        (forecast,) = response.json()
+        assert forecast["model"] == "test_model"
+        assert [value["v"] for value in forecast["values"]] == [0.0, 1.0]
+        assert forecast["values"][1]["speed"] == 1.0
+        assert forecast["values"][1]["direction"] == 180.0
+
+    def test_outside_grid(self, client, velocity_files):
+        """Test a location outside the model grids."""
+        response = client.get(
+            "/v3/forecast/point/",
+            params={"variable": "pointwind", "lat": 60.0, "lon": 15.5},
+        )
+        assert response.status_code == 404
+
+    def test_invalid_location(self, client):
+        """Test an invalid latitude."""
+        response = client.get(
+            "/v3/forecast/point/",
+            params={"variable": "pointwind", "lat": 95.0, "lon": 15.5},
+        )
+        assert response.status_code == 400
+
+
+class TestForecastManifest:
+    """Test cases for the forecast manifest."""
+
+    @pytest.fixture
+    def client(self):
+        return TestClient(app)
+
+    @pytest.fixture
+    def velocity_dir(self):
+        velocity_dir = Path("./data/forecast/test_model/velocity")
+        velocity_dir.mkdir(parents=True, exist_ok=True)
+        return velocity_dir
+
+    def test_manifest(self, client, velocity_dir):
+        """Test the files listed in the manifest and its ETag."""
+        path = velocity_dir / "aa_manifest_2023-01-04T000000Z.json.gz"
+        path.write_bytes(gzip.compress(b"[]"))
+        try:
+            response = client.get("/v3/forecast/manifest/")
+            assert response.status_code == 200
+            assert response.headers["Cache-Control"] == "no-cache"
+            (model,) = [
+                m for m in response.json()["models"] if m["model"] == "test_model"
+            ]
+            (series,) = [s for s in model["series"] if s["name"] == "aa_manifest"]
+            assert series["file_type"] == "velocity"
+            assert series["timestamps"] == ["2023-01-04T000000Z"]
+            assert series["file_paths"] == [path.name]
+            etag = response.headers["ETag"]
+
+            response = client.get(
+                "/v3/forecast/manifest/", headers={"If-None-Match": etag}
+            )
+            assert response.status_code == 304
+        finally:
+            path.unlink()
+
+        # Removing a file changes the manifest
+        response = client.get("/v3/forecast/manifest/", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
@@ -1,3 +1,7 @@
+import io
+import json
+
+import pandas as pd
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
@@ -78,3 +82,62 @@ class TestHistoricalObservationsEndpoints:
         assert response.status_code == 400  # Bad Request (custom error handling)
         data = response.json()
         assert "detail" in data
+
+    async def test_get_historical_data_with_downsample(self, client):
+        """Test getting historical data with a downsampling method."""
+        response = client.get(
+            "/v3/historical/TEST001?start_date=2023-01-01&end_date=2023-01-02&downsample=lttb"
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["id"] == "TEST001"
+        assert len(data["timeseries"]) > 0
+
+    async def test_get_historical_data_invalid_downsample(self, client):
+        """Test getting historical data with an unknown downsampling method."""
+        response = client.get(
+            "/v3/historical/TEST001?start_date=2023-01-01&end_date=2023-01-02&downsample=median"
+        )
+        assert response.status_code == 422
+
+    async def test_export_ndjson(self, client):
+        """Test exporting historical data as NDJSON."""
+        response = client.get(
+            "/v3/historical/export?stations=TEST001&start_date=2023-01-01&end_date=2023-01-02"
+        )
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert len(lines) == 2
+        assert lines[0]["id"] == "TEST001"
+        assert lines[0]["timestamp"] == "2023-01-01T00:00:00"
+        assert lines[0]["temperature"] == 10.5
+
+    async def test_export_csv(self, client):
+        """Test exporting historical data as CSV."""
+        response = client.get(
+            "/v3/historical/export?stations=TEST001&start_date=2023-01-01&end_date=2023-01-02&format=csv&variables=humidity"
+        )
+        assert response.status_code == 200
+        assert "attachment" in response.headers["content-disposition"]
+        lines = response.text.splitlines()
+        assert lines[0] == "id,timestamp,humidity"
+        assert len(lines) == 3
+
+    async def test_export_parquet(self, client):
+        """Test exporting historical data as Parquet."""
+        response = client.get(
+            "/v3/historical/export?stations=TEST001&start_date=2023-01-01&end_date=2023-01-02&format=parquet"
+        )
+        assert response.status_code == 200
+        df = pd.read_parquet(io.BytesIO(response.content))
+        assert list(df.columns) == ["id", "timestamp", "temperature", "humidity"]
+        assert len(df) == 2
+
+    async def test_export_nonexistent_station(self, client):
+        """Test exporting historical data of a non-existent station."""
+        response = client.get(
+            "/v3/historical/export?stations=TEST001&stations=NONEXISTENT&start_date=2023-01-01&end_date=2023-01-02"
+        )
+        assert response.status_code == 404
+        assert "not found" in response.json()["detail"]
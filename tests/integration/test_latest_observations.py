@@ -1,6 +1,11 @@
+import json
+import os
+
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
+from app.api.v3.endpoints.observation_latest import observation_store, timeline_cache
+from app.utils.response import RenderedPayload
 
 
 @pytest.mark.asyncio
@@ -31,6 +36,30 @@ class TestLatestObservationsEndpoints:
         assert len(data) > 0
         assert data[0]["id"] == "TEST001"
 
+    async def test_etag_and_not_modified(self, client):
+        """Test the conditional requests on the latest observations."""
+        response = client.get("/v3/observations/stations")
+        etag = response.headers["ETag"]
+
+        response = client.get(
+            "/v3/observations/stations", headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 304
+
+        response = client.get(
+            "/v3/observations/stations/TEST001", headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 200
+        assert response.json()["id"] == "TEST001"
+
+    async def test_observations_preloaded_at_startup(self):
+        """Test that the offsets are in memory once the app started."""
+        observation_store._values.clear()
+        with TestClient(app) as client:
+            assert observation_store.peek(0) is not None
+            response = client.get("/v3/observations/stations")
+        assert response.status_code == 200
+
     async def test_get_nonexistent_station_observations(self, client):
         """Test getting observations for a non-existent station."""
         response = client.get("/v3/observations/stations/NONEXISTENT")
@@ -53,3 +82,118 @@ class TestLatestObservationsEndpoints:
         data = response.json()
         assert "detail" in data
         assert "out of range" in data["detail"]
+
+
+class TestObservationsTimeline:
+    """Test cases for the multi-offset timeline endpoint."""
+
+    @pytest.fixture
+    def client(self):
+        return TestClient(app)
+
+    @pytest.fixture
+    def hourly_files(self):
+        """Hourly observations for the offsets -2 and -1."""
+        os.makedirs("./data/000_hourly_data", exist_ok=True)
+        paths = []
+        for offset, hour in ((-2, 10), (-1, 11)):
+            data = {
+                "TEST001": {
+                    "timeseries": [
+                        {
+                            "timestamp": f"2023-01-01T{hour}:00:00Z",
+                            "temperature": float(hour),
+                            "humidity": 60.0 + hour,
+                        }
+                    ]
+                },
+                "TEST002": {
+                    "timeseries": [
+                        {"timestamp": f"2023-01-01T{hour}:00:00Z", "wind": 5.0}
+                    ]
+                },
+            }
+            path = f"./data/000_hourly_data/{offset}.json"
+            with open(path, "w") as f:
+                json.dump(data, f)
+            paths.append(path)
+        yield
+        for path in paths:
+            os.remove(path)
+
+    def test_columnar_timeline(self, client, hourly_files):
+        """Test merging several offsets into arrays per station."""
+        response = client.get("/v3/observations/timeline?start_offset=-3&end_offset=-1")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["offsets"] == [-2, -1]
+        stations = {station["id"]: station for station in data["stations"]}
+        assert stations["TEST001"]["offsets"] == [-2, -1]
+        assert stations["TEST001"]["timestamps"] == [
+            "2023-01-01T10:00:00Z",
+            "2023-01-01T11:00:00Z",
+        ]
+        assert stations["TEST001"]["variables"] == {
+            "temperature": [10.0, 11.0],
+            "humidity": [70.0, 71.0],
+        }
+        assert stations["TEST002"]["variables"] == {"wind": [5.0, 5.0]}
+
+    def test_timeline_filters(self, client, hourly_files):
+        """Test selecting stations and variables."""
+        response = client.get(
+            "/v3/observations/timeline?start_offset=-2&end_offset=-1"
+            "&stations=TEST001&variables=humidity"
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert [station["id"] for station in data["stations"]] == ["TEST001"]
+        assert data["stations"][0]["variables"] == {"humidity": [70.0, 71.0]}
+
+        etag = response.headers["ETag"]
+        response = client.get(
+            "/v3/observations/timeline?start_offset=-2&end_offset=-1"
+            "&stations=TEST001&variables=humidity",
+            headers={"If-None-Match": etag},
+        )
+        assert response.status_code == 304
+
+    def test_timeline_cached_by_file_version(self, client, hourly_files):
+        """Test that a cached timeline follows the files, without keeping them."""
+        url = "/v3/observations/timeline?start_offset=-2&end_offset=-1"
+        response = client.get(url)
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+        assert all(
+            isinstance(payload, RenderedPayload)
+            for payload in timeline_cache._items.values()
+        )
+
+        path = "./data/000_hourly_data/-1.json"
+        with open(path) as f:
+            data = json.load(f)
+        data["TEST002"]["timeseries"][0]["wind"] = 7.0
+        with open(path, "w") as f:
+            json.dump(data, f)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        observation_store._values.clear()
+
+        response = client.get(url)
+        assert response.headers["ETag"] != etag
+        stations = {station["id"]: station for station in response.json()["stations"]}
+        assert stations["TEST002"]["variables"] == {"wind": [5.0, 7.0]}
+
+    def test_timeline_invalid_range(self, client):
+        """Test offsets out of range or in the wrong order."""
+        response = client.get("/v3/observations/timeline?start_offset=-30")
+        assert response.status_code == 400
+        response = client.get("/v3/observations/timeline?start_offset=-1&end_offset=-2")
+        assert response.status_code == 400
+
+    def test_timeline_without_data(self, client):
+        """Test a range without any data file."""
+        response = client.get(
+            "/v3/observations/timeline?start_offset=-24&end_offset=-20"
+        )
+        assert response.status_code == 404
@@ -5,7 +5,9 @@ Integration tests for sphere endpoints.
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
+from app.api.v3.endpoints import spheres
 from app.api.v3.endpoints.spheres import SpatialIndex, SphereNodePanorama
+from app.models.spheres import SphereGeojson
 from datetime import datetime
 import math
 
@@ -27,17 +29,6 @@ class TestSphereEndpoints:
 
     def _setup_mock_data(self):
         """Setup mock sphere data for testing."""
-        # Clear any existing data
-        from app.api.v3.endpoints.spheres import (
-            _spatial_index,
-            _distance_matrix,
-            _bearing_matrix,
-        )
-
-        _spatial_index.clear()
-        _distance_matrix.clear()
-        _bearing_matrix.clear()
-
         # Create mock nodes
         center_lon, center_lat = 6.8586, 45.8326  # Grenoble coordinates
         radius = 0.01  # ~1.1km
@@ -75,22 +66,12 @@ class TestSphereEndpoints:
         )
         nodes.append(center_node)
 
-        # Add nodes to spatial index and compute matrices
-        for node in nodes:
-            SpatialIndex.add_node(node)
-        SpatialIndex._compute_distance_and_bearing_matrices()
+        # Install a spatial index of the nodes
+        spheres._sphere_index = SpatialIndex(nodes)
 
     def _clear_data(self):
         """Clear test data."""
-        from app.api.v3.endpoints.spheres import (
-            _spatial_index,
-            _distance_matrix,
-            _bearing_matrix,
-        )
-
-        _spatial_index.clear()
-        _distance_matrix.clear()
-        _bearing_matrix.clear()
+        spheres._sphere_index = None
 
     def test_get_sphere_geojson(self):
         """Test GET /v3/spheres/geojson endpoint."""
@@ -112,6 +93,30 @@ class TestSphereEndpoints:
             assert feature["geometry"]["type"] == "Point"
             assert "coordinates" in feature["geometry"]
 
+    def test_get_sphere_geojson_rendered_once(self):
+        """Test that the GeoJSON is served pre-rendered, with an ETag."""
+        response = client.get(
+            "/v3/spheres/geojson", headers={"Accept-Encoding": "gzip"}
+        )
+        assert response.status_code == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.headers["Cache-Control"] == "no-cache"
+        etag = response.headers["ETag"]
+        payload = spheres._geojson_payloads[spheres._sphere_index]
+
+        # Same body as the response model, rendered a single time
+        expected = SphereGeojson.from_sphere_nodes(
+            list(spheres._sphere_index.nodes.values())
+        )
+        assert response.json() == expected.model_dump(mode="json")
+
+        response = client.get(
+            "/v3/spheres/geojson",
+            headers={"Accept-Encoding": "gzip", "If-None-Match": etag},
+        )
+        assert response.status_code == 304
+        assert spheres._geojson_payloads[spheres._sphere_index] is payload
+
     def test_get_sphere_panorama_and_links_valid_node(self):
         """Test GET /v3/spheres/{node_id} with valid node ID."""
         response = client.get("/v3/spheres/test_center")
@@ -216,17 +221,12 @@ class TestSphereEndpoints:
         neighbors = data["links"]
         if len(neighbors) >= 2:
             # Get bearings from center to each neighbor
-            from app.api.v3.endpoints.spheres import _bearing_matrix, _spatial_index
-
-            center_node = _spatial_index.get("test_center")
+            center = data["gps"]
 
             bearings = []
             for neighbor in neighbors:
-                if center_node and neighbor["id"] in _bearing_matrix.get(
-                    center_node.id, {}
-                ):
-                    bearing = _bearing_matrix[center_node.id][neighbor["id"]]
-                    bearings.append(bearing)
+                bearing = SpatialIndex._calculate_bearing(*center, *neighbor["gps"])
+                bearings.append(bearing)
 
             # Check minimum separation (should be ~22.5 degrees for 8 sectors)
             if len(bearings) >= 2:
@@ -253,17 +253,6 @@ class TestSphereErrorHandling:
 
     def _setup_mock_data(self):
         """Setup mock sphere data for testing."""
-        # Clear any existing data
-        from app.api.v3.endpoints.spheres import (
-            _spatial_index,
-            _distance_matrix,
-            _bearing_matrix,
-        )
-
-        _spatial_index.clear()
-        _distance_matrix.clear()
-        _bearing_matrix.clear()
-
         # Create a simple center node for testing
         center_node = SphereNodePanorama(
             id="test_center",
@@ -277,21 +266,12 @@ class TestSphereErrorHandling:
             label="Center",
         )
 
-        # Add node to spatial index and compute matrices
-        SpatialIndex.add_node(center_node)
-        SpatialIndex._compute_distance_and_bearing_matrices()
+        # Install a spatial index of the node
+        spheres._sphere_index = SpatialIndex([center_node])
 
     def _clear_data(self):
         """Clear test data."""
-        from app.api.v3.endpoints.spheres import (
-            _spatial_index,
-            _distance_matrix,
-            _bearing_matrix,
-        )
-
-        _spatial_index.clear()
-        _distance_matrix.clear()
-        _bearing_matrix.clear()
+        spheres._sphere_index = None
 
     def test_invalid_node_id_format(self):
         """Test with invalid node ID format."""
@@ -62,3 +62,39 @@ class TestStationStatusEndpoints:
         assert response.status_code == 400  # Bad Request (custom error handling)
         data = response.json()
         assert "detail" in data
+
+    async def test_etag_and_not_modified(self, client):
+        """Test the conditional requests on the station list."""
+        response = client.get("/v3/station-status/")
+        etag = response.headers["ETag"]
+        assert "Accept-Encoding" in response.headers["Vary"]
+
+        response = client.get("/v3/station-status/", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+
+    async def test_gzip_encoding(self, client):
+        """Test the pre-compressed station payload."""
+        response = client.get(
+            "/v3/station-status/TEST001", headers={"Accept-Encoding": "gzip"}
+        )
+        assert response.status_code == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.headers["ETag"].endswith('-gzip"')
+        assert response.json()["id"] == "TEST001"
+
+
+class TestHealthEndpoint:
+    """Test cases for the health endpoint."""
+
+    def test_health_reports_loop_lag(self):
+        """The lag monitor runs while the application is started."""
+        with TestClient(app) as client:
+            client.get("/v3/station-status/")
+            response = client.get("/health")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "ok"
+        assert set(data["event_loop_lag"]) == {"last_ms", "mean_ms", "max_ms"}
+        assert data["executors"]["stations"]["in_flight"] == 0
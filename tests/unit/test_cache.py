@@ -0,0 +1,106 @@
+"""
+Unit tests for the file cache.
+"""
+
+import asyncio
+import json
+import os
+
+import pytest
+
+from app.utils.cache import FileCache, HotFileStore, signature
+
+
+def _write(path, content, mtime_offset=0):
+    path.write_text(content)
+    stat = os.stat(path)
+    # Make sure the signature changes even within the mtime resolution
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + mtime_offset))
+
+
+class TestFileCache:
+    """Test cases for FileCache."""
+
+    def test_value_is_reused_until_the_file_changes(self, tmp_path):
+        path = tmp_path / "stations.json"
+        _write(path, json.dumps({"A": 1}))
+        cache = FileCache()
+
+        first = cache.get(path)
+        assert first == {"A": 1}
+        assert cache.get(path) is first
+
+        _write(path, json.dumps({"A": 1, "B": 2}), mtime_offset=10**9)
+        assert cache.get(path) == {"A": 1, "B": 2}
+
+    def test_half_written_file_serves_previous_value(self, tmp_path):
+        path = tmp_path / "stations.json"
+        _write(path, json.dumps({"A": 1}))
+        cache = FileCache()
+        cache.get(path)
+
+        _write(path, '{"A": 1, "B"', mtime_offset=10**9)
+        assert cache.get(path) == {"A": 1}
+
+        # Picked up once the file is complete
+        _write(path, json.dumps({"B": 2}), mtime_offset=2 * 10**9)
+        assert cache.get(path) == {"B": 2}
+
+    def test_invalid_file_without_previous_value_raises(self, tmp_path):
+        path = tmp_path / "stations.json"
+        _write(path, "{")
+        with pytest.raises(json.JSONDecodeError):
+            FileCache().get(path)
+
+    def test_missing_file_raises(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            FileCache().get(tmp_path / "missing.json")
+
+    def test_loaders_have_separate_entries(self, tmp_path):
+        path = tmp_path / "stations.json"
+        _write(path, json.dumps({"A": 1}))
+        cache = FileCache()
+        assert cache.get(path) == {"A": 1}
+        assert cache.get(path, lambda content: sorted(json.loads(content))) == ["A"]
+
+    def test_signature_changes_when_the_file_is_replaced(self, tmp_path):
+        path = tmp_path / "stations.json"
+        _write(path, "{}")
+        before = signature(path)
+        replacement = tmp_path / "stations.json.tmp"
+        _write(replacement, "{}")
+        os.replace(replacement, path)
+        assert signature(path) != before
+
+
+class TestHotFileStore:
+    """Test cases for HotFileStore."""
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        for offset in (-1, 0):
+            _write(tmp_path / f"{offset}.json", json.dumps({"offset": offset}))
+        paths = {offset: tmp_path / f"{offset}.json" for offset in (-2, -1, 0)}
+        return HotFileStore(paths, cache=FileCache())
+
+    def test_refresh_loads_changed_files(self, store, tmp_path):
+        # The file of offset -2 is missing
+        assert store.refresh() == 2
+        assert store.peek(0) == {"offset": 0}
+        assert store.peek(-2) is None
+        assert store.refresh() == 0
+
+        _write(tmp_path / "0.json", json.dumps({"offset": "new"}), 10**9)
+        assert store.refresh() == 1
+        assert store.peek(0) == {"offset": "new"}
+
+    def test_stale_values_are_checked_on_access(self, store, tmp_path):
+        store.refresh()
+        store.max_staleness = 0
+        assert store.peek(0) is None
+        _write(tmp_path / "0.json", json.dumps({"offset": "new"}), 10**9)
+        assert asyncio.run(store.get(0)) == {"offset": "new"}
+
+    def test_missing_file_raises(self, store):
+        with pytest.raises(FileNotFoundError):
+            asyncio.run(store.get(-2))
@@ -0,0 +1,97 @@
+"""
+Unit tests for the timeseries downsampling methods.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.utils.downsampling import downsample_timeseries, lttb_indices
+
+
+def _frame(n=5000, tz=None):
+    rng = np.random.default_rng(1)
+    index = pd.date_range("2023-01-01", periods=n, freq="1min", tz=tz, name="timestamp")
+    temperature = np.sin(np.linspace(0, 20, n)) + rng.normal(scale=0.05, size=n)
+    temperature[n // 4] = 25.0  # A spike that must survive
+    wind = rng.uniform(0, 10, size=n)
+    wind[n // 3] = -5.0
+    return pd.DataFrame(
+        {
+            "temperature": temperature,
+            "wind_speed": wind,
+            "latitude": np.full(n, 78.2),
+            "longitude": np.full(n, 15.6),
+        },
+        index=index,
+    )
+
+
+@pytest.mark.parametrize("method", ["lttb", "mean"])
+def test_returns_exactly_n_points(method):
+    df = _frame()
+    result = downsample_timeseries(df, 200, method)
+    assert len(result) == 200
+    assert result.index.is_monotonic_increasing
+    assert list(result.columns) == list(df.columns)
+
+
+def test_minmax_returns_at_most_n_points():
+    df = _frame()
+    result = downsample_timeseries(df, 200, "minmax")
+    assert 100 < len(result) <= 200
+    assert result.index.is_monotonic_increasing
+    assert list(result.columns) == list(df.columns)
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax", "mean"])
+def test_short_series_is_unchanged(method):
+    df = _frame(n=150)
+    assert downsample_timeseries(df, 200, method) is df
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+def test_preserves_extremes(method):
+    df = _frame()
+    result = downsample_timeseries(df, 200, method)
+    assert result["temperature"].max() == 25.0
+    assert result["wind_speed"].min() == -5.0
+
+
+def test_minmax_keeps_extremes_at_their_time():
+    index = pd.date_range("2023-01-01", periods=8, freq="1min")
+    df = pd.DataFrame({"value": [5.0, 9.0, 1.0, 4.0, 0.0, 2.0, 8.0, 3.0]}, index=index)
+    result = downsample_timeseries(df, 4, "minmax")
+    # First bucket: max (9) before min (1); second bucket: min (0) before max (8)
+    assert list(result["value"]) == [9.0, 1.0, 0.0, 8.0]
+    assert list(result.index) == [index[1], index[2], index[4], index[6]]
+
+
+def test_minmax_rows_are_samples():
+    """Test that the extremes of several variables stay on their own rows."""
+    df = _frame()
+    result = downsample_timeseries(df, 200, "minmax")
+    pd.testing.assert_frame_equal(result, df.loc[result.index])
+    assert result["temperature"].idxmax() == df["temperature"].idxmax()
+    assert result["wind_speed"].idxmin() == df["wind_speed"].idxmin()
+
+
+def test_mean_buckets():
+    index = pd.date_range("2023-01-01", periods=6, freq="10min", tz="UTC")
+    df = pd.DataFrame({"value": [1.0, 3.0, np.nan, 5.0, 2.0, 4.0]}, index=index)
+    result = downsample_timeseries(df, 3, "mean")
+    assert list(result["value"]) == [2.0, 5.0, 3.0]
+    assert list(result.index) == list(index[[0, 2, 4]] + pd.Timedelta(minutes=5))
+    assert str(result.index.tz) == "UTC"
+
+
+def test_lttb_indices_keep_bounds_and_peak():
+    x = np.arange(1000, dtype=float)
+    y = np.zeros((1000, 1))
+    y[500] = 1.0
+    indices = lttb_indices(x, y, 50)
+    assert len(indices) == 50
+    assert indices[0] == 0
+    assert indices[-1] == 999
+    assert 500 in indices
+    assert np.all(np.diff(indices) > 0)
@@ -0,0 +1,104 @@
+"""
+Unit tests for the re-encoding of gzipped files.
+"""
+
+import errno
+import gzip
+import os
+
+import pytest
+
+from app.utils import encoding
+from app.utils.encoding import (
+    can_reencode,
+    encode_sibling,
+    fresh_reencodings,
+    is_fresh,
+    iter_gunzip,
+    sibling_path,
+)
+
+
+@pytest.fixture
+def gzipped(tmp_path):
+    path = tmp_path / "aa_wind_2023-01-01T000000Z.json.gz"
+    path.write_bytes(gzip.compress(b'{"data": [1, 2, 3]}' * 1000))
+    return path
+
+
+class TestEncoding:
+    """Test cases for the gunzip stream and the re-encoded siblings."""
+
+    def test_iter_gunzip(self, gzipped):
+        chunks = list(iter_gunzip(gzipped, chunk_size=1024))
+        assert len(chunks) > 1
+        assert all(len(chunk) <= 1024 for chunk in chunks)
+        assert b"".join(chunks) == b'{"data": [1, 2, 3]}' * 1000
+
+    def test_sibling_path(self, gzipped):
+        assert sibling_path(gzipped, "br").name == "aa_wind_2023-01-01T000000Z.json.br"
+        assert sibling_path(gzipped, "zstd").suffix == ".zst"
+
+    def test_sibling_freshness(self, gzipped):
+        sibling = sibling_path(gzipped, "br")
+        assert not is_fresh(sibling, os.stat(gzipped))
+        sibling.write_bytes(b"")
+        stat = os.stat(gzipped)
+        os.utime(sibling, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert is_fresh(sibling, stat)
+        # The source changed since
+        os.utime(gzipped, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        assert not is_fresh(sibling, os.stat(gzipped))
+
+    def test_encode_brotli_sibling(self, gzipped):
+        brotli = pytest.importorskip("brotli")
+        assert encode_sibling(gzipped, "br")
+        sibling = sibling_path(gzipped, "br")
+        assert brotli.decompress(sibling.read_bytes()) == gzip.decompress(
+            gzipped.read_bytes()
+        )
+        assert fresh_reencodings(gzipped, os.stat(gzipped))[0] == "br"
+
+    def test_encode_zstd_sibling(self, gzipped):
+        zstandard = pytest.importorskip("zstandard")
+        assert encode_sibling(gzipped, "zstd")
+        content = (
+            zstandard.ZstdDecompressor()
+            .decompressobj()
+            .decompress(sibling_path(gzipped, "zstd").read_bytes())
+        )
+        assert content == gzip.decompress(gzipped.read_bytes())
+
+    def test_no_reencoding_without_libraries(self, gzipped, monkeypatch):
+        monkeypatch.setattr(encoding, "brotli", None)
+        monkeypatch.setattr(encoding, "zstandard", None)
+        assert fresh_reencodings(gzipped, os.stat(gzipped)) == []
+
+    def test_read_only_directory_is_not_reencoded(self, gzipped, monkeypatch):
+        monkeypatch.setattr(encoding, "_compressor", lambda e: (bytes, bytes))
+        calls = []
+
+        def write_sibling(sibling, chunks, source_stat):
+            calls.append(sibling)
+            raise OSError(errno.EROFS, "Read-only file system")
+
+        monkeypatch.setattr(encoding, "write_sibling", write_sibling)
+        monkeypatch.setattr(encoding, "_read_only_directories", set())
+        assert can_reencode(gzipped)
+        assert not encode_sibling(gzipped, "br")
+        assert not can_reencode(gzipped)
+        # Not attempted again
+        assert not encode_sibling(gzipped, "br")
+        assert len(calls) == 1
+
+    def test_other_write_errors_are_raised(self, gzipped, monkeypatch):
+        monkeypatch.setattr(encoding, "_compressor", lambda e: (bytes, bytes))
+
+        def write_sibling(sibling, chunks, source_stat):
+            raise OSError(errno.ENOSPC, "No space left on device")
+
+        monkeypatch.setattr(encoding, "write_sibling", write_sibling)
+        monkeypatch.setattr(encoding, "_read_only_directories", set())
+        with pytest.raises(OSError):
+            encode_sibling(gzipped, "br")
+        assert can_reencode(gzipped)
@@ -0,0 +1,125 @@
+"""
+Unit tests for the blocking work executor.
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.utils import executor
+from app.utils.executor import (
+    EventLoopLagMonitor,
+    _call_in_process,
+    _RemoteHTTPException,
+    get_limit,
+    iterate_blocking,
+    run_blocking,
+    shutdown_executors,
+)
+
+
+def _raise_not_found():
+    raise HTTPException(status_code=404, detail="Station not found")
+
+
+class TestRunBlocking:
+    """Test cases for run_blocking and iterate_blocking."""
+
+    def test_runs_outside_the_event_loop(self):
+        async def main():
+            loop_thread = threading.get_ident()
+            worker_thread = await run_blocking(threading.get_ident)
+            return loop_thread, worker_thread
+
+        loop_thread, worker_thread = asyncio.run(main())
+        assert loop_thread != worker_thread
+
+    def test_passes_arguments_and_reraises(self):
+        assert asyncio.run(run_blocking(divmod, 7, 2)) == (3, 1)
+        assert asyncio.run(run_blocking(int, "12", base=8)) == 10
+        with pytest.raises(HTTPException) as e:
+            asyncio.run(run_blocking(_raise_not_found))
+        assert e.value.status_code == 404
+
+    def test_group_limit(self, monkeypatch):
+        monkeypatch.setenv("SWI_METOBS_BACKEND_LIMIT_TESTLIMIT", "2")
+        assert get_limit("testlimit") == 2
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def work():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+
+        async def main():
+            await asyncio.gather(
+                *[run_blocking(work, group="testlimit") for _ in range(6)]
+            )
+
+        asyncio.run(main())
+        assert max(peak) == 2
+        assert executor.executor_stats()["testlimit"] == {"in_flight": 0, "limit": 2}
+
+    def test_iterate_blocking(self):
+        async def main():
+            return [item async for item in iterate_blocking(iter(range(5)))]
+
+        assert asyncio.run(main()) == [0, 1, 2, 3, 4]
+
+    def test_http_exception_crosses_process_boundary(self):
+        """HTTPException can not be pickled, it is carried as a plain exception."""
+        with pytest.raises(_RemoteHTTPException) as e:
+            _call_in_process(_raise_not_found)
+        assert e.value.args == (404, "Station not found", None)
+
+
+class TestEventLoopLagMonitor:
+    """Test cases for the event loop lag monitor."""
+
+    def test_measures_blocking_calls(self):
+        async def main():
+            monitor = EventLoopLagMonitor(interval=0.01, warning_threshold=10)
+            monitor.start()
+            await asyncio.sleep(0.03)
+            # A blocking callback of the event loop, like a blocking endpoint
+            asyncio.get_running_loop().call_soon(time.sleep, 0.1)
+            await asyncio.sleep(0.03)
+            await monitor.stop()
+            return monitor.stats()
+
+        stats = asyncio.run(main())
+        assert stats["max_ms"] >= 80
+        assert stats["mean_ms"] <= stats["max_ms"]
+
+    def test_run_blocking_keeps_loop_responsive(self):
+        async def main():
+            monitor = EventLoopLagMonitor(interval=0.01, warning_threshold=10)
+            monitor.start()
+            await run_blocking(time.sleep, 0.1)
+            await monitor.stop()
+            return monitor.stats()
+
+        stats = asyncio.run(main())
+        assert stats["max_ms"] < 80
+
+    def test_shutdown_keeps_loop_responsive(self):
+        async def main():
+            task = asyncio.create_task(run_blocking(time.sleep, 0.1))
+            await asyncio.sleep(0.01)
+            monitor = EventLoopLagMonitor(interval=0.01, warning_threshold=10)
+            monitor.start()
+            await shutdown_executors()
+            assert task.done()
+            await monitor.stop()
+            return monitor.stats()
+
+        stats = asyncio.run(main())
+        assert stats["max_ms"] < 80
@@ -0,0 +1,73 @@
+"""
+Unit tests for the streaming export encoders.
+"""
+
+import io
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app.utils.export import export_columns, stream_ndjson, stream_parquet
+
+
+def _write_day(path, day, data):
+    index = pd.date_range(day, periods=3, freq="1h", name="timestamp")
+    file_path = path / f"{day}.parquet"
+    pd.DataFrame(data, index=index).to_parquet(file_path)
+    return file_path
+
+
+class TestParquetExport:
+    """Test cases for the Parquet export of daily files of differing types."""
+
+    def test_types_unified_over_all_days(self, tmp_path):
+        """Test an int column, then a day with floats and a new column."""
+        files = [
+            _write_day(tmp_path, "2023-01-01", {"a": [1, 2, 3]}),
+            _write_day(
+                tmp_path,
+                "2023-01-02",
+                {"a": [1.5, float("nan"), 3.0], "b": [None, None, None]},
+            ),
+        ]
+        columns, types = export_columns(files)
+        assert columns == ["a", "b"]
+        assert types["a"] == pa.float64()
+        assert types["b"] == pa.float64()
+
+        chunks = [("S1", pd.read_parquet(file_path)) for file_path in files]
+        content = b"".join(stream_parquet(chunks, columns, types))
+        table = pq.read_table(io.BytesIO(content))
+        assert table.num_rows == 6
+        assert table.column("a").to_pylist() == [1.0, 2.0, 3.0, 1.5, None, 3.0]
+        assert table.column("b").null_count == 6
+
+    def test_variables_selected(self, tmp_path):
+        """Test that only the requested variables are exported, in order."""
+        files = [
+            _write_day(tmp_path, "2023-01-01", {"a": [1, 2, 3], "b": [4, 5, 6]}),
+            _write_day(tmp_path, "2023-01-02", {"c": [1.0, 2.0, 3.0], "a": [1, 2, 3]}),
+        ]
+        columns, types = export_columns(files, ["c", "a"])
+        assert columns == ["c", "a"]
+        assert pa.types.is_timestamp(types["timestamp"])
+
+
+class TestNdjsonExport:
+    """Test cases for the NDJSON export."""
+
+    def test_floats_in_shortest_form(self):
+        index = pd.date_range("2023-01-01", periods=3, freq="1h", name="timestamp")
+        values = [0.1 + 0.2, 1 / 3, float("nan")]
+        df = pd.DataFrame({"temperature": values, "count": [1, 2, 3]}, index=index)
+        body = b"".join(stream_ndjson([("TEST001", df)], ["temperature", "count"]))
+        lines = body.decode().splitlines()
+        assert len(lines) == 3
+        assert lines[0] == (
+            '{"id":"TEST001","timestamp":"2023-01-01T00:00:00",'
+            '"temperature":0.30000000000000004,"count":1}'
+        )
+        assert [json.loads(line)["temperature"] for line in lines[:2]] == values[:2]
+        assert json.loads(lines[2])["temperature"] is None
@@ -0,0 +1,125 @@
+"""
+Unit tests for the forecast file catalog.
+"""
+
+import os
+from datetime import datetime
+
+import pytest
+
+from app.utils.forecast_catalog import ForecastCatalog, parse_filename
+
+
+@pytest.fixture
+def base_dir(tmp_path, monkeypatch):
+    """Two models with COG and velocity files, relative to the working directory."""
+    monkeypatch.chdir(tmp_path)
+    base = tmp_path / "forecast"
+    for model in ("aa", "mc"):
+        (base / model / "cog").mkdir(parents=True)
+        (base / model / "velocity").mkdir(parents=True)
+        for hour in range(0, 24, 6):
+            timestamp = f"2023-01-01T{hour:02d}0000Z"
+            (base / model / "cog" / f"cog_temperature_{timestamp}.tif").touch()
+            (base / model / "cog" / f"cog_wind_speed_{timestamp}.tif").touch()
+            (base / model / "velocity" / f"{model}_wind_{timestamp}.json.gz").touch()
+    (base / "aa" / "cog" / "notes.txt").touch()
+    return base
+
+
+def _window(start_hour, end_hour):
+    return datetime(2023, 1, 1, start_hour), datetime(2023, 1, 1, end_hour)
+
+
+class TestParseFilename:
+    """Test cases for parse_filename."""
+
+    def test_cog(self):
+        assert parse_filename("cog_wind_speed_2023-01-01T060000Z.tif", "cog") == (
+            "wind_speed",
+            "2023-01-01T060000Z",
+            datetime(2023, 1, 1, 6),
+        )
+
+    def test_velocity(self):
+        stem, timestamp_str, _ = parse_filename(
+            "aa_wind_2023-01-01T060000Z.json.gz", "velocity"
+        )
+        assert (stem, timestamp_str) == ("aa_wind", "2023-01-01T060000Z")
+
+    def test_invalid(self):
+        assert parse_filename("notes.txt", "cog") is None
+        assert parse_filename("cog_temperature_latest.tif", "cog") is None
+        assert parse_filename("aa_wind_2023.json", "velocity") is None
+
+
+class TestForecastCatalog:
+    """Test cases for ForecastCatalog."""
+
+    def test_time_window(self, base_dir):
+        catalog = ForecastCatalog(base_dir)
+        files = catalog.files("temperature", None, "cog", *_window(6, 12))
+        assert [(f.model, f.timestamp) for f in files] == [
+            ("aa", "2023-01-01T060000Z"),
+            ("aa", "2023-01-01T120000Z"),
+            ("mc", "2023-01-01T060000Z"),
+            ("mc", "2023-01-01T120000Z"),
+        ]
+        assert files[0].file_path == os.path.join(
+            "forecast", "aa", "cog", "cog_temperature_2023-01-01T060000Z.tif"
+        )
+
+    def test_variable_is_not_a_prefix_match(self, base_dir):
+        catalog = ForecastCatalog(base_dir)
+        assert catalog.files("wind", ["aa"], "cog", *_window(0, 23)) == []
+        assert len(catalog.files("wind_speed", ["aa"], "cog", *_window(0, 23))) == 4
+
+    def test_velocity_files(self, base_dir):
+        catalog = ForecastCatalog(base_dir)
+        files = catalog.files("wind", ["mc", "unknown"], "velocity", *_window(0, 6))
+        assert [f.file_path for f in files] == [
+            "mc_wind_2023-01-01T000000Z.json.gz",
+            "mc_wind_2023-01-01T060000Z.json.gz",
+        ]
+
+    def test_refresh_on_directory_change(self, base_dir):
+        catalog = ForecastCatalog(base_dir)
+        assert len(catalog.files("temperature", ["aa"], "cog", *_window(0, 23))) == 4
+
+        cog_dir = base_dir / "aa" / "cog"
+        (cog_dir / "cog_temperature_2023-01-01T030000Z.tif").touch()
+        stat = os.stat(cog_dir)
+        os.utime(cog_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        files = catalog.files("temperature", ["aa"], "cog", *_window(0, 23))
+        assert [f.timestamp[11:13] for f in files] == ["00", "03", "06", "12", "18"]
+
+    def test_listing_has_no_side_effect(self, base_dir):
+        """Test that the siblings of removed velocity files are left to the writers."""
+        velocity_dir = base_dir / "aa" / "velocity"
+        orphan = velocity_dir / "aa_wind_2022-12-31T180000Z.json.br"
+        orphan.touch()
+
+        catalog = ForecastCatalog(base_dir)
+        directory = catalog.directory("aa", "velocity")
+        assert orphan.exists()
+        assert catalog.directory("aa", "velocity") is directory
+
+    def test_directories(self, base_dir):
+        catalog = ForecastCatalog(base_dir)
+        velocity_file = (
+            base_dir / "mc" / "velocity" / "mc_wind_2023-01-01T060000Z.json.gz"
+        )
+        os.utime(velocity_file, (2_000_000_000, 2_000_000_000))
+
+        directories = catalog.directories()
+        assert sorted(directories) == [
+            ("aa", "cog"),
+            ("aa", "velocity"),
+            ("mc", "cog"),
+            ("mc", "velocity"),
+        ]
+        series = directories["mc", "velocity"].series["mc_wind"]
+        assert len(series.files) == 4
+        # The modification time of the most recently written file
+        assert series.updated_at == 2_000_000_000
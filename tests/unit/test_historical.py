@@ -0,0 +1,99 @@
+"""
+Unit tests for the historical timeseries read engine.
+"""
+
+import pandas as pd
+
+from app.utils.historical import get_parquet_columns, read_timeseries
+
+
+def _write_day(path, day, tz=None, with_location=True):
+    index = pd.date_range(day, periods=24, freq="1h", tz=tz, name="timestamp")
+    data = {
+        "temperature": range(24),
+        "humidity": [50.0] * 24,
+    }
+    if with_location:
+        data["latitude"] = [78.2] * 24
+        data["longitude"] = [15.6] * 24
+    df = pd.DataFrame(data, index=index)
+    file_path = path / f"{day}.parquet"
+    df.to_parquet(file_path)
+    return file_path
+
+
+class TestReadTimeseries:
+    """Test cases for read_timeseries."""
+
+    def test_reads_whole_days(self, tmp_path):
+        files = [
+            _write_day(tmp_path, "2023-01-01"),
+            _write_day(tmp_path, "2023-01-02"),
+        ]
+        df = read_timeseries(files, "2023-01-01", "2023-01-02")
+        assert len(df) == 48
+        assert df.index.name == "timestamp"
+        assert df.index.is_monotonic_increasing
+        assert set(df.columns) == {"temperature", "humidity", "latitude", "longitude"}
+
+    def test_filters_time_range(self, tmp_path):
+        files = [
+            _write_day(tmp_path, "2023-01-01"),
+            _write_day(tmp_path, "2023-01-02"),
+        ]
+        df = read_timeseries(files, "2023-01-02", "2023-01-02")
+        assert len(df) == 24
+        assert df.index.min() == pd.Timestamp("2023-01-02 00:00")
+        assert df.index.max() == pd.Timestamp("2023-01-02 23:00")
+
+    def test_filters_time_range_timezone_aware(self, tmp_path):
+        files = [
+            _write_day(tmp_path, "2023-01-01", tz="UTC"),
+            _write_day(tmp_path, "2023-01-02", tz="UTC"),
+        ]
+        df = read_timeseries(files, "2023-01-01", "2023-01-01")
+        assert len(df) == 24
+        assert str(df.index.tz) == "UTC"
+
+    def test_projects_variables_and_keeps_location(self, tmp_path):
+        files = [_write_day(tmp_path, "2023-01-01")]
+        df = read_timeseries(files, "2023-01-01", "2023-01-01", ["temperature"])
+        assert list(df.columns) == ["temperature", "latitude", "longitude"]
+
+    def test_ignores_unknown_variables(self, tmp_path):
+        files = [_write_day(tmp_path, "2023-01-01", with_location=False)]
+        df = read_timeseries(files, "2023-01-01", "2023-01-01", ["temperature", "x"])
+        assert list(df.columns) == ["temperature"]
+
+    def test_unifies_column_types(self, tmp_path):
+        """Test days with an int column, then floats and a new column."""
+        index = pd.date_range("2023-01-01", periods=3, freq="1h", name="timestamp")
+        pd.DataFrame({"t": [1, 2, 3]}, index=index).to_parquet(
+            tmp_path / "2023-01-01.parquet"
+        )
+        pd.DataFrame(
+            {"t": [1.5, float("nan"), 3.0], "wind": [4.0, 5.0, 6.0]},
+            index=index + pd.Timedelta(days=1),
+        ).to_parquet(tmp_path / "2023-01-02.parquet")
+        files = [tmp_path / "2023-01-01.parquet", tmp_path / "2023-01-02.parquet"]
+
+        df = read_timeseries(files, "2023-01-01", "2023-01-02")
+        assert len(df) == 6
+        assert df["t"].dtype == "float64"
+        assert df["t"].iloc[3] == 1.5
+        assert df["wind"].isna().sum() == 3
+        assert df["wind"].iloc[5] == 6.0
+
+        df = read_timeseries(files, "2023-01-01", "2023-01-02", ["wind"])
+        assert list(df.columns) == ["wind"]
+        assert len(df) == 6
+
+
+def test_get_parquet_columns(tmp_path):
+    file_path = _write_day(tmp_path, "2023-01-01")
+    assert get_parquet_columns(file_path) == [
+        "temperature",
+        "humidity",
+        "latitude",
+        "longitude",
+    ]
@@ -0,0 +1,83 @@
+"""
+Unit tests for the pre-rendered responses.
+"""
+
+import gzip
+
+from app.utils.response import (
+    etag_matches,
+    is_not_modified,
+    parse_accept_encoding,
+    render_payload,
+    select_encoding,
+)
+
+
+class TestRenderPayload:
+    """Test cases for render_payload."""
+
+    def test_bodies_and_etag(self):
+        content = b'{"id": "TEST001"}' * 100
+        payload = render_payload(content)
+        assert payload.bodies["identity"] == content
+        assert gzip.decompress(payload.bodies["gzip"]) == content
+        # Deterministic: the same content gives the same bodies and ETag
+        assert render_payload(content) == payload
+        assert render_payload(content + b" ").etag != payload.etag
+
+    def test_etag_per_encoding(self):
+        payload = render_payload(b"{}")
+        assert payload.etag_for("identity") == f'"{payload.etag}"'
+        assert payload.etag_for("gzip") == f'"{payload.etag}-gzip"'
+
+
+class TestEncodingNegotiation:
+    """Test cases for the Accept-Encoding negotiation."""
+
+    def test_parse_q_values(self):
+        assert parse_accept_encoding("gzip;q=0.5, br, *;q=0") == {
+            "gzip": 0.5,
+            "br": 1.0,
+            "*": 0.0,
+        }
+        assert parse_accept_encoding(None) == {}
+
+    def test_select_encoding(self):
+        available = ["br", "gzip", "identity"]
+        assert select_encoding("gzip, deflate, br", available) == "br"
+        assert select_encoding("br;q=0.5, gzip", available) == "gzip"
+        assert select_encoding("deflate", available) == "identity"
+        assert select_encoding(None, available) == "identity"
+        assert select_encoding("*", ["gzip", "identity"]) == "gzip"
+        assert select_encoding("identity;q=0", ["identity"]) is None
+
+    def test_etag_matches(self):
+        assert etag_matches('"abc"', "abc")
+        assert etag_matches('W/"abc-gzip"', "abc")
+        assert etag_matches('"other", "abc-br"', "abc")
+        assert etag_matches("*", "abc")
+        assert not etag_matches('"abcd"', "abc")
+        assert not etag_matches(None, "abc")
+
+    def test_is_not_modified(self):
+        last_modified = "Sun, 01 Jan 2023 12:00:00 GMT"
+        assert is_not_modified({"If-None-Match": '"abc"'}, '"abc"')
+        assert is_not_modified(
+            {"If-Modified-Since": "Sun, 01 Jan 2023 13:00:00 GMT"},
+            '"abc"',
+            last_modified,
+        )
+        assert not is_not_modified(
+            {"If-Modified-Since": "Sun, 01 Jan 2023 11:00:00 GMT"},
+            '"abc"',
+            last_modified,
+        )
+        # If-None-Match takes precedence
+        assert not is_not_modified(
+            {"If-None-Match": '"other"', "If-Modified-Since": last_modified},
+            '"abc"',
+            last_modified,
+        )
+        assert not is_not_modified(
+            {"If-Modified-Since": "yesterday"}, '"abc"', last_modified
+        )
@@ -0,0 +1,208 @@
+"""
+Unit tests for the long timeseries rollups.
+"""
+
+import fcntl
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.utils.rollup import (
+    ROLLUP_LEVELS,
+    RollupQuery,
+    _bucket_count,
+    _minutes,
+    aggregate,
+    build_rollups,
+    build_station_rollups,
+    combine,
+    plan_rollup,
+    to_means,
+)
+
+STATION = "TEST001"
+DATES = [d.strftime("%Y-%m-%d") for d in pd.date_range("2023-01-30", "2023-02-03")]
+
+
+@pytest.fixture
+def source_dir(tmp_path):
+    """Five days of 1 minute observations crossing a month boundary."""
+    rng = np.random.default_rng(42)
+    station_dir = tmp_path / "long" / STATION
+    station_dir.mkdir(parents=True)
+    for date in DATES:
+        index = pd.date_range(date, periods=1440, freq="1min", name="timestamp")
+        temperature = rng.normal(size=1440)
+        temperature[::7] = np.nan
+        df = pd.DataFrame(
+            {
+                "temperature": temperature,
+                "wind_speed": rng.uniform(0, 20, size=1440),
+                "latitude": 78.2 + rng.normal(scale=0.01, size=1440),
+                "longitude": 15.6 + rng.normal(scale=0.01, size=1440),
+            },
+            index=index,
+        )
+        df.to_parquet(station_dir / f"{date}.parquet")
+    return tmp_path / "long"
+
+
+def _raw_resample(source_dir, interval):
+    files = [source_dir / STATION / f"{d}.parquet" for d in DATES]
+    df = pd.concat(pd.read_parquet(f) for f in files)
+    return df.resample(f"{interval}min").mean()
+
+
+class TestAggregation:
+    """Test cases for aggregate and combine."""
+
+    def test_combine_matches_direct_aggregation(self, source_dir):
+        df = pd.read_parquet(source_dir / STATION / f"{DATES[0]}.parquet")
+        fine = aggregate(df, pd.Timedelta(minutes=10))
+        direct = aggregate(df, pd.Timedelta(hours=6))
+        combined = combine(fine, pd.Timedelta(hours=6))
+        pd.testing.assert_frame_equal(
+            combined[direct.columns], direct, check_dtype=False, check_freq=False
+        )
+
+    def test_to_means_keeps_location(self, source_dir):
+        df = pd.read_parquet(source_dir / STATION / f"{DATES[0]}.parquet")
+        means = to_means(aggregate(df, pd.Timedelta(hours=1)), ["wind_speed"])
+        assert list(means.columns) == ["wind_speed", "latitude", "longitude"]
+
+
+def _plan(minutes, max_timesteps=200):
+    first = pd.Timestamp("2020-01-01")
+    return plan_rollup(first, first + pd.Timedelta(minutes=minutes), max_timesteps)
+
+
+class TestPlanRollup:
+    """Test cases for plan_rollup."""
+
+    def test_short_range_reads_raw_data(self):
+        level, interval = _plan(24 * 60)
+        assert level is None
+        assert interval == 8
+
+    def test_one_year_uses_hourly_level(self):
+        level, interval = _plan(365 * 24 * 60)
+        assert level.name == "1h"
+        assert interval == 44 * 60
+
+    def test_coarsest_dividing_level(self):
+        level, interval = _plan(3 * 365 * 24 * 60)
+        assert interval == 22 * 6 * 60
+        assert level.name == "6h"
+
+    def test_interval_is_finest_that_fits(self):
+        for days in (3, 10, 30, 90, 365, 3650):
+            first = pd.Timestamp("2020-01-01 07:00")
+            last = first + pd.Timedelta(days=days)
+            level, interval = plan_rollup(first, last, 200)
+            if level is not None:
+                assert interval % _minutes(level.freq) == 0
+            assert _bucket_count(first, last, interval) <= 200
+            assert interval <= 1.1 * days * 24 * 60 / 200 + 6 * 60
+
+    def test_counts_the_last_bucket(self):
+        """201 timestamps 10 minutes apart do not fit in 200 10 minute bins."""
+        first = pd.Timestamp("2020-01-01")
+        last = first + pd.Timedelta(minutes=2000)
+        assert _bucket_count(first, last, 10) == 201
+        _, interval = plan_rollup(first, last, 200)
+        assert interval == 11
+        assert _bucket_count(first, last, interval) <= 200
+
+
+class TestRollupQuery:
+    """Test cases for building and reading the rollups."""
+
+    def test_build_writes_partitions(self, source_dir, tmp_path):
+        rollup_dir = tmp_path / "rollups"
+        written = build_station_rollups(STATION, source_dir, rollup_dir)
+        # 2 monthly partitions for 10min and 1h, 1 yearly for 6h and 1d
+        assert written == 6
+        assert (rollup_dir / "10min" / STATION / "2023-01.parquet").exists()
+        assert (rollup_dir / "1d" / STATION / "2023.parquet").exists()
+        # Nothing to do when the sources did not change
+        assert build_station_rollups(STATION, source_dir, rollup_dir) == 0
+
+    def test_build_all_stations_once_at_a_time(self, source_dir, tmp_path):
+        rollup_dir = tmp_path / "rollups"
+        rollup_dir.mkdir()
+        with open(rollup_dir / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another process holds the lock
+            assert build_rollups(None, source_dir, rollup_dir) is None
+        assert build_rollups(None, source_dir, rollup_dir) == 6
+        assert build_rollups(None, tmp_path / "none", tmp_path / "none") == 0
+
+    def test_resample_matches_raw_resample(self, source_dir, tmp_path):
+        rollup_dir = tmp_path / "rollups"
+        build_station_rollups(STATION, source_dir, rollup_dir)
+        query = RollupQuery(STATION, DATES, DATES[0], DATES[-1], source_dir, rollup_dir)
+        resampled = query.resample(50)
+        assert resampled is not None
+        assert len(resampled) <= 50
+
+        level, interval = _plan(5 * 1440 - 1, 50)
+        assert level == ROLLUP_LEVELS[0]
+        expected = _raw_resample(source_dir, interval)
+        pd.testing.assert_frame_equal(
+            resampled[expected.columns], expected, check_freq=False
+        )
+
+    def test_resample_without_rollups(self, source_dir, tmp_path):
+        query = RollupQuery(
+            STATION, DATES, DATES[0], DATES[-1], source_dir, tmp_path / "none"
+        )
+        resampled = query.resample(200, ["temperature"])
+        _, interval = _plan(5 * 1440 - 1)
+        expected = _raw_resample(source_dir, interval)
+        assert list(resampled.columns) == ["temperature", "latitude", "longitude"]
+        np.testing.assert_allclose(
+            resampled["temperature"], expected["temperature"], equal_nan=True
+        )
+
+    def test_stale_partition_falls_back_to_raw(self, source_dir, tmp_path):
+        rollup_dir = tmp_path / "rollups"
+        build_station_rollups(STATION, source_dir, rollup_dir)
+
+        # Update the last day after the rollups were built
+        path = source_dir / STATION / f"{DATES[-1]}.parquet"
+        df = pd.read_parquet(path)
+        df["wind_speed"] = 100.0
+        df.to_parquet(path)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        query = RollupQuery(STATION, DATES, DATES[0], DATES[-1], source_dir, rollup_dir)
+        daily = query.level(ROLLUP_LEVELS[-1])
+        assert daily["wind_speed__mean"].iloc[-1] == 100.0
+        assert daily["wind_speed__mean"].iloc[0] < 100.0
+
+    def test_resample_boundary(self, tmp_path):
+        """Test that exactly max_timesteps + 1 rows are resampled to fit."""
+        index = pd.date_range("2023-01-01", periods=201, freq="10min", name="timestamp")
+        df = pd.DataFrame({"temperature": np.arange(201.0)}, index=index)
+        station_dir = tmp_path / "long" / STATION
+        station_dir.mkdir(parents=True)
+        dates = []
+        for date, day in df.groupby(df.index.date):
+            dates.append(str(date))
+            day.to_parquet(station_dir / f"{date}.parquet")
+
+        query = RollupQuery(
+            STATION, dates, dates[0], dates[-1], tmp_path / "long", tmp_path / "none"
+        )
+        resampled = query.resample(200)
+        assert len(resampled) <= 200
+        assert resampled["temperature"].iloc[-1] == 200.0
+
+    def test_small_range_is_not_resampled(self, source_dir, tmp_path):
+        query = RollupQuery(
+            STATION, DATES[:1], DATES[0], DATES[0], source_dir, tmp_path
+        )
+        assert query.resample(10_000) is None
@@ -0,0 +1,96 @@
+"""
+Unit tests for the historical timeseries serializer.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from app.models.stations import (
+    StationPosition,
+    StationTimeseries,
+    StationTimeseriesDataPoint,
+)
+from app.utils.serialization import format_timestamps, serialize_station_timeseries
+
+
+def _serialize_with_models(station_id, df):
+    """Reference implementation building one pydantic model per row."""
+    timeseries = []
+    for index, row in df.iterrows():
+        data_point = {}
+        if "latitude" in df.columns and "longitude" in df.columns:
+            data_point["location"] = StationPosition(
+                lat=row.get("latitude"), lon=row.get("longitude")
+            )
+        for column in df.columns:
+            if column not in ["latitude", "longitude"]:
+                data_point[column] = row.get(column)
+        timeseries.append(
+            StationTimeseriesDataPoint(timestamp=index.to_pydatetime(), **data_point)
+        )
+    return StationTimeseries(id=station_id, timeseries=timeseries).model_dump_json()
+
+
+def _frame(tz=None):
+    index = pd.date_range("2023-01-01", periods=6, freq="10min", tz=tz)
+    return pd.DataFrame(
+        {
+            "temperature": [1.5, -2.25, np.nan, 0.1, 12.345678901234, 3.0],
+            "latitude": [78.2, 78.2, 78.21, np.nan, 78.2, 78.2],
+            "longitude": [15.6, 15.6, 15.61, np.nan, 15.6, 15.6],
+        },
+        index=index,
+    )
+
+
+class TestSerializeStationTimeseries:
+    """Test cases for serialize_station_timeseries."""
+
+    def test_matches_pydantic_wire_format(self):
+        df = _frame()
+        expected = _serialize_with_models("TEST001", df).encode()
+        assert serialize_station_timeseries("TEST001", df) == expected
+
+    def test_matches_pydantic_wire_format_timezone_aware(self):
+        df = _frame(tz="UTC")
+        expected = _serialize_with_models("TEST001", df).encode()
+        assert serialize_station_timeseries("TEST001", df) == expected
+
+    def test_same_bytes_as_pydantic(self):
+        """Test that the floats are written in their shortest form."""
+        index = pd.date_range("2023-01-01", periods=3, freq="10min", tz="UTC")
+        df = pd.DataFrame(
+            {
+                "pressure": [1013.2, np.nan, 1e-7],
+                "temperature": [12.345, -0.1, 3.0],
+                "latitude": [78.1, 78.1, 78.1],
+                "longitude": [15.6, 15.6, np.nan],
+            },
+            index=index,
+        )
+        expected = _serialize_with_models("TEST001", df).encode()
+        assert serialize_station_timeseries("TEST001", df) == expected
+        assert b"78.1," in expected
+
+    def test_without_location(self):
+        df = _frame().drop(columns=["latitude", "longitude"])
+        data = json.loads(serialize_station_timeseries("TEST001", df))
+        assert data["id"] == "TEST001"
+        assert len(data["timeseries"]) == 6
+        assert "location" not in data["timeseries"][0]
+        assert data["timeseries"][2]["temperature"] is None
+
+    def test_empty_frame(self):
+        df = _frame().iloc[:0]
+        data = json.loads(serialize_station_timeseries("TEST001", df))
+        assert data == {"id": "TEST001", "timeseries": []}
+
+
+def test_format_timestamps_sub_second():
+    index = pd.DatetimeIndex(["2023-01-01 00:00:00", "2023-01-01 00:00:00.5"])
+    assert list(format_timestamps(index)) == [
+        "2023-01-01T00:00:00.000000",
+        "2023-01-01T00:00:00.500000",
+    ]
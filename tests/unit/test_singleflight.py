@@ -0,0 +1,85 @@
+"""
+Unit tests for the coalescing of concurrent calls.
+"""
+
+import asyncio
+
+import pytest
+
+from app.utils.singleflight import SingleFlight
+
+
+class TestSingleFlight:
+    """Test cases for SingleFlight."""
+
+    def test_concurrent_calls_share_one_call(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def work(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return value * 2
+
+        async def run():
+            results = await asyncio.gather(
+                *[flight.run("key", work, i) for i in range(5)]
+            )
+            # The next call, once the first is done, runs again
+            return results, await flight.run("key", work, 10)
+
+        results, again = asyncio.run(run())
+        assert results == [0] * 5
+        assert calls == [0, 10]
+        assert again == 20
+
+    def test_keys_are_independent(self):
+        flight = SingleFlight()
+
+        async def work(value):
+            await asyncio.sleep(0.01)
+            return value
+
+        async def run():
+            return await asyncio.gather(
+                flight.run("a", work, 1), flight.run("b", work, 2)
+            )
+
+        assert asyncio.run(run()) == [1, 2]
+
+    def test_exception_shared(self):
+        flight = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise ValueError("failed")
+
+        async def run():
+            return await asyncio.gather(
+                flight.run("key", work), flight.run("key", work), return_exceptions=True
+            )
+
+        results = asyncio.run(run())
+        assert len(calls) == 1
+        assert all(isinstance(result, ValueError) for result in results)
+        assert flight.get("key") is None
+
+    def test_cancelled_caller_does_not_cancel_the_call(self):
+        flight = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        async def run():
+            first = asyncio.ensure_future(flight.run("key", work))
+            second = asyncio.ensure_future(flight.run("key", work))
+            await asyncio.sleep(0.005)
+            first.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await first
+            return await second
+
+        assert asyncio.run(run()) == "done"
@@ -2,30 +2,42 @@
 Unit tests for sphere utility functions.
 """
 
+import asyncio
 import math
+import time
+
+import httpx
+import numpy as np
+from app.api.v3.endpoints import spheres
 from app.api.v3.endpoints.spheres import SpatialIndex
 from app.models.spheres import SphereNodePanorama, SphereNode
-from datetime import datetime
+from datetime import datetime, timedelta
+
+import pytest
 
 
 class TestSpatialIndex:
     """Test cases for SpatialIndex utility functions."""
 
-    def test_get_grid_key(self):
-        """Test grid key calculation."""
-        # Test basic grid key calculation
-        grid_key = SpatialIndex._get_grid_key(6.8586, 45.8326)
-        assert len(grid_key) == 2
-        assert isinstance(grid_key[0], float)
-        assert isinstance(grid_key[1], float)
+    def test_get_cell_key(self):
+        """Test the grid cell keys."""
+        cells = SpatialIndex._cell_coordinates(6.8586, 45.8326)
+        assert cells.shape == (3,)
+
+        # Test that same coordinates produce same cell key
+        key = SpatialIndex._get_cell_key(cells)
+        assert key == SpatialIndex._get_cell_key(
+            SpatialIndex._cell_coordinates(6.8586, 45.8326)
+        )
 
-        # Test that same coordinates produce same grid key
-        grid_key2 = SpatialIndex._get_grid_key(6.8586, 45.8326)
-        assert grid_key == grid_key2
+        # Test that different coordinates produce different cell keys
+        assert key != SpatialIndex._get_cell_key(
+            SpatialIndex._cell_coordinates(7.0, 46.0)
+        )
 
-        # Test that different coordinates produce different grid keys
-        grid_key3 = SpatialIndex._get_grid_key(7.0, 46.0)
-        assert grid_key != grid_key3
+        # Test that neighboring cells produce different cell keys
+        offsets = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1], [-1, -1, -1]])
+        assert len(set(SpatialIndex._get_cell_key(cells + offsets))) == 5
 
     def test_haversine_distance(self):
         """Test Haversine distance calculation."""
@@ -61,11 +73,11 @@ class TestSpatialIndex:
         assert 265 < bearing < 275  # West direction
 
 
-class TestDistanceMatrix:
-    """Test cases for distance matrix computation."""
+class TestDistancesAndBearings:
+    """Test cases for the vectorized distance and bearing computation."""
 
-    def test_distance_matrix_creation(self):
-        """Test distance matrix creation with mock nodes."""
+    def test_distances_and_bearings(self):
+        """Test the distances and bearings between mock nodes."""
         # Create some mock nodes
         nodes = [
             SphereNodePanorama(
@@ -103,31 +115,31 @@ class TestDistanceMatrix:
             ),
         ]
 
-        # Add nodes to spatial index
-        for node in nodes:
-            SpatialIndex.add_node(node)
-
-        # Compute distance matrix
-        SpatialIndex._compute_distance_and_bearing_matrices()
-
-        # Check that distance matrix was created
-        from app.api.v3.endpoints.spheres import _distance_matrix, _bearing_matrix
+        # Build the spatial index
+        index = SpatialIndex(nodes)
+        assert index.coordinates.shape == (3, 2)
 
-        assert len(_distance_matrix) == 3
-        assert len(_bearing_matrix) == 3
+        distances = {
+            node.id: index.distances_and_bearings(node.id)[0] for node in nodes
+        }
+        bearings = {node.id: index.distances_and_bearings(node.id)[1] for node in nodes}
 
         # Check self-distances are 0
-        assert _distance_matrix["node1"]["node1"] == 0.0
-        assert _distance_matrix["node2"]["node2"] == 0.0
-        assert _distance_matrix["node3"]["node3"] == 0.0
+        for row, node in enumerate(nodes):
+            assert distances[node.id][row] == 0.0
 
         # Check that distances are symmetric
-        assert _distance_matrix["node1"]["node2"] == _distance_matrix["node2"]["node1"]
-        assert _distance_matrix["node1"]["node3"] == _distance_matrix["node3"]["node1"]
+        assert distances["node1"][1] == distances["node2"][0]
+        assert distances["node1"][2] == distances["node3"][0]
+
+        # Check that they match the scalar computation
+        assert distances["node1"][1] == SpatialIndex._haversine_distance(
+            0.0, 0.0, 1.0, 0.0
+        )
 
         # Check that bearings are reasonable
-        bearing_1_to_2 = _bearing_matrix["node1"]["node2"]
-        bearing_2_to_1 = _bearing_matrix["node2"]["node1"]
+        bearing_1_to_2 = bearings["node1"][1]
+        bearing_2_to_1 = bearings["node2"][0]
         assert 80 < bearing_1_to_2 < 100  # East direction
         assert 260 < bearing_2_to_1 < 280  # West direction
 
@@ -137,17 +149,6 @@ class TestFindNeighbors:
 
     def setup_method(self):
         """Setup test data."""
-        # Clear any existing data
-        from app.api.v3.endpoints.spheres import (
-            _spatial_index,
-            _distance_matrix,
-            _bearing_matrix,
-        )
-
-        _spatial_index.clear()
-        _distance_matrix.clear()
-        _bearing_matrix.clear()
-
         # Create test nodes in a circle around center
         center_lon, center_lat = 0.0, 0.0
         radius = 0.1  # Small radius for testing
@@ -185,14 +186,12 @@ class TestFindNeighbors:
         )
         self.nodes.append(self.center_node)
 
-        # Add nodes to spatial index and compute matrices
-        for node in self.nodes:
-            SpatialIndex.add_node(node)
-        SpatialIndex._compute_distance_and_bearing_matrices()
+        # Build the spatial index
+        self.index = SpatialIndex(self.nodes)
 
     def test_find_neighbors_basic(self):
         """Test basic neighbor finding."""
-        neighbors = SpatialIndex.find_neighbors(
+        neighbors = self.index.find_neighbors(
             self.center_node, max_range=20000, sectors=4
         )
 
@@ -207,13 +206,13 @@ class TestFindNeighbors:
     def test_find_neighbors_distance_filtering(self):
         """Test distance-based filtering."""
         # Very small range should find no neighbors
-        neighbors = SpatialIndex.find_neighbors(
+        neighbors = self.index.find_neighbors(
             self.center_node, max_range=100, sectors=4
         )
         assert len(neighbors) == 0
 
         # Large range should find all neighbors
-        neighbors = SpatialIndex.find_neighbors(
+        neighbors = self.index.find_neighbors(
             self.center_node, max_range=20000, sectors=4
         )
         assert len(neighbors) == 4
@@ -221,10 +220,10 @@ class TestFindNeighbors:
     def test_find_neighbors_sector_filtering(self):
         """Test sector-based filtering."""
         # With 8 sectors, should get fewer neighbors due to angular separation
-        neighbors_4 = SpatialIndex.find_neighbors(
+        neighbors_4 = self.index.find_neighbors(
             self.center_node, max_range=20000, sectors=4
         )
-        neighbors_8 = SpatialIndex.find_neighbors(
+        neighbors_8 = self.index.find_neighbors(
             self.center_node, max_range=20000, sectors=8
         )
 
@@ -237,17 +236,17 @@ class TestFindNeighbors:
     def test_find_neighbors_angular_separation(self):
         """Test that neighbors have minimum angular separation."""
         sectors = 4
-        neighbors = SpatialIndex.find_neighbors(
+        neighbors = self.index.find_neighbors(
             self.center_node, max_range=20000, sectors=sectors
         )
 
         if len(neighbors) >= 2:
             # Get bearings of selected neighbors
             bearings = []
-            from app.api.v3.endpoints.spheres import _bearing_matrix
-
             for neighbor in neighbors:
-                bearing = _bearing_matrix[self.center_node.id][neighbor.id]
+                bearing = SpatialIndex._calculate_bearing(
+                    *self.center_node.gps, *neighbor.gps
+                )
                 bearings.append(bearing)
 
             # Check minimum separation
@@ -277,5 +276,360 @@ class TestFindNeighbors:
 
         invalid_node = MockSphereNodePanorama()
 
-        neighbors = SpatialIndex.find_neighbors(invalid_node, max_range=1000, sectors=4)
+        neighbors = self.index.find_neighbors(invalid_node, max_range=1000, sectors=4)
         assert len(neighbors) == 0
+
+
+class TestGridSearch:
+    """Test cases for the candidates search in the grid cells."""
+
+    def setup_method(self):
+        """Scatter nodes around Svalbard and at both poles and the antimeridian."""
+        rng = np.random.default_rng(0)
+        positions = np.column_stack(
+            [rng.uniform(10.0, 20.0, 500), rng.uniform(77.0, 80.0, 500)]
+        ).tolist()
+        positions += [[179.99, 0.0], [-179.99, 0.0], [0.0, 90.0], [90.0, 89.99]]
+        self.index = SpatialIndex(
+            SphereNodePanorama(
+                id=f"node_{i}",
+                gps=gps,
+                panorama=f"https://example.com/pano{i}.jpg",
+                thumbnail=f"https://example.com/thumb{i}.jpg",
+                links=[],
+            )
+            for i, gps in enumerate(positions)
+        )
+
+    def test_candidates_are_local(self):
+        """Test that only the nodes of the cells around are examined."""
+        candidates = self.index.candidates("node_0", 10000)
+        assert 0 < len(candidates) < len(self.index)
+        assert 0 in candidates
+        assert (np.diff(candidates) > 0).all()
+
+    def test_same_neighbors_as_full_scan(self):
+        """Test that the candidates include every node within range."""
+        for node_id in ["node_0", "node_1", "node_500", "node_501", "node_502"]:
+            for max_range in [0, 2000, 10000, 50000]:
+                distances, _ = self.index.distances_and_bearings(node_id)
+                within_range = np.flatnonzero(distances <= max_range)
+                candidates = self.index.candidates(node_id, max_range)
+                assert set(within_range) <= set(candidates)
+
+    def test_antimeridian_and_poles(self):
+        """Test neighbors across the antimeridian and around the pole."""
+        node = self.index.nodes["node_500"]  # 179.99E on the equator
+        neighbors = self.index.find_neighbors(node, max_range=5000, sectors=4)
+        assert [neighbor.id for neighbor in neighbors] == ["node_501"]
+
+        node = self.index.nodes["node_502"]  # North pole
+        neighbors = self.index.find_neighbors(node, max_range=5000, sectors=4)
+        assert [neighbor.id for neighbor in neighbors] == ["node_503"]
+
+    def test_invalid_range(self):
+        """Test negative and NaN ranges."""
+        assert len(self.index.candidates("node_0", -1)) == 0
+        assert len(self.index.candidates("node_0", float("nan"))) == 0
+
+
+def make_node(node_id: str, lon: float = 15.0, lat: float = 78.0):
+    return SphereNodePanorama(
+        id=node_id,
+        gps=[lon, lat],
+        panorama=f"https://example.com/{node_id}.jpg",
+        thumbnail=f"https://example.com/{node_id}_thumb.jpg",
+        links=[],
+    )
+
+
+class TestIndexRefresh:
+    """Test cases for the background refresh of the sphere index."""
+
+    @pytest.fixture(autouse=True)
+    def reset_index(self, monkeypatch, tmp_path):
+        self.fetches = 0
+
+        async def get_all_sphere_nodes(force_refresh=False):
+            self.fetches += 1
+            await asyncio.sleep(0.01)
+            if isinstance(self.nodes, Exception):
+                raise self.nodes
+            return self.nodes
+
+        monkeypatch.setattr(spheres, "get_all_sphere_nodes", get_all_sphere_nodes)
+        monkeypatch.setattr(spheres, "_sphere_index", None)
+        monkeypatch.setattr(spheres, "SNAPSHOT_PATH", tmp_path / "index.npz")
+        monkeypatch.setattr(spheres, "_geojson_cache", {})
+
+    def test_cold_start_loads_once(self):
+        """Test concurrent requests waiting for the first index."""
+        self.nodes = [make_node("a"), make_node("b", lon=15.01)]
+
+        async def run():
+            return await asyncio.gather(
+                *[spheres.ensure_data_loaded() for _ in range(5)]
+            )
+
+        indexes = asyncio.run(run())
+        assert self.fetches == 1
+        assert all(index is indexes[0] for index in indexes)
+        assert sorted(indexes[0].nodes) == ["a", "b"]
+
+    def test_stale_index_served_while_refreshing(self):
+        """Test stale-while-revalidate."""
+        stale = SpatialIndex([make_node("old")])
+        stale.built_at -= spheres.CACHE_TTL
+        spheres._sphere_index = stale
+        self.nodes = [make_node("new")]
+
+        async def run():
+            served = await spheres.ensure_data_loaded()
+            # A single refresh for concurrent requests
+            assert await spheres.ensure_data_loaded() is stale
+            await spheres.schedule_refresh()
+            return served, await spheres.ensure_data_loaded()
+
+        served, refreshed = asyncio.run(run())
+        assert served is stale
+        assert list(refreshed.nodes) == ["new"]
+        assert self.fetches == 1
+
+    def test_failed_refresh_keeps_index(self):
+        """Test that the current index is kept when the refresh fails."""
+        stale = SpatialIndex([make_node("old")])
+        stale.built_at -= spheres.CACHE_TTL
+        spheres._sphere_index = stale
+        self.nodes = RuntimeError("upstream down")
+
+        async def run():
+            await spheres.ensure_data_loaded()
+            await asyncio.gather(spheres.schedule_refresh(), return_exceptions=True)
+            return await spheres.ensure_data_loaded()
+
+        assert asyncio.run(run()) is stale
+
+    def test_empty_index_retried_sooner(self):
+        """Test that an index without nodes is stale after RETRY_INTERVAL."""
+        index = SpatialIndex([])
+        assert not index.is_stale()
+        index.built_at -= spheres.RETRY_INTERVAL + timedelta(seconds=1)
+        assert index.is_stale()
+        assert not SpatialIndex([make_node("a")]).is_stale()
+
+
+class TestGeojsonFetch:
+    """Test cases for the fetch of the sphere GeoJSON."""
+
+    @pytest.fixture(autouse=True)
+    def reset_cache(self, monkeypatch):
+        self.fetches = 0
+
+        async def fetch_geojson(url):
+            self.fetches += 1
+            await asyncio.sleep(0.01)
+            return {"type": "FeatureCollection", "features": []}
+
+        monkeypatch.setattr(spheres, "_fetch_geojson", fetch_geojson)
+        monkeypatch.setattr(spheres, "_geojson_cache", {})
+
+    def test_concurrent_fetches_coalesced(self):
+        """Test that concurrent callers share a single fetch per URL."""
+
+        async def run():
+            return await asyncio.gather(
+                *[
+                    spheres.fetch_geojson_from_url("https://example.com/a.geojson")
+                    for _ in range(20)
+                ],
+                spheres.fetch_geojson_from_url("https://example.com/b.geojson"),
+            )
+
+        results = asyncio.run(run())
+        assert self.fetches == 2
+        assert all(result["type"] == "FeatureCollection" for result in results)
+
+
+class TestUpstreamFetch:
+    """Test cases for the requests to the sphere sources."""
+
+    @pytest.fixture(autouse=True)
+    def reset_cache(self, monkeypatch):
+        self.requests = []
+
+        def handler(request):
+            self.requests.append(request)
+            if request.headers.get("If-None-Match") == '"v1"':
+                return httpx.Response(304)
+            return httpx.Response(
+                200,
+                json={"type": "FeatureCollection", "features": []},
+                headers={"ETag": '"v1"'},
+            )
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(spheres, "get_http_client", lambda: client)
+        monkeypatch.setattr(spheres, "_geojson_cache", {})
+        monkeypatch.setattr(spheres, "_cache_timestamp", {})
+        monkeypatch.setattr(spheres, "_geojson_validators", {})
+
+    def test_conditional_request(self):
+        """Test that unchanged data is revalidated instead of downloaded."""
+        url = "https://example.com/spheres.geojson"
+
+        async def run():
+            first = await spheres.fetch_geojson_from_url(url, force_refresh=True)
+            second = await spheres.fetch_geojson_from_url(url, force_refresh=True)
+            return first, second
+
+        first, second = asyncio.run(run())
+        assert "If-None-Match" not in self.requests[0].headers
+        assert self.requests[1].headers["If-None-Match"] == '"v1"'
+        assert second is first
+
+    def test_projects_fetched_concurrently(self, monkeypatch):
+        """Test that the projects are fetched in parallel, in their order."""
+
+        async def fetch_geojson(url, force_refresh=False):
+            await asyncio.sleep(0.2)
+            if url.endswith("broken"):
+                raise RuntimeError("unavailable")
+            feature = {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [15.0, 78.0]},
+                "properties": {"id": url, "filename": "a.jpg", "thumbnail": "a.png"},
+            }
+            return {"type": "FeatureCollection", "features": [feature]}
+
+        monkeypatch.setattr(spheres, "fetch_geojson_from_url", fetch_geojson)
+        monkeypatch.setattr(
+            spheres,
+            "SphereProjectLinks",
+            {
+                name: {"geojson_url": name, "base_url": "https://example.com/"}
+                for name in ["first", "broken", "second", "third"]
+            },
+        )
+
+        start = time.perf_counter()
+        nodes = asyncio.run(spheres.get_all_sphere_nodes())
+        assert time.perf_counter() - start < 0.6
+        assert [node.id for node in nodes] == ["first", "second", "third"]
+
+
+class TestIndexSnapshot:
+    """Test cases for the on-disk snapshot of the sphere index."""
+
+    URL = "https://example.com/spheres.geojson"
+
+    @pytest.fixture(autouse=True)
+    def reset_index(self, monkeypatch, tmp_path):
+        self.path = tmp_path / "index.npz"
+        self.fetches = 0
+
+        async def get_all_sphere_nodes(force_refresh=False):
+            self.fetches += 1
+            return self.nodes
+
+        monkeypatch.setattr(spheres, "get_all_sphere_nodes", get_all_sphere_nodes)
+        monkeypatch.setattr(spheres, "SNAPSHOT_PATH", self.path)
+        monkeypatch.setattr(spheres, "_sphere_index", None)
+        monkeypatch.setattr(spheres, "_geojson_cache", {})
+        monkeypatch.setattr(spheres, "_cache_timestamp", {})
+        monkeypatch.setattr(spheres, "_geojson_validators", {})
+        monkeypatch.setattr(
+            spheres,
+            "SphereProjectLinks",
+            {"Test": {"geojson_url": self.URL, "base_url": "https://example.com/"}},
+        )
+
+    def test_round_trip(self):
+        """Test that a loaded index answers like the saved one."""
+        nodes = [
+            make_node(str(i), lon=15.0 + 0.01 * (i % 7), lat=78.0 + 0.01 * (i // 7))
+            for i in range(50)
+        ]
+        index = SpatialIndex(nodes)
+        index.save(self.path, {self.URL: {"geojson": {}, "validators": {}}})
+
+        loaded, sources = SpatialIndex.load(self.path)
+        assert loaded.node_ids == index.node_ids
+        assert loaded.built_at == index.built_at
+        assert sources == {self.URL: {"geojson": {}, "validators": {}}}
+        for name in spheres._SNAPSHOT_ARRAYS:
+            np.testing.assert_array_equal(getattr(loaded, name), getattr(index, name))
+        for node in nodes:
+            assert loaded.find_neighbors(node, 2000, 5) == index.find_neighbors(
+                node, 2000, 5
+            )
+
+    def test_warm_start(self):
+        """Test that a worker starts from the snapshot without fetching."""
+        geojson = {"type": "FeatureCollection", "features": []}
+        spheres._geojson_cache[self.URL] = geojson
+        spheres._geojson_validators[self.URL] = {"etag": '"v1"'}
+        self.nodes = [make_node("a"), make_node("b", lon=15.01)]
+        asyncio.run(spheres.refresh_sphere_index())
+        assert self.path.exists()
+
+        # A new worker
+        spheres._sphere_index = None
+        spheres._geojson_cache.clear()
+        spheres._geojson_validators.clear()
+        index = asyncio.run(spheres.ensure_data_loaded())
+        assert self.fetches == 1
+        assert sorted(index.nodes) == ["a", "b"]
+        # The sources are revalidated, and used when upstream is down
+        assert spheres._geojson_cache[self.URL] == geojson
+        assert spheres._geojson_validators[self.URL] == {"etag": '"v1"'}
+
+    def test_empty_index_not_saved(self):
+        """Test that a refresh without any node keeps the snapshot."""
+        self.nodes = [make_node("a")]
+        asyncio.run(spheres.refresh_sphere_index())
+        self.nodes = []
+        asyncio.run(spheres.refresh_sphere_index())
+        index, _ = SpatialIndex.load(self.path)
+        assert index.node_ids == ["a"]
+
+    def test_unreadable_snapshot(self):
+        """Test that an unreadable snapshot is ignored."""
+        self.path.write_bytes(b"not a snapshot")
+        self.nodes = [make_node("a")]
+        assert spheres.load_snapshot() is None
+        index = asyncio.run(spheres.ensure_data_loaded())
+        assert self.fetches == 1
+        assert index.node_ids == ["a"]
+
+
+class TestNavigationGraph:
+    """Test cases for the precomputed links of the sphere index."""
+
+    @pytest.fixture(autouse=True)
+    def setup_index(self):
+        rng = np.random.default_rng(0)
+        self.nodes = [
+            make_node(str(i), lon=lon, lat=lat)
+            for i, (lon, lat) in enumerate(
+                zip(rng.uniform(14.0, 16.0, 300), rng.uniform(77.5, 78.5, 300))
+            )
+        ]
+        self.index = SpatialIndex(self.nodes)
+
+    def test_default_links_precomputed(self):
+        """Test that the graph holds the neighbors for the default parameters."""
+        assert len(self.index.graph_starts) == len(self.nodes) + 1
+        for node in self.nodes:
+            expected = self.index.find_neighbors(
+                node, spheres.DEFAULT_MAX_RANGE, spheres.DEFAULT_SECTORS
+            )
+            assert self.index.links(node.id, 10000, 5) == expected
+        assert len(self.index._links) == 0
+
+    def test_other_links_cached(self):
+        """Test that the links for other parameters are computed once."""
+        node = self.nodes[0]
+        links = self.index.links(node.id, 5000, 8)
+        assert links == self.index.find_neighbors(node, 5000, 8)
+        assert self.index.links(node.id, 5000, 8) is links
+        assert len(self.index._links) == 1
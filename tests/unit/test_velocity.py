@@ -0,0 +1,232 @@
+"""
+Unit tests for the leaflet-velocity grids subsetting.
+"""
+
+import gzip
+import json
+import os
+
+import numpy as np
+import pytest
+
+from app.utils.velocity import (
+    BINARY_MAGIC,
+    VelocityGrid,
+    binary_path,
+    decode_velocity,
+    decode_velocity_binary,
+    encode_velocity,
+    encode_velocity_binary,
+    parse_bbox,
+    sample_bilinear,
+    snap_bbox,
+    stride_for_zoom,
+    subset_velocity,
+    wind_components,
+    wind_speed_direction,
+    write_velocity_binary,
+)
+
+
+def make_grid(north_to_south: bool = True) -> VelocityGrid:
+    """A 5x4 grid from 10E to 13E, 0.75 degrees apart, between 78N and 79N."""
+    header = {"nx": 5, "ny": 4, "lo1": 10.0, "lo2": 13.0, "dx": 0.75, "dy": 1 / 3}
+    header["la1"], header["la2"] = (79.0, 78.0) if north_to_south else (78.0, 79.0)
+    header["numberPoints"] = 20
+    return VelocityGrid(header, np.arange(20, dtype=float).reshape(4, 5))
+
+
+class TestDecoding:
+    """Test cases for decoding and encoding the velocity files."""
+
+    def test_round_trip(self):
+        content = json.dumps(
+            [{"header": {"nx": 2, "ny": 2}, "data": [1, None, "2.5", 4]}]
+        ).encode()
+        grids = decode_velocity(content)
+        assert grids[0].data.shape == (2, 2)
+        assert np.isnan(grids[0].data[0, 1])
+        assert json.loads(encode_velocity(grids))[0]["data"] == [1.0, None, 2.5, 4.0]
+
+
+class TestSubsetting:
+    """Test cases for subset_velocity."""
+
+    def test_bbox(self):
+        (subset,) = subset_velocity([make_grid()], (10.5, 78.2, 12.0, 78.7))
+        # Columns at 10.75, 11.5 and rows at 78.667, 78.333
+        assert subset.data.tolist() == [[6.0, 7.0], [11.0, 12.0]]
+        assert subset.header["lo1"] == 10.75
+        assert subset.header["lo2"] == 11.5
+        assert subset.header["la1"] == pytest.approx(78 + 2 / 3)
+        assert subset.header["la2"] == pytest.approx(78 + 1 / 3)
+        assert subset.header["nx"] == 2
+        assert subset.header["ny"] == 2
+        assert subset.header["numberPoints"] == 4
+
+    def test_south_to_north(self):
+        (subset,) = subset_velocity([make_grid(False)], (10.5, 78.2, 12.0, 78.7))
+        assert subset.data.tolist() == [[6.0, 7.0], [11.0, 12.0]]
+        assert subset.header["la1"] == pytest.approx(78 + 1 / 3)
+        assert subset.header["la2"] == pytest.approx(78 + 2 / 3)
+
+    def test_stride(self):
+        (subset,) = subset_velocity([make_grid()], stride=2)
+        assert subset.data.tolist() == [[0.0, 2.0, 4.0], [10.0, 12.0, 14.0]]
+        assert subset.header["dx"] == 1.5
+        assert subset.header["lo2"] == 13.0
+        assert subset.header["la2"] == pytest.approx(78 + 1 / 3)
+
+    def test_bbox_outside_grid(self):
+        assert subset_velocity([make_grid()], (20.0, 70.0, 21.0, 71.0)) is None
+
+    def test_bbox_edges_included(self):
+        (subset,) = subset_velocity([make_grid()], (10.0, 78.0, 13.0, 79.0))
+        assert subset.data.shape == (4, 5)
+
+    @pytest.mark.parametrize("nx", [360, 361])
+    @pytest.mark.parametrize("west, east", [(-10.0, 10.0), (350.0, 370.0)])
+    def test_bbox_across_seam(self, nx, west, east):
+        """Test a bounding box crossing the seam of a global 1 degree grid."""
+        header = {"nx": nx, "ny": 2, "lo1": 0.0, "la1": 1.0, "dx": 1.0, "dy": 1.0}
+        header["la2"] = 0.0
+        data = np.tile(np.arange(nx, dtype=float) % 360, (2, 1))
+        (subset,) = subset_velocity([VelocityGrid(header, data)], (west, 0, east, 1))
+        expected = list(range(350, 360)) + list(range(0, 11))
+        assert subset.data[0].tolist() == expected
+        assert subset.header["lo1"] == west
+        assert subset.header["lo2"] == east
+        assert subset.header["nx"] == 21
+
+        (subset,) = subset_velocity(
+            [VelocityGrid(header, data)], (west, 0, east, 1), stride=5
+        )
+        assert subset.data[0].tolist() == [350.0, 355.0, 0.0, 5.0, 10.0]
+        assert subset.header["lo2"] == east
+
+
+class TestBoundingBox:
+    """Test cases for the bounding box helpers."""
+
+    def test_parse(self):
+        assert parse_bbox("10,78,20.5,80") == (10.0, 78.0, 20.5, 80.0)
+        for invalid in ("10,78,20", "20,78,10,80", "10,80,20,78", "10,78,20,91", "a"):
+            with pytest.raises(ValueError):
+                parse_bbox(invalid)
+
+    def test_snap(self):
+        assert snap_bbox((10.2, 78.5, 11.7, 79.1)) == (10.0, 78.0, 12.0, 80.0)
+        assert snap_bbox((-0.5, 89.5, 0.5, 90.0)) == (-1.0, 89.0, 1.0, 90.0)
+
+    def test_stride_for_zoom(self):
+        header = {"nx": 100, "ny": 100, "lo1": 0.0, "la1": 80.0, "dx": 0.025}
+        header["dy"] = 0.025
+        assert stride_for_zoom(header, 3) > stride_for_zoom(header, 6)
+        assert stride_for_zoom(header, 20) == 1
+
+
+class TestBinaryEncoding:
+    """Test cases for the binary velocity format."""
+
+    def test_round_trip(self):
+        data = np.array([[-12.5, 0.0, np.nan], [3.25, 20.0, -0.01]])
+        grids = [VelocityGrid({"nx": 3, "ny": 2, "parameterNumber": 2}, data)]
+        content = encode_velocity_binary(grids)
+        assert content.startswith(BINARY_MAGIC)
+        # The values are aligned on 8 bytes and stored on 2 bytes each
+        assert (len(content) - data.size * 2) % 8 == 0
+
+        (decoded,) = decode_velocity_binary(content)
+        assert decoded.header == grids[0].header
+        assert np.isnan(decoded.data[0, 2])
+        resolution = 32.5 / 65534
+        np.testing.assert_allclose(
+            decoded.data[np.isfinite(data)], data[np.isfinite(data)], atol=resolution
+        )
+
+    def test_constant_and_missing_grids(self):
+        grids = [
+            VelocityGrid({"nx": 2, "ny": 1}, np.array([[5.0, 5.0]])),
+            VelocityGrid({"nx": 2, "ny": 1}, np.array([[np.nan, np.nan]])),
+        ]
+        constant, missing = decode_velocity_binary(encode_velocity_binary(grids))
+        assert constant.data.tolist() == [[5.0, 5.0]]
+        assert np.isnan(missing.data).all()
+
+    def test_invalid_content(self):
+        with pytest.raises(ValueError):
+            decode_velocity_binary(b"{}")
+
+    def test_write_once(self, tmp_path):
+        path = tmp_path / "aa_wind_2023-01-01T000000Z.json.gz"
+        content = [{"header": {"nx": 2, "ny": 1}, "data": [1.5, -2]}]
+        path.write_bytes(gzip.compress(json.dumps(content).encode()))
+
+        sibling = write_velocity_binary(path, os.stat(path))
+        assert sibling == binary_path(path)
+        assert sibling.name == "aa_wind_2023-01-01T000000Z.swiv.gz"
+        (grid,) = decode_velocity_binary(gzip.decompress(sibling.read_bytes()))
+        np.testing.assert_allclose(grid.data, [[1.5, -2.0]], atol=1e-4)
+
+        # Up to date: not written again
+        written = sibling.stat().st_mtime_ns
+        sibling.write_bytes(b"kept")
+        os.utime(sibling, ns=(written, written))
+        write_velocity_binary(path, os.stat(path))
+        assert sibling.read_bytes() == b"kept"
+
+    def test_write_removes_orphans(self, tmp_path):
+        """Test that writing a sibling deletes those of removed velocity files."""
+        path = tmp_path / "aa_wind_2023-01-01T000000Z.json.gz"
+        content = [{"header": {"nx": 2, "ny": 1}, "data": [1.5, -2]}]
+        path.write_bytes(gzip.compress(json.dumps(content).encode()))
+        kept = tmp_path / "aa_wind_2023-01-01T000000Z.json.br"
+        kept.touch()
+        orphans = [
+            tmp_path / "aa_wind_2022-12-31T180000Z.json.br",
+            tmp_path / "aa_wind_2022-12-31T180000Z.json.zst",
+            tmp_path / "aa_wind_2022-12-31T180000Z.swiv.gz",
+        ]
+        for orphan in orphans:
+            orphan.touch()
+        (tmp_path / ".tmp1234.tmp").touch()
+
+        write_velocity_binary(path, os.stat(path))
+        assert kept.exists()
+        assert not any(orphan.exists() for orphan in orphans)
+        assert (tmp_path / ".tmp1234.tmp").exists()
+
+
+class TestPointSampling:
+    """Test cases for the point sampling of the grids."""
+
+    def test_bilinear(self):
+        grid = make_grid()
+        # Grid points
+        assert sample_bilinear(grid, 79.0, 10.0) == 0.0
+        assert sample_bilinear(grid, 78.0, 13.0) == 19.0
+        # Between 4 points: rows 0-1 and columns 0-1
+        assert sample_bilinear(grid, 79 - 1 / 6, 10.375) == pytest.approx(3.0)
+        # Longitudes in [0, 360]
+        assert sample_bilinear(grid, 79.0, 10.0 + 360) == 0.0
+
+    def test_outside_or_missing(self):
+        grid = make_grid()
+        assert sample_bilinear(grid, 77.5, 11.0) is None
+        assert sample_bilinear(grid, 78.5, 14.0) is None
+        grid.data[0, 0] = np.nan
+        assert sample_bilinear(grid, 79.0, 10.2) is None
+
+    def test_wind_components(self):
+        u = VelocityGrid({"parameterNumber": 2}, np.zeros((1, 1)))
+        v = VelocityGrid({"parameterNumber": 3}, np.zeros((1, 1)))
+        assert wind_components([v, u]) == (u, v)
+        with pytest.raises(ValueError):
+            wind_components([u])
+
+    def test_speed_direction(self):
+        # Wind blowing to the north comes from the south
+        assert wind_speed_direction(0.0, 5.0) == (5.0, 180.0)
+        speed, direction = wind_speed_direction(-3.0, 0.0)
+        assert speed == 3.0
+        assert direction == pytest.approx(90.0)